@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# *-* coding: utf-8 *-*
+
+# Micro-benchmark of the GDSII real codec (float2gds/gds2float and their vectorized versions)
+# Usage: python benchmarks/codec.py [N]
+# The round-trip of random values over the whole exponent range is checked before timing.
+
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+import gds
+
+def values(N, seed=0):
+	rng=np.random.RandomState(seed)
+	x=np.ldexp(rng.uniform(-1,1,N),rng.randint(-255,252,N))
+	x[:8]=[0.0,-0.0,1.0,-1.0,0.001,1e-9,16.0**-65,5e-324]
+	return x
+
+def check(x):
+	enc=gds.floats2gds(x)
+	dec=gds.gds2floats(enc)
+	ok=np.abs(x)>=16.0**-65
+	assert np.array_equal(dec[ok],x[ok]), "vectorized round-trip failed"
+	# Below 16**-65 GDSII reals are denormalized with a resolution of 2**-312
+	assert (np.abs(dec[~ok]-x[~ok])<2.0**-312).all(), "wrong denormalized values"
+	raw=enc.tobytes()
+	assert b''.join(gds.float2gds(v) for v in x)==raw, "scalar and vectorized encoders differ"
+	assert all(gds.gds2float(raw[8*i:8*i+8])==dec[i] for i in range(len(x))), "scalar and vectorized decoders differ"
+
+def bench(x, repeat=5):
+	raw=gds.floats2gds(x).tobytes()
+	xl=x.tolist()
+	chunks=[raw[8*i:8*i+8] for i in range(len(x))]
+	tests=[
+		("float2gds (scalar)",lambda: [gds.float2gds(v) for v in xl]),
+		("floats2gds",lambda: gds.floats2gds(x).tobytes()),
+		("gds2float (scalar)",lambda: [gds.gds2float(v) for v in chunks]),
+		("gds2floats",lambda: gds.gds2floats(raw))]
+	for name,f in tests:
+		t=min(timeit.repeat(f,number=1,repeat=repeat))
+		print("%-20s %10.1f ns/value"%(name,1e9*t/len(x)))
+
+if __name__=='__main__':
+	N=int(sys.argv[1]) if len(sys.argv)>1 else 100000
+	x=values(N)
+	check(x)
+	bench(x)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# *-* coding: utf-8 *-*
+
+# Micro-benchmark of the per-record overhead (type lookup and encoding)
+# Usage: python benchmarks/records.py [N]
+# The "linear" rows replay the former getType (search over Type.values() then over Type)
+# to compare with the registry lookup.
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+import gds
+
+def linearGetType(Type, t):
+	if t in Type.values():
+		for x in Type:
+			if t==Type[x]:
+				return x
+	else: return t
+
+class Null:
+	def write(self, data):
+		pass
+	def flush(self):
+		pass
+	closed=False
+
+def bench(N, repeat=5):
+	g=gds.GDSII()
+	Type=gds.GDSII.Type
+	names=['BOUNDARY','LAYER','DATATYPE','XY','FBMS',b'\x11\x00']
+	w=gds.GDSII()
+	w.f=gds.GDSWriter(Null())
+	w.newStr('A')
+	tests=[
+		("getType (linear)",lambda: [linearGetType(Type,t) for t in names],len(names)),
+		("getType (registry)",lambda: [g.getType(t) for t in names],len(names)),
+		("encodeObj LAYER",lambda: g.encodeObj('LAYER',1),1),
+		("encodeObj MAG",lambda: g.encodeObj('MAG',2.0),1),
+		("encodeObj XY (5 pts)",lambda: g.encodeObj('XY',[0,0,0,1,1,1,1,0,0,0]),1),
+		("addObj LAYER",lambda: w.addObj('LAYER',1),1),
+		("addRect (6 records)",lambda: w.addRect([0,0,10,10]),6)]
+	for name,f,n in tests:
+		t=min(timeit.repeat(f,number=N,repeat=repeat))
+		print("%-22s %10.1f ns/record"%(name,1e9*t/N/n))
+
+if __name__=='__main__':
+	bench(int(sys.argv[1]) if len(sys.argv)>1 else 20000)
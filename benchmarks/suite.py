@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# *-* coding: utf-8 *-*
+
+# Throughput benchmarks on the synthetic libraries of synth.py
+# Usage: python benchmarks/suite.py [-s SCALE] [-k KIND]... [-o results.json] [-c baseline.json]
+#
+# For each library (flat, hier, aref, paths, elements) the DirectWrite generation, the in-memory
+# generation + write, open, getLobjs, flatten and the geometry helpers are timed (best of -r runs),
+# as well as the DirectWrite generation by each per-element helper (addRect, addPoly, addLine, addDisk)
+# and their peak memory measured with tracemalloc in a separate run. The results (records/s,
+# MB/s, elements/s, peak MB) are saved as JSON and compared to a baseline: the benchmarks slower
+# than the baseline by more than the threshold are reported and the exit code is 1.
+# benchmarks/baseline.json holds the results of the default run (scale 1) on the reference machine,
+# times are only comparable on the same machine. Its per-element cases (elements/generate,
+# elements/generate+write and elements/add*) were run with the writer preceding the batch APIs.
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+import gds
+import gdsflat
+import synth
+
+def measure(f, repeat=3):
+	"""
+	Return the best time of repeat calls of f and the peak memory (bytes) of one more call
+	"""
+	best=float('inf')
+	for i in range(repeat):
+		t=time.perf_counter()
+		f()
+		best=min(best,time.perf_counter()-t)
+	tracemalloc.start()
+	f()
+	peak=tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return best,peak
+
+def result(t, peak, records=None, size=None, elements=None):
+	r={'time':t,'peak_MB':peak/2.0**20}
+	if records is not None:
+		r['records']=records
+		r['records/s']=records/t
+	if size is not None:
+		r['MB/s']=size/2.0**20/t
+	if elements is not None:
+		r['elements']=elements
+		r['elements/s']=elements/t
+	return r
+
+def benchLibrary(kind, scale, tmp, repeat=3):
+	"""
+	Run the benchmarks on the synthetic library kind, return {benchmark name: result}
+	"""
+	path=os.path.join(tmp,kind+".gds")
+	r={}
+	t,peak=measure(lambda: synth.make(kind,path,scale),repeat)
+	top=synth.make(kind,path,scale)[1]
+	size=os.path.getsize(path)
+	lib=gds.GDSII()
+	lib.open(path)
+	records=len(lib.objs)
+	r['generate']=result(t,peak,records,size)
+	def build():
+		g,top=synth.make(kind,None,scale)
+		g.write(path+".mem")
+	t,peak=measure(build,repeat)
+	r['generate+write']=result(t,peak,records,size)
+	t,peak=measure(lambda: gds.GDSII().open(path),repeat)
+	r['open']=result(t,peak,records,size)
+	t,peak=measure(lambda: lib.getLobjs(),repeat)
+	r['getLobjs']=result(t,peak,records)
+	n=[0]
+	def flatten():
+		n[0]=len(gdsflat.flatten(lib,top))
+	t,peak=measure(flatten,repeat)
+	r['flatten']=result(t,peak,elements=n[0])
+	f=gdsflat.flatten(lib,top)
+	if len(f):
+		polys=f.take(np.nonzero(f.kind!=gdsflat.PATH)[0])
+		if len(polys):
+			r['closeShapes+getAreas']=result(*measure(lambda: gds.getAreas(*gds.closeShapes(polys.pts,polys.starts)),repeat),elements=len(polys))
+		r['getLengths']=result(*measure(lambda: gds.getLengths(f.pts,f.starts),repeat),elements=len(f))
+		g=gds.GDSII()
+		g.uvRotate(30)
+		r['uv2xyArray']=result(*measure(lambda: g.uv2xyArray(f.pts),repeat),elements=len(f))
+		r['normalizeShapes']=result(*measure(lambda: gds.normalizeShapes(f.pts,f.starts,False),repeat),elements=len(f))
+	os.remove(path+".mem")
+	return r
+
+def benchElements(scale, tmp, repeat=3):
+	"""
+	Time the DirectWrite generation by each per-element helper of synth.HELPERS, return {helper: result}
+	"""
+	path=os.path.join(tmp,"helper.gds")
+	r={}
+	for helper in synth.HELPERS:
+		n=[0]
+		def generate():
+			g=gds.GDSII(path)
+			g.new('ELEMENTS')
+			g.newStr('TOP')
+			n[0]=synth.perElement(g,helper,scale)
+			g.endStr()
+			g.endLib()
+			g.close()
+		t,peak=measure(generate,repeat)
+		r[helper]=result(t,peak,size=os.path.getsize(path),elements=n[0])
+	os.remove(path)
+	return r
+
+def run(scale=1, kinds=None, repeat=3):
+	"""
+	Run the benchmarks, return the results with their environment
+	"""
+	kinds=kinds or list(synth.KINDS)
+	res={'scale':scale,'python':platform.python_version(),'numpy':np.__version__,
+		'machine':platform.machine(),'results':{}}
+	tmp=tempfile.mkdtemp()
+	try:
+		for kind in kinds:
+			bench=benchLibrary(kind,scale,tmp,repeat)
+			if kind=='elements':
+				bench.update(benchElements(scale,tmp,repeat))
+			for name,r in bench.items():
+				res['results']["%s/%s"%(kind,name)]=r
+				print("%-28s %8.3f s %s %8.1f MB"%(kind+"/"+name,r['time'],
+					" ".join("%12.4g %s"%(r[k],k) for k in ('records/s','MB/s','elements/s') if k in r),r['peak_MB']))
+	finally:
+		for f in os.listdir(tmp):
+			os.remove(os.path.join(tmp,f))
+		os.rmdir(tmp)
+	return res
+
+def compare(res, base, threshold=0.2, minTime=0.01):
+	"""
+	Print the time ratios of the results res to the baseline base.
+	Return the names of the benchmarks slower by more than threshold
+	(the benchmarks faster than minTime seconds are too noisy to be reported).
+	"""
+	if base.get('scale')!=res.get('scale'):
+		print("Warning: the baseline was run at the scale %s"%(base.get('scale')))
+	slow=[]
+	for name,r in sorted(res['results'].items()):
+		b=base['results'].get(name)
+		if b is None:
+			continue
+		ratio=r['time']/b['time']
+		mem=r['peak_MB']/b['peak_MB'] if b['peak_MB'] else 1
+		flag=""
+		if max(r['time'],b['time'])<minTime:
+			flag="(too short)"
+		elif ratio>1+threshold:
+			flag="SLOWER"
+			slow.append(name)
+		elif ratio<1/(1+threshold):
+			flag="faster"
+		print("%-28s time x%5.2f  peak memory x%5.2f %s"%(name,ratio,mem,flag))
+	return slow
+
+if __name__=='__main__':
+	parser=argparse.ArgumentParser(description="Throughput benchmarks of libgds on synthetic libraries")
+	parser.add_argument('-s','--scale',type=float,default=1,help="size of the synthetic libraries (default: 1)")
+	parser.add_argument('-k','--kind',action='append',choices=list(synth.KINDS),help="only run the library KIND (repeatable)")
+	parser.add_argument('-r','--repeat',type=int,default=3,help="number of timed runs (the best is kept)")
+	parser.add_argument('-o','--output',help="save the results to this JSON file")
+	parser.add_argument('-c','--compare',help="compare to the results of this JSON file (e.g. benchmarks/baseline.json)")
+	parser.add_argument('-t','--threshold',type=float,default=0.2,help="relative slowdown reported as a regression (default: 0.2)")
+	args=parser.parse_args()
+	res=run(args.scale,args.kind,args.repeat)
+	if args.output:
+		with open(args.output,"w") as f:
+			json.dump(res,f,indent=1,sort_keys=True)
+	if args.compare:
+		with open(args.compare) as f:
+			slow=compare(res,json.load(f),args.threshold)
+		if slow:
+			sys.exit(1)
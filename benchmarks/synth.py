@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# *-* coding: utf-8 *-*
+
+# Synthetic GDSII libraries for the benchmarks, written with the GDSII writer
+# Usage: python benchmarks/synth.py <kind> <file.gds> [scale]
+# kind: flat (polygons), hier (deep SREF hierarchy), aref (large AREF), paths (long paths),
+# elements (written one element at a time by addRect/addPoly/addLine/addDisk)
+# The libraries only depend on the kind, the scale and the seed, so the results are reproducible.
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+import gds
+
+def flat(g, scale=1, seed=0):
+	"""
+	One structure TOP of 100000*scale rectangles and 10000*scale 16-sided disks on 4 layers
+	"""
+	rng=np.random.RandomState(seed)
+	g.newStr('TOP')
+	N=int(100000*scale)
+	r=np.c_[rng.randint(0,10**7,(N,2)),rng.randint(100,5000,(N,2))]
+	g.addRects(r,layer=rng.randint(0,4,N),dose=rng.randint(1,20,N)/10.0)
+	N=int(10000*scale)
+	g.addDisks(rng.randint(0,10**7,(N,2)),rng.randint(100,3000,N),npts=16,layer=4)
+	g.endStr()
+	return 'TOP'
+
+def hier(g, scale=1, seed=0, depth=5, fanout=4):
+	"""
+	A hierarchy of depth levels: the leaf holds 1000*scale rectangles and each level
+	places fanout rotated references to the level below (fanout**depth leaves)
+	"""
+	rng=np.random.RandomState(seed)
+	g.newStr('L0')
+	N=int(1000*scale)
+	g.addRects(np.c_[rng.randint(0,10**5,(N,2)),rng.randint(100,2000,(N,2))])
+	g.endStr()
+	for d in range(1,depth+1):
+		g.newStr('L%i'%(d))
+		step=2*10**5*2**d
+		for k in range(fanout):
+			g.addSRef('L%i'%(d-1),(step*(k%2),step*(k//2)),angle=90*k)
+		g.endStr()
+	return 'L%i'%(depth)
+
+def aref(g, scale=1, seed=0):
+	"""
+	A cell of 100 rectangles placed by an AREF of 100x100*scale instances
+	"""
+	rng=np.random.RandomState(seed)
+	g.newStr('CELL')
+	g.addRects(np.c_[rng.randint(0,9000,(100,2)),rng.randint(10,1000,(100,2))])
+	g.endStr()
+	g.newStr('TOP')
+	g.addARef('CELL',(0,0),array=(100,int(100*scale)),spacing=(10000,10000))
+	g.endStr()
+	return 'TOP'
+
+def paths(g, scale=1, seed=0):
+	"""
+	1000*scale random walks of 2000 points written as paths
+	"""
+	rng=np.random.RandomState(seed)
+	g.newStr('TOP')
+	N=int(1000*scale)
+	steps=rng.randint(-500,501,(N,2000,2))
+	steps[:,0]=rng.randint(0,10**7,(N,2))
+	g.addLines(np.cumsum(steps,axis=1),width=rng.randint(10,100,N))
+	g.endStr()
+	return 'TOP'
+
+# Per-element helpers of the elements library
+HELPERS=('addRect','addPoly','addLine','addDisk')
+
+def perElement(g, helper, scale=1, seed=0):
+	"""
+	Write the elements of one per-element helper in the current structure: 20000*scale rectangles
+	(addRect), 5000*scale 16-sided polygons (addPoly), 5000*scale lines of 20 points (addLine)
+	or 5000*scale 32-sided disks (addDisk). Return the number of elements.
+	"""
+	rng=np.random.RandomState(seed)
+	if helper=='addRect':
+		N=int(20000*scale)
+		for x,y,w,h,l in np.c_[rng.randint(0,10**7,(N,2)),rng.randint(100,5000,(N,3))%[5000,5000,4]].tolist():
+			g.addRect([x,y,w,h],layer=l)
+		return N
+	N=int(5000*scale)
+	if helper=='addPoly':
+		t=np.linspace(0,2*np.pi,17)
+		for (x,y),r in zip(rng.randint(0,10**7,(N,2)).tolist(),rng.randint(100,3000,N).tolist()):
+			g.addPoly(np.c_[x+r*np.cos(t),y+r*np.sin(t)].astype(int).ravel().tolist(),layer=1)
+	elif helper=='addLine':
+		steps=rng.randint(-500,501,(N,20,2))
+		steps[:,0]=rng.randint(0,10**7,(N,2))
+		for p in np.cumsum(steps,axis=1).reshape(N,-1).tolist():
+			g.addLine(p,layer=2,width=50)
+	else:
+		for (x,y),r in zip(rng.randint(0,10**7,(N,2)).tolist(),rng.randint(10,3000,N).tolist()):
+			g.addDisk((x,y),r,npts=32,layer=3)
+	return N
+
+def elements(g, scale=1, seed=0):
+	"""
+	One structure TOP written one element at a time by each of the HELPERS (see perElement)
+	"""
+	g.newStr('TOP')
+	for helper in HELPERS:
+		perElement(g,helper,scale,seed)
+	g.endStr()
+	return 'TOP'
+
+KINDS={'flat':flat,'hier':hier,'aref':aref,'paths':paths,'elements':elements}
+
+def make(kind, path=None, scale=1, seed=0):
+	"""
+	Write the synthetic library kind to path (DirectWrite) or in memory if path is None.
+	Return (GDSII, name of the top structure)
+	"""
+	g=gds.GDSII(path)
+	g.new(kind.upper())
+	top=KINDS[kind](g,scale,seed)
+	g.endLib()
+	if path is not None:
+		g.close()
+	return g,top
+
+if __name__=='__main__':
+	make(sys.argv[1],sys.argv[2],float(sys.argv[3]) if len(sys.argv)>3 else 1)
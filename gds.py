@@ -17,6 +17,14 @@ import sys
 import binascii
 import math
 import os
+import mmap
+import json
+import io
+from collections import OrderedDict
+from functools import lru_cache
+from array import array
+from bisect import bisect_left
+import numpy as np
 
 def MatrVectMul(A,v):
 	if A==[[1,0],[0,1]]:
@@ -32,41 +40,87 @@ def MatrMatrMul(A,B):
 
 
 def float2gds(x):
-	if type(x)==float:
-		x=struct.pack('>d',x)
-	s=struct.unpack('>Q',x)[0]
-	sgn = (s&0x8000000000000000)
-	exp = (s&0x7ff0000000000000) >> 52
-	man = (s&0x000fffffffffffff)
-	man =man|0x0010000000000000
-	ee=(exp-1023)
-	e=65+(ee>>2)
-	m=man<<ee%4
-	f=(sgn) | (e<<56) | m
-	r=struct.pack('>Q',f)
-	return r
+	"""
+	Convert a number (or a big-endian packed double) to a GDSII 8-bytes real (excess-64, base 16)
+	Scalar fast path of floats2gds.
+	"""
+	if isinstance(x,bytes):
+		x=struct.unpack('>d',x)[0]
+	x=float(x)
+	if x==0:
+		return b'\x00'*8
+	m,e=math.frexp(abs(x))
+	# |x| = m*2**e = (m*2**(e-4k))*16**k with 1/16 <= m*2**(e-4k) < 1
+	k=-(-e//4)
+	man=int(m*9007199254740992)<<(3+e-4*k)
+	e=k+64
+	if e<0:
+		# Too small for a normalized GDSII real
+		man>>=-4*e
+		e=0
+		if man==0:
+			# Flushed to zero, without sign like floats2gds
+			return b'\x00'*8
+	elif e>127:
+		raise OverflowError("%r is out of the range of GDSII reals"%(x))
+	return struct.pack('>Q',((x<0)<<63)|(e<<56)|man)
 
 def gds2float(x):
+	"""
+	Convert a GDSII 8-bytes real (excess-64, base 16) to a float
+	Scalar fast path of gds2floats.
+	"""
 	s=struct.unpack('>Q',x)[0]
-	sgn=(s&0x8000000000000000)
-	exp=(s&0x7f00000000000000) >> 56
-	man=(s&0x00ffffffffffffff)
-	e=1023+((exp-64)<<2)
-	if ((man&0x00e0000000000000) >> 53) == 0:
-		man = (man&0x000fffffffffffff)
-		e-=4
-	elif ((man&0x00c0000000000000) >> 54) == 0:
-		man = (man&0x001fffffffffffff) >> 1
-		e-=3
-	elif ((man&0x0080000000000000) >> 55) == 0:
-		man = (man&0x003fffffffffffff) >> 2
-		e-=2
-	else:
-		man = (man&0x007fffffffffffff) >> 3
-		e-=1
-	f=(sgn)|(e<<52)|man
-	r=struct.unpack('>d',struct.pack('>Q',f))[0]
+	r=math.ldexp(s&0x00ffffffffffffff,4*(((s>>56)&0x7f)-64)-56)
+	if s>>63:
+		return -r
 	return r
+
+def floats2gds(x):
+	"""
+	Vectorized version of float2gds.
+	Convert an array of numbers to GDSII 8-bytes reals.
+	The result is a big-endian uint64 array, use .tobytes() to get the raw data.
+	"""
+	x=np.asarray(x,dtype=np.float64)
+	if not np.isfinite(x).all():
+		raise OverflowError("inf and nan cannot be represented by GDSII reals")
+	m,e=np.frexp(np.abs(x))
+	e=e.astype(np.int64)
+	k=-((-e)//4)
+	man=(m*9007199254740992).astype(np.uint64)<<(3+e-4*k).astype(np.uint64)
+	e=k+64
+	if (e>127).any():
+		raise OverflowError("values out of the range of GDSII reals")
+	# Too small values are denormalized (and eventually flushed to zero)
+	under=np.clip(-4*e,0,64).astype(np.uint64)
+	man=np.where(under<64,man>>np.minimum(under,np.uint64(63)),np.uint64(0))
+	e=np.clip(e,0,127).astype(np.uint64)
+	r=(e<<np.uint64(56))|man|(np.signbit(x).astype(np.uint64)<<np.uint64(63))
+	return np.where(man!=0,r,np.uint64(0)).astype('>u8')
+
+def gds2floats(x):
+	"""
+	Vectorized version of gds2float.
+	Convert a whole array of GDSII 8-bytes reals (excess-64, base 16) to float64.
+	
+	Arguments:
+	----------
+	x: the raw big-endian data (bytes, memoryview) or an array of uint64
+	"""
+	if not isinstance(x,np.ndarray):
+		x=np.frombuffer(x,dtype='>u8')
+	x=x.astype(np.uint64)
+	man=(x&np.uint64(0x00ffffffffffffff)).astype(np.float64)
+	exp=((x>>np.uint64(56))&np.uint64(0x7f)).astype(np.int64)
+	r=np.ldexp(man,4*(exp-64)-56)
+	return np.where((x>>np.uint64(63))!=0,-r,r)
+
+def decodeXY(data):
+	"""
+	Convert the raw parameters of a XY record to an int32 array [x1,y1,x2,y2,...]
+	"""
+	return np.frombuffer(data,dtype='>i4').astype(np.int32)
 	
 def getArea(x,y=None):
 	if y is None:
@@ -89,7 +143,1390 @@ def getLength(x,y=None):
 		length+=math.sqrt((x[i+1]-x[i])**2+(y[i+1]-y[i])**2)
 	return length
 	
+# Record registry: code of each record type (record type byte, data type byte)
+RECORDS={
+	'HEADER':0x0002,
+	'BGNLIB':0x0102,
+	'LIBNAME':0x0206,
+	'UNITS':0x0305,
+	'ENDLIB':0x0400,
+	'BGNSTR':0x0502,
+	'STRNAME':0x0606,
+	'ENDSTR':0x0700,
+	'BOUNDARY':0x0800,
+	'PATH':0x0900,
+	'SREF':0x0A00,
+	'AREF':0x0B00,
+	'TEXT':0x0C00,
+	'LAYER':0x0D02,
+	'DATATYPE':0x0E02,
+	'WIDTH':0x0F03,
+	'XY':0x1003,
+	'ENDEL':0x1100,
+	'SNAME':0x1206,
+	'COLROW':0x1302,
+	'NODE':0x1500,
+	'TEXTTYPE':0x1602,
+	'PRESENTATION':0x1701,
+	'ASCII STRING':0x1906,
+	'STRANS':0x1A01,
+	'MAG':0x1B05,
+	'ANGLE':0x1C05,
+	'REFLIBS':0x1F06,
+	'FONTS':0x2006,
+	'PATHTYPE':0x2102,
+	'GENERATIONS':0x2202,
+	'ATTRTABLE':0x2306,
+	'ELFLAGS':0x2601,
+	'NODETYPE':0x2A02,
+	'PROPATTR':0x2B02,
+	'PROPVALUE':0x2C06,
+	'BOX':0x2D00,
+	'BOXTYPE':0x2E02,
+	'PLEX':0x2F03,
+	'FORMAT':0x3602,
+	'MASK':0x3706,
+	'ENDMASKS':0x3800,
+	'FBMS':0x5800}
+# code -> name
+RECORD_NAMES=dict((v,k) for k,v in RECORDS.items())
+# name -> 2-bytes code (the keys used by GDSII.objs)
+RECORD_BYTES=dict((k,struct.pack(">H",v)) for k,v in RECORDS.items())
+
+# Format of the parameters for each GDSII data type (last byte of the record code)
+# (size of one element in bytes, struct format)
+DATATYPES={
+	0: (0,''),
+	1: (2,'H'),
+	2: (2,'H'),
+	3: (4,'i'),
+	5: (8,'Q'),
+	6: (-1,'s')}
+
+# Parses the 4 bytes header (LENGTH, TYPE) of each record
+_HEADER=struct.Struct(">HH")
+
+# Prebuilt struct.Struct (header included) of the integer records, by (code, number of values)
+_STRUCTS={}
+
+def recordStruct(code, n):
+	"""
+	Return the struct.Struct packing the record code (integer data) with n values, header included
+	"""
+	st=_STRUCTS.get((code,n))
+	if st is None:
+		fmt=DATATYPES[code&0xff]
+		st=_STRUCTS[(code,n)]=struct.Struct(">HH%i%s"%(n,fmt[1]))
+	return st
+
+# struct.Struct (data only) decoding the integer records, by (data type, number of values)
+_DATASTRUCTS={}
+
+def dataStruct(dt, n):
+	"""
+	Return the struct.Struct unpacking the n values of an integer record of data type dt
+	"""
+	st=_DATASTRUCTS.get((dt,n))
+	if st is None:
+		st=_DATASTRUCTS[(dt,n)]=struct.Struct(">%i%s"%(n,DATATYPES[dt][1]))
+	return st
+
+# NumPy types of the long integer records (decoded with np.frombuffer)
+_DATADTYPES={1:'>u2',2:'>u2',3:'>i4'}
+
+for _name,_n in [('HEADER',1),('BGNLIB',12),('BGNSTR',12),('LAYER',1),('DATATYPE',1),('WIDTH',1),
+		('XY',2),('XY',10),('COLROW',2),('TEXTTYPE',1),('PRESENTATION',1),('STRANS',1),('PATHTYPE',1),
+		('GENERATIONS',1),('ELFLAGS',1),('NODETYPE',1),('BOXTYPE',1),('PLEX',1),('FORMAT',1)]:
+	recordStruct(RECORDS[_name],_n)
+
+def decodeRecord(code, data):
+	"""
+	Decode the parameters of a record returned by GDSReader
+
+	Arguments:
+	----------
+	code: the record code (2-bytes integer, record type and data type)
+	data: the raw parameters of the record (bytes or memoryview)
+	
+	Return None for records without data, a list with the string for string records
+	an int32 array for XY, a float64 array for reals and a tuple of numbers otherwise.
+	"""
+	fmt=DATATYPES.get(code&0xff,(-1,'s'))
+	n=len(data)
+	if fmt[0]==0 or n==0:
+		return None
+	if fmt[0]==-1:
+		return [bytes(data).decode('latin-1')]
+	if code==0x1003:
+		return decodeXY(data)
+	if fmt[1]=='Q':
+		return gds2floats(data)
+	n//=fmt[0]
+	if n>16:
+		return tuple(np.frombuffer(data,dtype=_DATADTYPES[code&0xff],count=n).tolist())
+	return dataStruct(code&0xff,n).unpack(data)
+
+def shapeArrays(shapes, offsets=None):
+	"""
+	Convert a batch of shapes to a (P,2) float array of points and the array starts of
+	the index of the first point of each shape (len N+1, starts[-1]==P).
+	
+	Arguments:
+	----------
+	shapes: either an array of N shapes of the same number of points ((N,K,2) or (N,2K))
+		or, if offsets is given, the flat coordinates [x1,y1,x2,y2,...] of all the shapes
+	offsets: the index (in points) of the first point of each shape (len N or N+1)
+	"""
+	if offsets is None:
+		a=np.asarray(shapes,dtype=np.float64)
+		N=len(a)
+		pts=a.reshape(-1,2)
+		K=len(pts)//N if N else 0
+		return pts,np.arange(N+1,dtype=np.int64)*K
+	pts=np.asarray(shapes,dtype=np.float64).reshape(-1,2)
+	starts=np.asarray(offsets,dtype=np.int64)
+	if len(starts)==0 or starts[-1]!=len(pts):
+		starts=np.append(starts,len(pts))
+	return pts,starts
+
+def closeShapes(pts, starts):
+	"""
+	Append the first point to the shapes which are not closed
+	"""
+	if len(starts)<2:
+		return pts,starts
+	first=pts[starts[:-1]]
+	last=pts[starts[1:]-1]
+	op=(first!=last).any(axis=1)
+	if not op.any():
+		return pts,starts
+	pts=np.insert(pts,starts[1:][op],first[op],axis=0)
+	starts=starts+np.concatenate([[0],np.cumsum(op)])
+	return pts,starts
+
+def getAreas(pts, starts):
+	"""
+	Vectorized getArea: areas of the closed polygons given as points and starts (see shapeArrays)
+	"""
+	x=pts[:,0]
+	y=pts[:,1]
+	c=np.zeros(len(pts))
+	c[:-1]=x[:-1]*y[1:]-x[1:]*y[:-1]
+	# Remove the terms joining two different shapes
+	c[starts[1:]-1]=0
+	return 0.5*np.abs(np.add.reduceat(c,starts[:-1])) if len(pts) else np.zeros(len(starts)-1)
+
+def getLengths(pts, starts):
+	"""
+	Vectorized getLength: lengths of the lines given as points and starts (see shapeArrays)
+	"""
+	d=np.zeros(len(pts))
+	d[:-1]=np.hypot(np.diff(pts[:,0]),np.diff(pts[:,1]))
+	d[starts[1:]-1]=0
+	return np.add.reduceat(d,starts[:-1]) if len(pts) else np.zeros(len(starts)-1)
+	
+# XY records of more points are transformed and simplified with NumPy by GDSII.addObj
+SHORTXY=64
+
+# Largest number of points of an XY record (its length is a 16 bits number of bytes)
+MAXPOINTS=8191
+
+def simplifyShapes(pts, starts, closed=True, tol=0):
+	"""
+	Remove the repeated points and the points within tol of the segment joining their neighbours
+	(going on in the same direction) of the shapes (pts, starts). The first and last points are kept,
+	as well as the shapes which would be left with less than 4 (closed) or 2 (lines) points.
+	Return the new (pts, starts).
+	"""
+	minimum=4 if closed else 2
+	while len(starts)>1 and len(pts)>2:
+		# Inner points 1..P-2 with the segments a before them and b after them
+		dx=np.diff(pts[:,0])
+		dy=np.diff(pts[:,1])
+		ax,ay,bx,by=dx[:-1],dy[:-1],dx[1:],dy[1:]
+		inner=np.ones(len(pts)-2,dtype=bool)
+		inner[starts[1:-1]-1]=False
+		inner[starts[1:-1]-2]=False
+		nxt=np.zeros(len(pts)-2,dtype=bool)
+		i=starts[1:]-3
+		nxt[i[i>=0]]=True
+		drop=((ax==0)&(ay==0))|(nxt&(bx==0)&(by==0))
+		c=np.abs(ax*by-ay*bx)
+		fwd=ax*bx+ay*by>0
+		if tol>0:
+			col=fwd&(c<=tol*np.hypot(ax+bx,ay+by))
+			# Of consecutive points only every other one is removed per pass
+			run=col[:-1]&col[1:]
+			while run.any():
+				col[1:][run]=False
+				run=col[:-1]&col[1:]
+			drop|=col
+		else:
+			drop|=fwd&(c==0)
+		drop&=inner
+		if not drop.any():
+			break
+		keep=np.ones(len(pts),dtype=bool)
+		keep[1:-1]=~drop
+		# The shapes left with too few points are kept as they are
+		left=np.add.reduceat(keep.astype(np.int64),starts[:-1])
+		small=left<np.minimum(minimum,np.diff(starts))
+		if small.any():
+			keep|=np.repeat(small,np.diff(starts))
+			if keep.all():
+				break
+		pts=pts[keep]
+		starts=np.concatenate([[0],np.cumsum(keep)[starts[1:]-1]])
+	return pts,starts
+
+def simplifyPoints(p, closed=True, tol=0):
+	"""
+	simplifyShapes of the single shape p [x1,y1,x2,y2,...] in pure Python (faster for the short XY
+	records written one by one). Return p itself if no point is removed, the truncated points otherwise.
+	"""
+	x=[int(z) for z in p[::2]]
+	y=[int(z) for z in p[1::2]]
+	n=len(x)
+	minimum=min(4 if closed else 2,n)
+	if n<3:
+		return p
+	if tol==0:
+		# Without tolerance the passes of simplifyShapes end on the turning points: one pass with a stack
+		sx=[x[0]]
+		sy=[y[0]]
+		for qx,qy in zip(x[1:],y[1:]):
+			if qx==sx[-1] and qy==sy[-1]:
+				continue
+			while len(sx)>1:
+				ax=sx[-1]-sx[-2]
+				ay=sy[-1]-sy[-2]
+				bx=qx-sx[-1]
+				by=qy-sy[-1]
+				if ax*by!=ay*bx or ax*bx+ay*by<=0:
+					break
+				sx.pop()
+				sy.pop()
+			sx.append(qx)
+			sy.append(qy)
+		if len(sx)==n:
+			return p
+		if len(sx)>=minimum:
+			xy=[0]*(2*len(sx))
+			xy[::2]=sx
+			xy[1::2]=sy
+			return xy
+	# Too few points left or tolerance: the passes of simplifyShapes
+	removed=False
+	while len(x)>2:
+		n=len(x)
+		keep=[True]*n
+		col=False
+		for i in range(1,n-1):
+			ax=x[i]-x[i-1]
+			ay=y[i]-y[i-1]
+			bx=x[i+1]-x[i]
+			by=y[i+1]-y[i]
+			if (ax==0 and ay==0) or (i==n-2 and bx==0 and by==0):
+				keep[i]=False
+				col=False
+				continue
+			c=ax*by-ay*bx
+			if tol>0:
+				# Of consecutive aligned points only the first one is removed per pass
+				prev=col
+				col=ax*bx+ay*by>0 and abs(c)<=tol*math.hypot(ax+bx,ay+by)
+				if col and not prev:
+					keep[i]=False
+			elif c==0 and ax*bx+ay*by>0:
+				keep[i]=False
+		left=sum(keep)
+		if left==n or left<minimum:
+			break
+		x=[z for z,k in zip(x,keep) if k]
+		y=[z for z,k in zip(y,keep) if k]
+		removed=True
+	if not removed:
+		return p
+	xy=[0]*(2*len(x))
+	xy[::2]=x
+	xy[1::2]=y
+	return xy
+
+def splitShapes(pts, starts, closed=True, limit=MAXPOINTS):
+	"""
+	Split the shapes (pts, starts) of more than limit points: the lines into consecutive pieces sharing
+	their ends, the closed polygons into horizontal bands (area preserved).
+	Return (pts, starts, src) where src is the index of the original shape of each piece.
+	"""
+	counts=np.diff(starts)
+	N=len(counts)
+	if N==0 or counts.max()<=limit:
+		return pts,starts,np.arange(N)
+	if not closed:
+		m=np.maximum(1,-(-(counts-1)//(limit-1)))
+		src=np.repeat(np.arange(N),m)
+		first=np.zeros(N,dtype=np.int64)
+		np.cumsum(m[:-1],out=first[1:])
+		j=np.arange(len(src))-first[src]
+		a=starts[src]+j*(limit-1)
+		b=np.minimum(a+limit,starts[src+1])
+		n=b-a
+		new=np.zeros(len(src)+1,dtype=np.int64)
+		np.cumsum(n,out=new[1:])
+		idx=np.arange(new[-1])-np.repeat(new[:-1]-a,n)
+		return pts[idx],new,src
+	parts=[]
+	for i in range(N):
+		p=pts[starts[i]:starts[i+1]]
+		parts+=[(i,q) for q in splitPolygon(p,limit)]
+	src=np.array([i for i,q in parts],dtype=np.int64)
+	new=np.zeros(len(parts)+1,dtype=np.int64)
+	np.cumsum([len(q) for i,q in parts],out=new[1:])
+	return np.concatenate([q for i,q in parts]),new,src
+
+def clipPolygon(pts, box):
+	"""
+	Clip the closed polygon pts (n,2) to the box [xmin,ymin,xmax,ymax] (Sutherland-Hodgman).
+	Return the points of the clipped polygon (closed, empty if outside).
+	Concave polygons cut into several parts stay one polygon joined by zero-width edges.
+	"""
+	if len(pts)>1 and (pts[0]==pts[-1]).all():
+		pts=pts[:-1]
+	for axis,bound,keep in ((0,box[0],1),(0,box[2],-1),(1,box[1],1),(1,box[3],-1)):
+		if len(pts)==0:
+			break
+		d=(pts[:,axis]-bound)*keep
+		inside=d>=0
+		if inside.all():
+			continue
+		nxt=np.roll(pts,-1,axis=0)
+		dn=np.roll(d,-1)
+		out=[]
+		for i in range(len(pts)):
+			if inside[i]:
+				out.append(pts[i])
+			if inside[i]!=(dn[i]>=0):
+				t=d[i]/(d[i]-dn[i])
+				p=pts[i]+t*(nxt[i]-pts[i])
+				p[axis]=bound
+				out.append(p)
+		pts=np.array(out).reshape(-1,2)
+	if len(pts)<3:
+		return np.zeros((0,2))
+	return np.concatenate([pts,pts[:1]])
+
+def splitPolygon(p, limit):
+	# Cut the closed polygon p into horizontal bands of at most limit points (see splitShapes)
+	if len(p)<=limit:
+		return [p]
+	n=-(-2*len(p)//limit)
+	ys=np.unique(np.round(np.quantile(p[:,1],np.arange(1,n)/float(n))))
+	bounds=np.concatenate([[-np.inf],ys,[np.inf]])
+	r=[]
+	for a,b in zip(bounds[:-1],bounds[1:]):
+		q=clipPolygon(p,[-np.inf,a,np.inf,b])
+		if len(q)==0:
+			continue
+		if len(q)>=len(p):
+			raise ValueError("The polygon of %i points can't be split into XY records of %i points"%(len(p),limit))
+		r+=splitPolygon(q,limit)
+	return r
+
+def normalizeShapes(pts, starts, closed=True, tol=0, limit=MAXPOINTS):
+	"""
+	Prepare the shapes (pts, starts) for their XY records: the coordinates are truncated to integers
+	(as encoded), the redundant points removed (see simplifyShapes) and the shapes too long split
+	(see splitShapes). Return (pts, starts, src) where src is the index of the original shape of each shape.
+	"""
+	pts,starts=simplifyShapes(np.trunc(pts),starts,closed,tol)
+	n=len(starts)-1
+	pts,starts,src=splitShapes(pts,starts,closed,limit)
+	if len(src)>n and closed:
+		# The bands have cut edges
+		pts=np.trunc(pts)
+	return pts,starts,src
+
+def doseDec(datatype):
+	"""
+	Inverse of GDSII.doseEnc: return the dose factor(s) encoded in the datatype(s)
+	"""
+	d=np.asarray(datatype,dtype=np.float64)
+	return np.where(d<=30000,d/1000.0,30+(d-30000)/2.0)
+	
+def loadRanges(path, ranges):
+	"""
+	Return a RecordStore holding the records of the GDSII file path in the byte ranges
+	[(start, stop), ...] (used by the worker processes of GDSII.open)
+	"""
+	st=RecordStore()
+	with GDSReader(path) as r:
+		for start,stop in ranges:
+			for code,pos,data in r.records(start,stop):
+				st.addRaw(code,data)
+	st.trim()
+	return st
+	
+def buildStructs(func, jobs, area=None, loops=1, tag=''):
+	"""
+	Generate the structures jobs [(name, args, kargs), ...] with func(g, *args, **kargs)
+	in a GDSII writing in memory (used by the worker processes of GDSII.addStructs).
+	area holds the boundaries of the structures already written, which can be referenced.
+	The glyph cells and compiled macros used by the structures follow them, their names are made unique with tag.
+	Return the list of (name, binary data, stats)
+	"""
+	buf=io.BytesIO()
+	g=GDSII(buf)
+	g.loops=loops
+	g.glyphTag=tag
+	if area:
+		g.area.update(area)
+	r=[]
+	def add(name, pos):
+		g.f.flush()
+		stats=dict(area=g.area[name],Area=g.Area[name],Length=g.Length[name],DoseArea=g.DoseArea[name],DoseLine=g.DoseLine[name])
+		r.append((name,buf.getvalue()[pos:g.f.tell()],stats))
+	for name,args,kargs in jobs:
+		pos=g.f.tell()
+		g.newStr(name)
+		func(g,*args,**kargs)
+		g.endStr()
+		add(name,pos)
+	for key,gl in g.glyphs.items():
+		pos=g.f.tell()
+		g.writeGlyph(key)
+		add(gl[0],pos)
+	return r+g.cells
+	
+class GDSReader:
+	def __init__(self, path):
+		"""
+		Memory-mapped reader of a GDSII file.
+		Iterating over it yields the records lazily as (code, offset, data) tuples where
+		code is the 2-bytes record code as an integer, offset the position of the record in the file
+		and data a memoryview on its raw parameters. Nothing is copied nor decoded,
+		use decodeRecord(code, data) to obtain the values of the records you are interested in.
+		
+		Arguments:
+		----------
+		path: the path of the GDSII file
+		"""
+		self.path=path
+		self.f=open(path,"rb")
+		self.size=os.fstat(self.f.fileno()).st_size
+		if self.size>0:
+			self.mm=mmap.mmap(self.f.fileno(),0,access=mmap.ACCESS_READ)
+		else:
+			self.mm=b''
+		self.buf=memoryview(self.mm)
+		
+	def records(self, start=0, stop=None):
+		"""
+		Yield the records found between the byte offsets start and stop
+		"""
+		if stop is None or stop>self.size: stop=self.size
+		mm=self.mm
+		buf=self.buf
+		header=_HEADER.unpack_from
+		pos=start
+		code=None
+		while pos+4<=stop:
+			LENGTH,c=header(mm,pos)
+			if LENGTH<4:
+				# The end of the file is padded with zeros
+				break
+			if pos+LENGTH>stop:
+				raise IOError("Truncated record at offset %i in %s"%(pos,self.path))
+			code=c
+			yield code,pos,buf[pos+4:pos+LENGTH]
+			pos+=LENGTH
+		self.checkEnd(pos,stop,code)
+			
+	def headers(self, start=0, stop=None):
+		"""
+		Yield the (code, offset, length) of the records found between the byte offsets start and stop
+		(faster than records when the parameters are not needed)
+		"""
+		if stop is None or stop>self.size: stop=self.size
+		mm=self.mm
+		header=_HEADER.unpack_from
+		pos=start
+		code=None
+		while pos+4<=stop:
+			LENGTH,c=header(mm,pos)
+			if LENGTH<4:
+				break
+			if pos+LENGTH>stop:
+				raise IOError("Truncated record at offset %i in %s"%(pos,self.path))
+			code=c
+			yield code,pos,LENGTH
+			pos+=LENGTH
+		self.checkEnd(pos,stop,code)
+		
+	def checkEnd(self, pos, stop, last):
+		"""
+		Raise IOError unless the bytes left between pos and stop are the zero padding of the end of the file
+		and the records read up to the end of the file (last is the code of the last one) end with ENDLIB
+		"""
+		if pos<stop and bytes(self.buf[pos:stop]).strip(b'\x00'):
+			raise IOError("Truncated record at offset %i in %s"%(pos,self.path))
+		if stop==self.size and last is not None and last!=0x0400:
+			raise IOError("Truncated file %s: no ENDLIB after the offset %i"%(self.path,pos))
+			
+	def __iter__(self):
+		return self.records()
+		
+	def close(self):
+		self.buf.release()
+		try:
+			self.mm.close()
+		except (BufferError,AttributeError):
+			# Some record views are still alive, the map will be released with them
+			pass
+		self.f.close()
+		
+	def __enter__(self):
+		return self
+		
+	def __exit__(self, *args):
+		self.close()
+	
+class StructIndex:
+	def __init__(self, path=None):
+		"""
+		Index of the structures of a GDSII file.
+		For each structure name, self.structs holds [begin, end, first, last] where begin/end are
+		the byte offsets of its BGNSTR record and of the end of its ENDSTR record and first/last
+		the corresponding record numbers (last excluded).
+		self.header is the size of the library header (offset of the first BGNSTR)
+		and self.end the offset of the ENDLIB record.
+		"""
+		self.path=path
+		self.size=0
+		self.mtime=0
+		self.header=0
+		self.end=0
+		self.structs={}
+		if path is not None:
+			st=os.stat(path)
+			self.size=st.st_size
+			self.mtime=st.st_mtime_ns
+			
+	def __getitem__(self, name):
+		return self.structs[name]
+		
+	def __contains__(self, name):
+		return name in self.structs
+		
+	def __len__(self):
+		return len(self.structs)
+		
+	def names(self):
+		return list(self.structs)
+		
+	def scan(self, reader):
+		"""
+		Build the index in a single pass over the records of a GDSReader.
+		Only the STRNAME records are decoded.
+		"""
+		self.structs={}
+		self.header=None
+		self.end=reader.size
+		begin=first=name=None
+		for i,(code,pos,LENGTH) in enumerate(reader.headers()):
+			if code==0x0502: # BGNSTR
+				begin=pos
+				first=i
+				if self.header is None: self.header=pos
+			elif code==0x0606: # STRNAME
+				name=reader.mm[pos+4:pos+LENGTH].decode('latin-1').rstrip('\x00')
+			elif code==0x0700: # ENDSTR
+				self.structs[name]=[begin,pos+4,first,i+1]
+			elif code==0x0400: # ENDLIB
+				self.end=pos
+		if self.header is None: self.header=self.end
+		return self
+		
+	def isValid(self):
+		"""
+		Check that the indexed file was not modified since the index was built
+		"""
+		try:
+			st=os.stat(self.path)
+		except OSError:
+			return False
+		return st.st_size==self.size and st.st_mtime_ns==self.mtime
+		
+	def save(self, fn=None):
+		"""
+		Save the index as a json sidecar file (default: path+".idx")
+		"""
+		if fn is None: fn=self.path+".idx"
+		with open(fn,"w") as f:
+			json.dump({'size':self.size,'mtime':self.mtime,'header':self.header,'end':self.end,
+				'structs':[[k]+v for k,v in self.structs.items()]},f)
+				
+	def load(self, fn=None):
+		"""
+		Load the index from a sidecar file. Return False if it is missing or out of date.
+		"""
+		if fn is None: fn=self.path+".idx"
+		try:
+			with open(fn) as f:
+				d=json.load(f)
+		except (IOError,ValueError):
+			return False
+		if d['size']!=self.size or d['mtime']!=self.mtime:
+			return False
+		self.header=d['header']
+		self.end=d['end']
+		self.structs=dict((x[0],x[1:]) for x in d['structs'])
+		return True
+
+def loadIndex(path, save=False):
+	"""
+	Return the StructIndex of the GDSII file path.
+	The sidecar index path+".idx" is used if it is up to date, otherwise the file is scanned
+	(and the sidecar written if save is True).
+	"""
+	idx=StructIndex(path)
+	if idx.load():
+		return idx
+	with GDSReader(path) as r:
+		idx.scan(r)
+	if save:
+		idx.save()
+	return idx
+
+# Record codes of the elements
+ELEMENTS=(0x0800,0x0900,0x0A00,0x0B00,0x0C00,0x1500,0x2D00,0x5800)
+
+def recordCode(t):
+	"""
+	Return the integer record code of t given as 2-bytes (bytes or str) or integer
+	"""
+	if isinstance(t,int):
+		return t
+	if isinstance(t,str):
+		t=t.encode('latin-1')
+	return (t[0]<<8)|t[1]
+
+class Buffer:
+	def __init__(self, dtype, size=1024):
+		"""
+		Growable NumPy array. Only the first n values of self.a are used.
+		"""
+		self.a=np.empty(size,dtype=dtype)
+		self.n=0
+		
+	def extend(self, values):
+		values=np.asarray(values)
+		m=self.n+len(values)
+		if m>len(self.a):
+			a=np.empty(max(m,2*len(self.a)),dtype=self.a.dtype)
+			a[:self.n]=self.a[:self.n]
+			self.a=a
+		self.a[self.n:m]=values
+		self.n=m
+		
+	def view(self):
+		return self.a[:self.n]
+		
+	def trim(self):
+		"""
+		Release the unused capacity (before pickling for instance)
+		"""
+		self.a=self.a[:self.n].copy()
+		
+	def nbytes(self):
+		return self.a.nbytes
+
+def widen(a):
+	"""
+	Return the offsets array('I') a as an array('q') (for the offsets beyond 32 bits)
+	"""
+	return a if a.typecode=='q' else array('q',a)
+
+def offsetArray(values):
+	"""
+	Return the offsets values as an array('I'), or an array('q') if they don't fit in 32 bits
+	"""
+	values=np.asarray(values,dtype=np.int64)
+	if len(values)==0 or values.max()<=0xFFFFFFFF:
+		return array('I',values.astype(np.uint32).tobytes())
+	return array('q',values.tobytes())
+
+# Columns of the references stored in ElementTable.rparams: (name, type, default)
+REFCOLUMNS=(('strans',int,0),('mag',float,1.0),('angle',float,0.0),('cols',int,1),('rows',int,1))
+
+class RefColumn:
+	def __init__(self, table, k):
+		"""
+		Per-element view of the reference column k of the table (the default value for the other elements).
+		k is -1 for sname, otherwise the index of the column in REFCOLUMNS.
+		"""
+		self.table=table
+		self.k=k
+		
+	def get(self, j):
+		# Value of the reference j
+		t=self.table
+		if self.k<0:
+			return t.rsname[j]
+		name,tp,default=REFCOLUMNS[self.k]
+		return tp(t.rparams[len(REFCOLUMNS)*j+self.k])
+		
+	def __getitem__(self, i):
+		t=self.table
+		if i<0: i+=len(t.kind)
+		j=bisect_left(t.refs,i)
+		if j<len(t.refs) and t.refs[j]==i:
+			return self.get(j)
+		return None if self.k<0 else REFCOLUMNS[self.k][2]
+		
+	def __len__(self):
+		return len(self.table.kind)
+		
+	def __iter__(self):
+		t=self.table
+		default=None if self.k<0 else REFCOLUMNS[self.k][2]
+		j=0
+		for i in range(len(t.kind)):
+			if j<len(t.refs) and t.refs[j]==i:
+				yield self.get(j)
+				j+=1
+			else:
+				yield default
+
+class ElementTable:
+	__slots__=('name','store','first','last','rec','kind','layer','datatype','width','xy','nxy','loop','refs','rsname','rparams')
+	def __init__(self, store, first):
+		"""
+		Struct-of-arrays describing the elements of one structure of a RecordStore.
+		The coordinates of element i are store.ints[xy[i]:xy[i]+nxy[i]] (see getXY).
+		
+		Columns:
+		--------
+		rec: index of the first record of each element
+		kind: element record code (0x0800 for BOUNDARY, 0x0900 for PATH, ...)
+		layer, datatype (or texttype/boxtype), width
+		loop: Raith loop count (1 if not set)
+		sname, strans, mag, angle, cols, rows: reference parameters (SREF/AREF), stored for the
+			references only (refs: their element indices, rsname and rparams: their values)
+			and read per element through RefColumn views (default values for the other elements)
+		"""
+		self.name=None
+		self.store=store
+		self.first=first
+		self.last=None
+		self.rec=array('I')
+		self.kind=array('H')
+		self.layer=array('h')
+		self.datatype=array('h')
+		self.width=array('i')
+		self.xy=array('I')
+		self.nxy=array('H')
+		self.loop=array('i')
+		self.refs=array('I')
+		self.rsname=[]
+		self.rparams=array('d')
+		
+	sname=property(lambda self:RefColumn(self,-1))
+	strans=property(lambda self:RefColumn(self,0))
+	mag=property(lambda self:RefColumn(self,1))
+	angle=property(lambda self:RefColumn(self,2))
+	cols=property(lambda self:RefColumn(self,3))
+	rows=property(lambda self:RefColumn(self,4))
+		
+	def __len__(self):
+		return len(self.kind)
+		
+	def newElement(self, kind, rec):
+		if rec>0xFFFFFFFF: self.rec=widen(self.rec)
+		self.rec.append(rec)
+		self.kind.append(kind)
+		self.layer.append(0)
+		self.datatype.append(0)
+		self.width.append(0)
+		self.xy.append(0)
+		self.nxy.append(0)
+		self.loop.append(1)
+		if kind==0x0A00 or kind==0x0B00: # SREF, AREF
+			self.refs.append(len(self.kind)-1)
+			self.rsname.append(None)
+			self.rparams.extend([c[2] for c in REFCOLUMNS])
+			
+	def lastRef(self):
+		# Index of the last reference if it is the last element (None otherwise)
+		if len(self.refs) and self.refs[-1]==len(self.kind)-1:
+			return len(self.refs)-1
+		return None
+		
+	def getXY(self, i):
+		"""
+		Return the coordinates [x1,y1,x2,y2,...] of the element i as an int32 array
+		"""
+		return self.store.ints.a[self.xy[i]:self.xy[i]+self.nxy[i]]
+		
+	def column(self, name):
+		"""
+		Return the column name as a NumPy array
+		"""
+		k=[c[0] for c in REFCOLUMNS].index(name) if name in ('strans','mag','angle','cols','rows') else None
+		if k is None:
+			return np.array(getattr(self,name),dtype=None if name!='sname' else object)
+		c=REFCOLUMNS[k]
+		a=np.full(len(self.kind),c[2],dtype=np.float64 if c[1] is float else np.int64)
+		a[np.array(self.refs,dtype=np.int64)]=np.array(self.rparams).reshape(-1,len(REFCOLUMNS))[:,k]
+		return a
+		
+	def select(self, kinds):
+		"""
+		Return the indices of the elements whose kind (record code) is in kinds
+		"""
+		return np.nonzero(np.isin(self.column('kind'),kinds))[0]
+		
+	def getPoints(self, sel):
+		"""
+		Gather the coordinates of the elements sel (array of indices) without a Python loop.
+		Return a (P,2) int32 array of points and the index of the first point of each element (len N+1).
+		"""
+		offs=self.column('xy')[sel]
+		counts=self.column('nxy')[sel]
+		starts=np.zeros(len(sel)+1,dtype=np.int64)
+		np.cumsum(counts,out=starts[1:])
+		idx=np.arange(starts[-1],dtype=np.int64)+np.repeat(offs-starts[:-1],counts)
+		return self.store.ints.a[idx].reshape(-1,2),starts//2
+		
+	def nbytes(self):
+		return sum(getattr(self,k).itemsize*len(getattr(self,k)) for k in self.__slots__ if isinstance(getattr(self,k),array))+8*len(self.rsname)
+
+class RecordStore:
+	def __init__(self):
+		"""
+		Compact in-memory storage of GDSII records, used as GDSII.objs.
+		Each record is described by its code, the offset and the number of its parameters in a
+		shared buffer: ints (int32, holding XY, LAYER, ...), reals (float64) or strs (list).
+		Each structure also gets an ElementTable (see self.tables).
+		The store behaves like the list of {'TYPE':..., 'PARAMS':...} dicts it replaces:
+		the dicts are built on the fly when indexing or iterating.
+		"""
+		self.codes=array('H')
+		self.offs=array('I') # widened to 'q' beyond 32 bits (see widen)
+		self.counts=array('H')
+		self.ints=Buffer(np.int32)
+		self.reals=Buffer(np.float64)
+		self.strs=[]
+		self.tables=[]
+		self.table=None
+		self.byName={}
+		
+	def __len__(self):
+		return len(self.codes)
+		
+	def append(self, ob):
+		self.add(ob['TYPE'],ob['PARAMS'])
+		
+	def add(self, t, p=None):
+		"""
+		Append the record of type t (2-bytes or integer code) with the parameters p
+		"""
+		code=recordCode(t)
+		dt=code&0xff
+		if p is None or dt==0:
+			n=0
+			o=0
+		elif dt==6 or dt not in DATATYPES:
+			if isinstance(p,(list,tuple)): p=p[0]
+			if isinstance(p,bytes): p=p.decode('latin-1')
+			o=len(self.strs)
+			n=1
+			self.strs.append(p)
+		else:
+			if not isinstance(p,(list,tuple,np.ndarray)): p=[p]
+			if dt==5:
+				o=self.reals.n
+				self.reals.extend(np.asarray(p,dtype=np.float64))
+			else:
+				o=self.ints.n
+				self.ints.extend(np.asarray(p).astype(np.int32))
+			n=len(p)
+		if o>0xFFFFFFFF: self.offs=widen(self.offs)
+		self.codes.append(code)
+		self.offs.append(o)
+		self.counts.append(n)
+		self.index(code,o,n)
+		
+	def addRaw(self, code, data):
+		"""
+		Append a record given its raw parameters as returned by GDSReader
+		"""
+		dt=code&0xff
+		fmt=DATATYPES.get(dt,(-1,'s'))
+		if fmt[0]==0 or len(data)==0:
+			o=n=0
+		elif fmt[0]==-1:
+			o=len(self.strs)
+			n=1
+			self.strs.append(bytes(data).decode('latin-1'))
+		elif dt==5:
+			o=self.reals.n
+			self.reals.extend(gds2floats(data))
+			n=self.reals.n-o
+		else:
+			o=self.ints.n
+			self.ints.extend(np.frombuffer(data,dtype=['>u2','>i4'][dt==3]))
+			n=self.ints.n-o
+		if o>0xFFFFFFFF: self.offs=widen(self.offs)
+		self.codes.append(code)
+		self.offs.append(o)
+		self.counts.append(n)
+		self.index(code,o,n)
+		
+	def index(self, code, o, n):
+		# Update the ElementTable of the current structure
+		t=self.table
+		if code==0x0502: # BGNSTR
+			self.table=ElementTable(self,len(self.codes)-1)
+		elif t is None:
+			return
+		elif code in ELEMENTS:
+			t.newElement(code,len(self.codes)-1)
+		elif code==0x0606: # STRNAME
+			t.name=self.strs[o].rstrip('\x00')
+		elif code==0x0700: # ENDSTR
+			t.last=len(self.codes)
+			self.tables.append(t)
+			self.byName[t.name]=t
+			self.table=None
+		elif len(t.kind)==0 or n==0:
+			return
+		elif code==0x1003: # XY
+			if o>0xFFFFFFFF: t.xy=widen(t.xy)
+			t.xy[-1]=o
+			t.nxy[-1]=n
+		elif code in (0x0D02,0x0E02,0x1602,0x2E02): # LAYER, DATATYPE, TEXTTYPE, BOXTYPE
+			v=int(self.ints.a[o])
+			if v>32767: v-=65536
+			if code==0x0D02: t.layer[-1]=v
+			else: t.datatype[-1]=v
+		elif code==0x0F03: # WIDTH
+			t.width[-1]=self.ints.a[o]
+		elif code in (0x1206,0x1A01,0x1B05,0x1C05,0x1302):
+			# Parameters of a reference
+			j=t.lastRef()
+			if j is None:
+				return
+			k=len(REFCOLUMNS)*j
+			if code==0x1206: # SNAME
+				t.rsname[j]=self.strs[o].rstrip('\x00')
+			elif code==0x1A01: # STRANS
+				t.rparams[k]=self.ints.a[o]&0xffff
+			elif code==0x1B05: # MAG
+				t.rparams[k+1]=self.reals.a[o]
+			elif code==0x1C05: # ANGLE
+				t.rparams[k+2]=self.reals.a[o]
+			else: # COLROW
+				t.rparams[k+3]=self.ints.a[o]
+				t.rparams[k+4]=self.ints.a[o+1]
+		elif code==0x6306 and self.strs[o][:1]=='\xaa': # Raith loop
+			t.loop[-1]=struct.unpack("<I",self.strs[o][8:12].encode('latin-1'))[0]
+			
+	def getTable(self, name):
+		return self.byName[name]
+		
+	def trim(self):
+		"""
+		Release the unused capacity of the shared buffers (once the store is filled)
+		"""
+		self.ints.trim()
+		self.reals.trim()
+		
+	def merge(self, other):
+		"""
+		Append all the records and structures of the RecordStore other
+		(the offsets of its records and element tables are shifted, no record is decoded)
+		"""
+		nrec=len(self.codes)
+		ni=self.ints.n
+		nr=self.reals.n
+		ns=len(self.strs)
+		codes=np.frombuffer(other.codes,dtype=np.uint16)
+		offs=np.frombuffer(other.offs,dtype=other.offs.typecode).astype(np.int64)
+		counts=np.frombuffer(other.counts,dtype=np.uint16)
+		dt=codes&0xff
+		used=counts>0
+		reals=used&(dt==5)
+		ints=used&np.isin(dt,(1,2,3))
+		strs=used&~reals&~ints
+		offs[ints]+=ni
+		offs[reals]+=nr
+		offs[strs]+=ns
+		self.codes.extend(other.codes)
+		if self.offs.typecode=='I' and (len(offs)==0 or offs.max()<=0xFFFFFFFF):
+			self.offs.frombytes(offs.astype(np.uint32).tobytes())
+		else:
+			self.offs=widen(self.offs)
+			self.offs.frombytes(offs.tobytes())
+		self.counts.extend(other.counts)
+		self.ints.extend(other.ints.view())
+		self.reals.extend(other.reals.view())
+		self.strs.extend(other.strs)
+		for t in other.tables:
+			t.store=self
+			t.first+=nrec
+			t.last+=nrec
+			t.rec=offsetArray(np.frombuffer(t.rec,dtype=t.rec.typecode).astype(np.int64)+nrec)
+			t.xy=offsetArray(np.frombuffer(t.xy,dtype=t.xy.typecode).astype(np.int64)+ni)
+			self.tables.append(t)
+			self.byName[t.name]=t
+			
+	def addBytes(self, data):
+		"""
+		Append all the records encoded in data (GDSII binary format)
+		"""
+		mv=memoryview(data)
+		pos=0
+		header=_HEADER.unpack_from
+		while pos+4<=len(mv):
+			LENGTH,code=header(mv,pos)
+			self.addRaw(code,mv[pos+4:pos+LENGTH])
+			pos+=LENGTH
+			
+	def getParams(self, i):
+		code=self.codes[i]
+		n=self.counts[i]
+		if n==0:
+			return None
+		o=self.offs[i]
+		dt=code&0xff
+		if dt==6 or dt not in DATATYPES:
+			return [self.strs[o]]
+		if dt==5:
+			return self.reals.a[o:o+n].copy()
+		if code==0x1003:
+			return self.ints.a[o:o+n].copy()
+		return tuple(self.ints.a[o:o+n].tolist())
+		
+	def __getitem__(self, i):
+		if isinstance(i,slice):
+			return [self[k] for k in range(*i.indices(len(self)))]
+		if i<0: i+=len(self)
+		return {'TYPE':struct.pack(">H",self.codes[i]),'PARAMS':self.getParams(i)}
+		
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+			
+	def encode(self, i):
+		"""
+		Return the record i encoded in the GDSII binary format
+		"""
+		code=self.codes[i]
+		n=self.counts[i]
+		o=self.offs[i]
+		dt=code&0xff
+		if n==0:
+			return _HEADER.pack(4,code)
+		if dt==6 or dt not in DATATYPES:
+			p=self.strs[o]
+			if p[-1]!='\x00' and len(p)%2==1: p+='\x00'
+			data=p.encode('latin-1')
+		elif dt==5:
+			data=floats2gds(self.reals.a[o:o+n]).tobytes()
+		else:
+			data=self.ints.a[o:o+n].astype(['>u2','>i4'][dt==3]).tobytes()
+		return _HEADER.pack(4+len(data),code)+data
+		
+	def write(self, f, a=0, b=None):
+		"""
+		Write the records a to b (excluded) to the file object f
+		"""
+		if b is None: b=len(self)
+		w=GDSWriter(f)
+		for i in range(a,b):
+			w.write(self.encode(i))
+		w.flush()
+		
+	def nbytes(self):
+		"""
+		Approximative memory used by the store (in bytes)
+		"""
+		return self.codes.itemsize*len(self.codes)+self.offs.itemsize*len(self.offs)+self.counts.itemsize*len(self.counts)+self.ints.nbytes()+self.reals.nbytes()+sum(len(s)+49 for s in self.strs)+sum(t.nbytes() for t in self.tables)
+
+def encodeRecord(code, p=None):
+	"""
+	Encode the record code (integer) with the parameters p in the GDSII binary format
+	"""
+	dt=code&0xff
+	if p is None or dt==0:
+		return _HEADER.pack(4,code)
+	if dt in (1,2,3):
+		if type(p) is not list and type(p) is not tuple:
+			if not isinstance(p,np.ndarray):
+				return recordStruct(code,1).pack(4+DATATYPES[dt][0],code,int(p))
+			p=p.tolist()
+		n=len(p)
+		if n>16:
+			data=np.asarray(p).astype(np.int32).astype(['>u2','>i4'][dt==3]).tobytes()
+			return _HEADER.pack(4+len(data),code)+data
+		# struct is faster than numpy for the short records (LAYER, WIDTH, ...)
+		return recordStruct(code,n).pack(4+n*DATATYPES[dt][0],code,*map(int,p))
+	if dt==5:
+		if type(p) is not list and type(p) is not tuple and not isinstance(p,np.ndarray): p=(p,)
+		if len(p)<=4:
+			data=b''.join(map(float2gds,p))
+		else:
+			data=floats2gds(p).tobytes()
+		return _HEADER.pack(4+len(data),code)+data
+	if isinstance(p,(list,tuple)): p=p[0]
+	if isinstance(p,str): p=p.encode('latin-1')
+	if p[-1:]!=b'\x00' and len(p)%2==1: p+=b'\x00'
+	return _HEADER.pack(4+len(p),code)+p
+
+class GDSWriter:
+	def __init__(self, f, size=1<<22):
+		"""
+		Buffered writer of GDSII data.
+		The records are packed in a preallocated buffer which is written in chunks of size bytes.
+		
+		Arguments:
+		----------
+		f: a path (str, bytes or os.PathLike) or a binary file object (only the files opened from a path are closed by close)
+		size: the size of the buffer in bytes
+		"""
+		self.owned=not hasattr(f,'write')
+		if self.owned:
+			self.f=open(os.fspath(f),"wb")
+		else:
+			self.f=f
+		self.buf=bytearray(size)
+		self.mv=memoryview(self.buf)
+		self.n=0
+		self.pos=0
+		
+	def tell(self):
+		return self.pos+self.n
+		
+	def write(self, data):
+		l=len(data)
+		if self.n+l>len(self.buf):
+			self.flush()
+			if l>len(self.buf):
+				self.f.write(data)
+				self.pos+=l
+				return
+		self.mv[self.n:self.n+l]=data
+		self.n+=l
+		
+	def addRecord(self, code, p=None):
+		"""
+		Encode and write the record code (integer) with the parameters p
+		"""
+		self.write(encodeRecord(code,p))
+		
+	def addXY(self, xy):
+		"""
+		Write a XY record. xy is an array of int32 (or anything convertible) [x1,y1,x2,y2,...]
+		"""
+		data=np.asarray(xy).astype(np.int32).astype('>i4')
+		self.write(_HEADER.pack(4+4*len(data),0x1003))
+		self.write(data.tobytes())
+		
+	def flush(self):
+		if self.n:
+			self.f.write(self.mv[:self.n])
+			self.pos+=self.n
+			self.n=0
+		self.f.flush()
+		
+	def close(self):
+		if self.f.closed:
+			return
+		self.flush()
+		if self.owned:
+			self.f.close()
+		
+	def __del__(self):
+		try:
+			if self.owned:
+				self.close()
+			elif self.n and not self.f.closed:
+				self.flush()
+		except Exception:
+			pass
+
+class LazyLibrary:
+	def __init__(self, path, budget=256<<20, saveIndex=False):
+		"""
+		Lazy handle on a GDSII file. Only the structure index is built at opening
+		(from the sidecar path.idx if it is up to date, otherwise with a single scan).
+		The structures are decoded when first accessed and kept in a LRU cache.
+		
+		Arguments:
+		----------
+		path: the path of the GDSII file
+		budget: the memory budget of the cache in bytes. The least recently used structures are
+			dropped when the decoded structures exceed it.
+		saveIndex: if True, write the sidecar index when it had to be built
+		"""
+		self.path=path
+		self.reader=GDSReader(path)
+		self.index=StructIndex(path)
+		if not self.index.load():
+			self.index.scan(self.reader)
+			if saveIndex:
+				self.index.save()
+		self.budget=budget
+		self.cache=OrderedDict()
+		self.used=0
+		self.header=RecordStore()
+		for code,pos,data in self.reader.records(0,self.index.header):
+			self.header.addRaw(code,data)
+			
+	def names(self):
+		return self.index.names()
+		
+	def __contains__(self, name):
+		return name in self.index
+		
+	def __len__(self):
+		return len(self.index)
+		
+	def getUnits(self):
+		"""
+		Return the UNITS of the library (user unit, database unit in meter)
+		"""
+		for i in range(len(self.header)):
+			if self.header.codes[i]==0x0305:
+				return self.header.getParams(i).tolist()
+				
+	def getStore(self, name):
+		"""
+		Return the RecordStore holding the structure name (decoded on first access)
+		"""
+		st=self.cache.get(name)
+		if st is not None:
+			self.cache.move_to_end(name)
+			return st
+		begin,end=self.index[name][:2]
+		st=RecordStore()
+		for code,pos,data in self.reader.records(begin,end):
+			st.addRaw(code,data)
+		st.trim()
+		self.cache[name]=st
+		self.used+=st.nbytes()
+		while self.used>self.budget and len(self.cache)>1:
+			k,old=self.cache.popitem(last=False)
+			self.used-=old.nbytes()
+		return st
+		
+	def getTable(self, name):
+		"""
+		Return the ElementTable of the structure name
+		"""
+		return self.getStore(name).tables[0]
+		
+	def __getitem__(self, name):
+		return self.getTable(name)
+		
+	def close(self):
+		self.cache.clear()
+		self.used=0
+		self.reader.close()
+		
+	def __enter__(self):
+		return self
+		
+	def __exit__(self, *args):
+		self.close()
+
+# Strokes of the custom font of GDSII.addText (glyphs of 1x2 units)
+FONT={	'0':[[(0,0),(1,0),(1,2),(0,2),(0,0)]],
+	'1':[[(.5,0),(.5,2)]],
+	'2':[[(0,2),(1,2),(1,1),(0,1),(0,0),(1,0)]],
+	'3':[[(0,0),(1,0),(1,2),(0,2)],[(0,1),(1,1)]],
+	'4':[[(0,2),(0,1),(1,1)],[(1,2),(1,0)]],
+	'5':[[(0,0),(1,0),(1,1),(0,1),(0,2),(1,2)]],
+	'6':[[(1,2),(0,2),(0,0),(1,0),(1,1),(0,1)]],
+	'7':[[(0,2),(1,2),(0,0)],[(0,1),(1,1)]],
+	'8':[[(0,1),(1,1),(1,2),(0,2),(0,0),(1,0),(1,1)]],
+	'9':[[(0,0),(1,0),(1,2),(0,2),(0,1),(1,1)]],
+	'A':[[(0,0),(0,2),(1,2),(1,0)],[(0,1),(1,1)]],
+	'B':[[(0,0),(0,2),(1,1.5),(0,1),(1,0.5),(0,0)]],
+	'C':[[(1,0),(0,0),(0,2),(1,2)]],
+	'D':[[(0,0),(0,2),(1,1),(0,0)]],
+	'E':[[(1,0),(0,0),(0,2),(1,2)],[(0,1),(1,1)]],
+	'F':[[(0,0),(0,2),(1,2)],[(0,1),(1,1)]],
+	'G':[[(1,2),(0,2),(0,0),(1,0),(1,1),(0.5,1)]],
+	'H':[[(0,0),(0,2)],[(1,0),(1,2)],[(0,1),(1,1)]],
+	'I':[[(0.5,0),(0.5,2)],[(0,0),(1,0)],[(0,2),(1,2)]],
+	'J':[[(0,2),(1,2),(1,0),(0,0),(.5,.5)]],
+	'K':[[(0,0),(0,2)],[(1,2),(0,1),(1,0)]],
+	'L':[[(0,2),(0,0),(1,0)]],
+	'M':[[(0,0),(0,2),(0.5,1),(1,2),(1,0)]],
+	'N':[[(0,0),(0,2),(1,0),(1,2)]],
+	'O':[[(0,0),(1,0),(1,2),(0,2),(0,0)]],
+	'P':[[(0,0),(0,2),(1,2),(1,1),(0,1)]],
+	'Q':[[(0.5,0.5),(1,0),(1,2),(0,2),(0,0),(1,0)]],
+	'R':[[(0,0),(0,2),(1,2),(1,1),(0,1),(1,0)]],
+	'S':[[(0,0),(1,0),(1,1),(0,1),(0,2),(1,2)]],
+	'T':[[(0,2),(1,2)],[(0.5,0),(0.5,2)]],
+	'U':[[(0,2),(0,0),(1,0),(1,2)]],
+	'V':[[(0,2),(.5,0),(1,2)]],
+	'W':[[(0,2),(0,0),(.5,1),(1,0),(1,2)]],
+	'X':[[(0,0),(1,2)],[(0,2),(1,0)]],
+	'Y':[[(0,2),(.5,1),(1,2)],[(.5,1),(.5,0)]],
+	'Z':[[(0,2),(1,2),(0,0),(1,0)]],
+	'+':[[(0.5,0),(0.5,2)],[(0,1),(1,1)]],
+	'-':[[(0,1),(1,1)]],
+	'=':[[(0,.75),(1,.75)],[(0,.25),(1,.25)]],
+	'.':[[(.33,0),(.33,.33),(.66,.33),(.66,0),(.33,0)]],
+	'?':[[(0,0),(1,2),(0,2),(0,0),(1,0),(1,2)],[(0,2),(1,0)]],
+	' ':[]
+	}
+
+@lru_cache(maxsize=256)
+def circleTemplate(npts, A=0, B=360):
+	"""
+	Return the (npts+1,2) points of the arc of the unit circle from A to B (degrees) used by
+	addDisk/addCircle. The templates are cached and read-only.
+	"""
+	A*=math.pi/180
+	B*=math.pi/180
+	t=np.array([[math.cos(A+(B-A)*i/npts),math.sin(A+(B-A)*i/npts)] for i in range(npts+1)])
+	t.flags.writeable=False
+	return t
+	
+def glyphName(c):
+	# Key of FONT drawing the character c ('?' if unknown)
+	if c in FONT:
+		return c
+	if c.upper() in FONT:
+		return c.upper()
+	return '?'
+	
+def refParams(L):
+	"""
+	Return the (STRANS, MAG, ANGLE) of a reference with the 2x2 linear transformation L
+	or None if L is not a similarity (see gdsflat.refMatrix)
+	"""
+	L=np.asarray(L,dtype=np.float64)
+	strans=0
+	if np.linalg.det(L)<0:
+		strans=0x8000
+		L=L*[1,-1]
+	mag=math.hypot(L[0,0],L[1,0])
+	if mag==0 or abs(L[0,0]-L[1,1])>1e-9*mag or abs(L[0,1]+L[1,0])>1e-9*mag:
+		return None
+	angle=round(math.degrees(math.atan2(L[1,0],L[0,0])),9)%360
+	return strans,round(mag,12),angle
+	
 class GDSII:
+	# Views of the record registry keyed by the 2-bytes codes
+	Type2=dict((struct.pack("B",k),v) for k,v in DATATYPES.items())
+	Type=dict((v,k) for k,v in RECORD_BYTES.items())
+	IType=RECORD_BYTES
+	
 	def __init__(self,DirectWrite=False):
 		"""
 		Main class to create GDSII data
@@ -98,72 +1535,34 @@ class GDSII:
 		----------
 		DirectWrite: The filename of the structure. If None, the data will be kept on memory until you writze them explicitely. Except for specific debuging, it is better to wrote the file directly
 		"""
-		self.Type2={
-			b'\x00': (0,''),
-			b'\x01': (2,'H'),
-			b'\x02': (2,'H'),
-			b'\x03': (4,'i'),
-			b'\x05': (8,'Q'),
-			b'\x06': (-1,'s')}
-		self.Type={
-			b'\x00\x02':'HEADER',
-			b'\x01\x02':'BGNLIB',
-			b'\x02\x06':'LIBNAME',
-			b'\x03\x05':'UNITS',
-			b'\x04\x00':'ENDLIB',
-			b'\x05\x02':'BGNSTR',
-			b'\x06\x06':'STRNAME',
-			b'\x07\x00':'ENDSTR',
-			b'\x08\x00':'BOUNDARY',
-			b'\x09\x00':'PATH',
-			b'\x0A\x00':'SREF',
-			b'\x0B\x00':'AREF',
-			b'\x0C\x00':'TEXT',
-			b'\x0D\x02':'LAYER',
-			b'\x0E\x02':'DATATYPE',
-			b'\x0F\x03':'WIDTH',
-			b'\x10\x03':'XY',
-			b'\x12\x06':'SNAME',
-			b'\x13\x02':'COLROW',
-			b'\x15\x00':'NODE',
-			b'\x16\x02':'TEXTTYPE',
-			b'\x17\x01':'PRESENTATION',
-			b'\x19\x06':'ASCII STRING',
-			b'\x1a\x01':'STRANS',
-			b'\x1b\x05':'MAG',
-			b'\x1c\x05':'ANGLE',
-			b'\x1f\x06':'REFLIBS',
-			b'\x20\x06':'FONTS',
-			b'\x21\x02':'PATHTYPE',
-			b'\x22\x02':'GENERATIONS',
-			b'\x23\x06':'ATTRTABLE',
-			b'\x26\x01':'ELFLAGS',
-			b'\x2a\x02':'NODETYPE',
-			b'\x2d\x00':'BOX',
-			b'\x2e\x02':'BOXTYPE',
-			b'\x2f\x03':'PLEX',
-			b'\x36\x02':'FORMAT',
-			b'\x37\x06':'MASK',
-			b'\x38\x00':'ENDMASKS',
-			b'\x58\x00':'FBMS'}
-		self.IType=dict((k,v) for v,k in self.Type.items())
 		self.structs=[]
 		self.minimax=[[0.0,0.0],[0.0,0.0]]
-		self.objs=[]
-		self.M=[[1.0,0.0],[0.0,1.0]]
-		self.shift=[0.0,0.0]
+		self.objs=RecordStore()
+		self.T=np.eye(3) # uv -> xy affine transformation
+		self.linear=True # True if the linear part of self.T is the identity
+		self.uvStack=[]
 		self.loops=1
 		self.macro=[]
 		self.enabledMacro=False
 		self.currentStructure=None
-		self.area={} # Store the boudary of the Structure
+		self.area={} # Store the boudary of the Structure [xmin,ymin,xmax,ymax]
+		self.bboxes=None # Hierarchical boundaries of the loaded structures (gdsflat.BBoxes)
+		self.ref=None # Parameters of the reference being written
 		self.Area={} # Store the summed area of the polygons
 		self.Length ={} # Store the summed Length of the lines
 		self.DoseArea={}
 		self.DoseLine={}
 		self.StrPos={}
+		self.glyphs=OrderedDict() # (glyph, scale, layer, width, dose, loop) -> [cell name, length, written]
+		self.glyphTag='' # Inserted in the names of the glyph cells and macros (see buildStructs)
+		self.normalize=True # Remove the redundant points and split the shapes too long for an XY record (see normalizeShapes)
+		self.tolerance=0 # Distance below which the points aligned with their neighbours are removed
+		self.element=None # Type of the element being written
+		self.halfWidth=0 # Half width of the path being written (extends the boundary of the structure)
+		self.cells=[] # Compiled macros waiting to be written by endLib: (name, binary data, stats)
+		self.nMacros=0
 		if DirectWrite:
-			self.f=open(DirectWrite,"wb")
+			self.f=GDSWriter(DirectWrite)
 		else:
 			self.f=None
 			
@@ -271,127 +1670,236 @@ class GDSII:
 		self.addObj('XY',list(pos)+lr+tl)
 		self.addObj(b'\x11\x00')
 		
+	@property
+	def M(self):
+		# 2x2 linear part of self.T
+		return self.T[:2,:2].tolist()
+		
+	@M.setter
+	def M(self, M):
+		self.T[:2,:2]=M
+		self.linear=(self.T[:2,:2]==np.eye(2)).all()
+		
+	@property
+	def shift(self):
+		# translation part of self.T
+		return self.T[:2,2].tolist()
+		
+	@shift.setter
+	def shift(self, shift):
+		self.T[:2,2]=shift
+		
 	def uvSetShift(self,x=None,y=None):
-		if x==None: x=self.shift[0]
-		if y==None: y=self.shift[1]
-		self.shift=[x,y]
+		if x==None: x=self.T[0,2]
+		if y==None: y=self.T[1,2]
+		self.T[:2,2]=[x,y]
 	
 	def uvSave(self):
-		self.BckM = self.M[:]
-		self.BckShift = self.shift[:]
+		self.BckT = self.T.copy()
 		
 	def uvRestore(self):
-		self.M = self.BckM[:]
-		self.shift = self.BckShift[:]
+		self.T = self.BckT.copy()
+		self.M = self.T[:2,:2]
+		
+	def uvPush(self):
+		"""
+		Save the current transformation on the stack (see uvPop)
+		"""
+		self.uvStack.append(self.T.copy())
+		
+	def uvPop(self):
+		"""
+		Restore the last transformation saved by uvPush
+		"""
+		self.T=self.uvStack.pop()
+		self.M=self.T[:2,:2]
+		
+	def uvReset(self):
+		self.T=np.eye(3)
+		self.linear=True
 		
 	def uvResetM(self):
-		self.M=[[1,0],[0,1]]
+		self.M=np.eye(2)
 		
 	def uvShift(self,x=0,y=0):
-		self.shift=[self.shift[0]+x,self.shift[1]+y]
+		self.T[0,2]+=x
+		self.T[1,2]+=y
+		
+	def uvLinear(self, A):
+		# Apply the 2x2 matrix A after the current linear transformation (the shift is unchanged)
+		self.M=np.dot(A,self.T[:2,:2])
 		
 	def uvScale(self,x=1,y=1):
-		self.M=MatrMatrMul([[x,0],[0,y]],self.M)
+		self.uvLinear([[x,0],[0,y]])
 		
 	def uvRotate(self, alpha=0):
 		alpha*=math.pi/180
-		self.M=MatrMatrMul([[math.cos(alpha),math.sin(alpha)],[-math.sin(alpha),math.cos(alpha)]],self.M)
+		self.uvLinear([[math.cos(alpha),math.sin(alpha)],[-math.sin(alpha),math.cos(alpha)]])
 		
 	def uvMirror(self, x=False, y=False):
-		self.M=MatrMatrMul([[ [1,-1][x],0],[0, [1,-1][y]]],self.M)
+		self.uvLinear([[ [1,-1][x],0],[0, [1,-1][y]]])
 		
 	def getType(self, t):
-		if t in self.Type.values():
-			for x in self.Type:
-				if t==self.Type[x]:
-					#print("%s"%(binascii.hexlify(x.encode('utf-8'))))
-					return x
-		else: return t
+		return RECORD_BYTES.get(t,t)
 
 	def uv2xy(self,v):
-		if self.M!=[[1,0],[0,1]]:
-			v=MatrVectMul(self.M,v)
-		return [self.shift[0]+v[0],self.shift[1]+v[1]]
+		T=self.T
+		if self.linear:
+			return [T[0,2]+v[0],T[1,2]+v[1]]
+		return [T[0,0]*v[0]+T[0,1]*v[1]+T[0,2],T[1,0]*v[0]+T[1,1]*v[1]+T[1,2]]
 
 	
+	def uv2xyList(self, p):
+		"""
+		uv2xy of the flat list of points [u1,v1,u2,v2,...], faster than uv2xyArray for the short XY records
+		"""
+		(a,b,c),(d,e,f)=self.T[:2].tolist()
+		u=p[::2]
+		v=p[1::2]
+		xy=[0.0]*(2*len(u))
+		if self.linear:
+			xy[::2]=[x+c for x in u]
+			xy[1::2]=[y+f for y in v]
+		else:
+			xy[::2]=[a*x+b*y+c for x,y in zip(u,v)]
+			xy[1::2]=[d*x+e*y+f for x,y in zip(u,v)]
+		return xy
+
+	def uv2xyArray(self, pts):
+		"""
+		Vectorized uv2xy: transform a (P,2) array of points
+		"""
+		pts=np.asarray(pts,dtype=np.float64)
+		if self.linear:
+			return pts+self.T[:2,2]
+		return pts.dot(self.T[:2,:2].T)+self.T[:2,2]
+		
+	def doseEncArray(self, dose):
+		"""
+		Vectorized doseEnc
+		"""
+		dose=np.asarray(dose,dtype=np.float64)
+		return np.where(dose<=30,(dose*1000).astype(np.int64),30000+((dose-30)*2).astype(np.int64))
+		
 	def doseEnc(self, dose):
 		if dose<=30:
 			return int(dose*1000)
 		else:
 			return 30000+int((dose-30)*2)
+			
+	def doseDec(self, datatype):
+		"""
+		Return the dose factor encoded in the datatype by doseEnc (vectorized, see doseDec)
+		"""
+		return doseDec(datatype)
+		
+	def getUnits(self):
+		"""
+		Return the UNITS of the library (user unit, database unit in meter)
+		"""
+		for i,c in enumerate(self.objs.codes):
+			if c==0x0305:
+				return self.objs.getParams(i).tolist()
 
-	def open(self, path):
-		self.objs=[]
-		bs=os.path.getsize(path)
-		f=open(path,"rb")
-		bLENGTH=f.read(2)
-		cs=[0,0]
-		lp=0
-		lo=None
-		while bLENGTH!='':
-			v=f.tell()*100/bs
-			if v>lp:
-				print("%i%% done"%(v))
-				lp=v
-			LENGTH=struct.unpack(">H",bLENGTH)[0]
-			TYPE=f.read(2)
-			PARAMS=f.read(LENGTH-4)
-			bLENGTH=f.read(2)
-			fmt=self.Type2[TYPE[1]]
-			if fmt[0]==-1:
-				TXT=struct.unpack(str(LENGTH-4)+fmt[1],PARAMS)
-			elif fmt[0]>0:
-				if fmt[1]=='Q':
-					TXT=[]
-					for k in range((LENGTH-4)/8):
-						TXT.append(gds2float(PARAMS[k*8:k*8+8]))
-				else:
-					TXT=struct.unpack(">%i%s"%((LENGTH-4)/fmt[0], fmt[1]),PARAMS)
+	def open(self, path, svg=False, names=None, workers=1):
+		"""
+		Load the GDSII file path in memory (self.objs)
+		The StructIndex of the file is built while reading and stored in self.index.
+		
+		Arguments:
+		----------
+		path: the path of the GDSII file
+		svg: if True, write a preview path_STRNAME.svg for each structure (see gdsrender)
+		names: if given, only load the library header and the structures listed
+			(located with the sidecar index path.idx if it is up to date, or a quick scan)
+		workers: number of worker processes parsing the structures (None: one per CPU, see openParallel)
+		"""
+		self.objs=RecordStore()
+		self.bboxes=None
+		if workers is None:
+			workers=os.cpu_count() or 1
+		if workers>1:
+			self.openParallel(path,names,workers)
+		else:
+			self.openSerial(path,names)
+		if svg:
+			import gdsrender
+			for t in self.objs.tables:
+				gdsrender.svg(self,t.name,path+"_"+t.name+".svg")
+				
+	def openSerial(self, path, names=None):
+		"""
+		Load the GDSII file path in memory in this process (see open)
+		"""
+		self.objs=RecordStore()
+		self.bboxes=None
+		if names is None:
+			self.index=StructIndex(path)
+			self.index.header=None
+			self.index.end=self.index.size
+			ranges=[(0,None)]
+		else:
+			self.index=loadIndex(path)
+			ranges=[(0,self.index.header)]+[self.index[n][:2] for n in names]+[(self.index.end,None)]
+		idx=self.index
+		with GDSReader(path) as r:
+			for start,stop in ranges:
+				for code,pos,data in r.records(start,stop):
+					self.objs.addRaw(code,data)
+					if names is None:
+						if code==0x0502: # BGNSTR
+							begin=pos
+							if idx.header is None: idx.header=pos
+						elif code==0x0700: # ENDSTR
+							t=self.objs.tables[-1]
+							idx.structs[t.name]=[begin,pos+4,t.first,t.last]
+						elif code==0x0400: # ENDLIB
+							idx.end=pos
+		self.objs.trim()
+		self.structs=[[t.first,t.last] for t in self.objs.tables]
+		
+	def openParallel(self, path, names=None, workers=None, chunks=4):
+		"""
+		Load the GDSII file path in memory with a pool of worker processes.
+		The structures are located with the StructIndex (sidecar or quick scan), split into
+		workers*chunks groups of similar size in bytes and parsed by the workers reading the
+		file through their own mmap. The RecordStores returned are merged in file order.
+		"""
+		from concurrent.futures import ProcessPoolExecutor
+		if workers is None:
+			workers=os.cpu_count() or 1
+		self.objs=RecordStore()
+		self.bboxes=None
+		self.index=idx=loadIndex(path)
+		if names is None:
+			names=sorted(idx.names(),key=lambda n:idx[n][0])
+		ranges=[idx[n][:2] for n in names]
+		# Groups of consecutive structures of about the same size, adjacent ranges joined
+		total=sum(b-a for a,b in ranges)
+		n=max(1,workers*chunks)
+		groups=[[]]
+		size=0
+		for a,b in ranges:
+			if size>=total*len(groups)/float(n):
+				groups.append([])
+			g=groups[-1]
+			if g and g[-1][1]==a:
+				g[-1]=(g[-1][0],b)
 			else:
-				TXT=None
-			if TYPE in self.Type:
-				if self.Type[TYPE] == 'BGNSTR':
-					cs[0]=len(self.objs)
-				elif self.Type[TYPE] == 'ENDSTR':
-					cs[1]=len(self.objs)
-					self.structs.append(cs)
-			if TYPE in self.Type: TYPE=self.Type[TYPE]
-			else: TYPE="??? (%s)"%(binascii.hexlify(TYPE))
-#			if self.f==None:
-#				ob={'TYPE':TYPE,'PARAMS':TXT}
-#				self.objs.append(ob)
-#			else:
-#				if TYPE in ['BOUNDARY','PATH','SREF','AREF','TEXT','NODE','BOX']:
-#					self.f.write("[%s]\n"%(TYPE))
-#				else:
-#					self.f.write("\t[%s]\t%s\n"%(TYPE,TXT))
-#				if TYPE in self.Type: TYPE=self.Type[TYPE]
-#				else: TYPE="??? (%s)"%(binascii.hexlify(TYPE))
-			if TYPE=='STRNAME':
-				t=TXT[0]
-				if t[-1]==b'\x00': t=t[:-1]
-				ff=open(path+"_"+t+".svg","w")
-				ff.write("<svg xmlns=\"http://www.w3.org/2000/svg\">\n")
-				ff.write("<g transform=\"scale(1,-1)\">\n")
-			elif TYPE=='ENDSTR':
-				ff.write("</g>\n</svg>")
-				ff.close()
-			if TYPE in ['BOUNDARY','PATH','SREF','AREF','TEXT','NODE','BOX']:
-				lo=TYPE
-			elif TYPE=='SNAME':
-				los=TXT[0]
-				if los[-1]==b'\x00': los=los[:-1]
-			elif TYPE=='XY':
-				if lo in ['BOUNDARY','PATH']:
-					ff.write("<path d=\"M %i,%i L"%(TXT[0],TXT[1]))
-					for x in zip(TXT[2::2],TXT[3::2]):
-						ff.write(" %i,%i"%x)
-					if lo=='PATH':
-						ff.write("\" fill=\"none\" stroke=\"black")
-					ff.write("\" />\n")
-				if lo in ['SREF','AREF']:
-					ff.write("<g transform=\"scale(1,-1)\"><text x=\"%i\" y=\"%i\" font-size=\"10000\">%s</text></g>\n"%(TXT[0],TXT[1],los))
-					
+				g.append((a,b))
+			size+=b-a
+		with GDSReader(path) as r:
+			for code,pos,data in r.records(0,idx.header):
+				self.objs.addRaw(code,data)
+		with ProcessPoolExecutor(workers) as ex:
+			for st in ex.map(loadRanges,[path]*len(groups),groups):
+				self.objs.merge(st)
+		with GDSReader(path) as r:
+			for code,pos,data in r.records(idx.end,None):
+				self.objs.addRaw(code,data)
+		self.objs.trim()
+		self.structs=[[t.first,t.last] for t in self.objs.tables]
+		
 	def show(self,a=0,b=-1):
 		if b==-1: b=len(self.objs)
 		for x in self.objs[a:b]:
@@ -412,44 +1920,56 @@ class GDSII:
 		r=[]
 		co={}
 		if b==-1: b=len(self.objs)
-		for x in self.objs[a:b]:
-			T=x['TYPE']
-			if T in self.Type: TT=self.Type[T]
-			else: TT="??? (%s)"%(binascii.hexlify(T))
+		names={}
+		for i in range(a,b):
+			code=self.objs.codes[i]
+			TT=names.get(code)
+			if TT is None:
+				T=struct.pack(">H",code)
+				if T in self.Type: TT=self.Type[T]
+				else: TT="??? (%s)"%(binascii.hexlify(T))
+				names[code]=TT
 			if TT in ['BOUNDARY','PATH','SREF','AREF','TEXT','NODE','BOX']:
 				if 'TYPE' in co:
 					r.append(co)
 				co={}
 				co['TYPE']=TT
 			else:
-				co[TT]=x['PARAMS']
+				co[TT]=self.objs.getParams(i)
 		if co!={}: r.append(co)
 		return r
 				
+	def getTable(self, name):
+		"""
+		Return the ElementTable of the structure name
+		"""
+		return self.objs.byName[name]
+		
 	def getstructs(self):
-		r=[]
-		for i in self.structs:
-			s=self.objs[i[0]+1]['PARAMS'][0]
-			if s[-1]==b'\x00': s=s[:-1]
-			r.append(s)
-		return r
+		return [t.name for t in self.objs.tables]
 		
 	def getstruct(self, s):
-		for i in self.structs:
-			ss=self.objs[i[0]+1]['PARAMS'][0]
-			if ss[-1]==b'\x00': ss=ss[:-1]
-			if ss==s:
-				return i
+		t=self.objs.byName.get(s)
+		if t is not None:
+			return [t.first,t.last]
 				
 	def write(self,path):
-		f=open(path,"wb")
-		for x in self.objs:
-			 f.write(self.encodeObj(x['TYPE'],x['PARAMS']))
-		f.close()
+		with open(path,"wb") as f:
+			self.objs.write(f)
 	
 	def playMacro(self):
+		cur=self.currentStructure
 		for x in self.macro:
-			self.addObj(x['TYPE'],x['PARAMS'])
+			self.addObj(x['TYPE'],x['PARAMS'],x.get('AREA'))
+			dose=x.get('DOSE')
+			if dose is None:
+				continue
+			if x['AREA']:
+				self.Area[cur]+=self.LastArea
+				self.DoseArea[cur]+=self.LastArea*dose
+			else:
+				self.Length[cur]+=self.LastLength
+				self.DoseLine[cur]+=self.LastLength*dose
 			
 	def startMacro(self):
 		self.macro=[]
@@ -458,14 +1978,129 @@ class GDSII:
 	def stopMacro(self,type=None):
 		self.enabledMacro=False
 		
-	def MatrixMacro(self,space,N):
-		currentShift=self.shift
-		for y in range(N[1]):
-			for x in range(N[0]):
-				self.playMacro()
-				self.uvShift(x=space[0])
-			self.uvShift(x=-space[0]*N[0],y=space[1])
-		self.shift=currentShift
+	def macroBytes(self, name=None):
+		"""
+		Play the macro in a GDSII writing in memory.
+		If name is given, the macro is written as the structure name with the linear part of the current
+		transformation (see compileMacro), otherwise as elements with the current transformation.
+		Return (binary data, stats) with stats as returned by buildStructs
+		"""
+		buf=io.BytesIO()
+		g=GDSII(buf)
+		g.loops=self.loops
+		g.area=dict(self.area)
+		g.macro=self.macro
+		if name is None:
+			name=self.currentStructure
+			g.currentStructure=name
+			g.ax=None
+			g.area[name]=[float('inf'),float('inf'),-float('inf'),-float('inf')]
+			g.Area[name]=g.Length[name]=g.DoseArea[name]=g.DoseLine[name]=0.0
+			g.T=self.T.copy()
+			g.linear=self.linear
+			g.playMacro()
+		else:
+			g.newStr(name)
+			g.M=self.T[:2,:2]
+			g.playMacro()
+			g.endStr()
+		g.f.flush()
+		stats=dict(area=g.area[name],Area=g.Area[name],Length=g.Length[name],DoseArea=g.DoseArea[name],DoseLine=g.DoseLine[name])
+		return buf.getvalue(),stats
+		
+	def compileMacro(self, name):
+		"""
+		Compile the macro into the structure name, drawn with the linear part of the current transformation,
+		to be placed with SREF/AREF. The structure is written by endLib. Return its stats (see buildStructs)
+		"""
+		data,stats=self.macroBytes(name)
+		self.cells.append((name,data,stats))
+		self.area[name]=stats['area']
+		return stats
+		
+	def addStats(self, stats, n=1):
+		# Add n times the sums of stats (see buildStructs) to the current structure
+		cur=self.currentStructure
+		for k in ('Area','Length','DoseArea','DoseLine'):
+			getattr(self,k)[cur]+=stats[k]*n
+			
+	def writeTemplate(self, data, shifts, size=1<<24):
+		"""
+		Write the records data once per shift of shifts ((n,2) integers) with the coordinates of their XY records shifted
+		"""
+		xy=[]
+		pos=0
+		while pos+4<=len(data):
+			l,code=_HEADER.unpack_from(data,pos)
+			if code==0x1003:
+				xy.append((pos+4,pos+l))
+			pos+=l
+		tpl=np.frombuffer(data,dtype=np.uint8)
+		chunk=max(1,size//max(len(data),1))
+		for i in range(0,len(shifts),chunk):
+			s=shifts[i:i+chunk]
+			out=np.tile(tpl,(len(s),1))
+			for a,b in xy:
+				v=out[:,a:b].view('>i4')
+				v[:,0::2]+=s[:,:1]
+				v[:,1::2]+=s[:,1:]
+			if self.f is not None:
+				self.f.write(out.tobytes())
+			else:
+				self.objs.addBytes(out.tobytes())
+		
+	def MatrixMacro(self,space,N,mode='replay',name=None):
+		"""
+		Repeat the macro on a grid of N[0] x N[1] positions, spaced by space (xy coordinates)
+		
+		Arguments:
+		----------
+		space: the (x,y) spacing of the grid
+		N: the number of (columns, rows)
+		mode: 'replay' (default) to play the macro at each position, 'template' to encode the macro once
+			and shift its XY coordinates for each position (faster, but the shifts are rounded to integers)
+			or 'aref' to compile the macro into a structure placed with one AREF (see compileMacro)
+		name: the name of the structure compiled with 'aref' (default: _M<n>)
+		"""
+		n=N[0]*N[1]
+		if mode=='replay':
+			currentShift=self.shift
+			for y in range(N[1]):
+				for x in range(N[0]):
+					self.playMacro()
+					self.uvShift(x=space[0])
+				self.uvShift(x=-space[0]*N[0],y=space[1])
+			self.shift=currentShift
+		elif mode=='aref':
+			if name is None:
+				name="_M%s%i"%(self.glyphTag,self.nMacros)
+				self.nMacros+=1
+			stats=self.compileMacro(name)
+			x0,y0=self.shift
+			self.uvPush()
+			self.uvReset()
+			self.addObj('AREF')
+			self.addObj('SNAME',name)
+			self.addObj('COLROW',[N[0],N[1]])
+			self.addObj('XY',[x0,y0,x0+N[0]*space[0],y0,x0,y0+N[1]*space[1]])
+			self.addObj(b'\x11\x00')
+			self.uvPop()
+			self.addStats(stats,n)
+		elif mode=='template':
+			if n<=0:
+				return
+			data,stats=self.macroBytes()
+			i=np.arange(n)
+			shifts=np.stack([np.round(i%N[0]*space[0]),np.round(i//N[0]*space[1])],axis=1).astype(np.int64)
+			self.writeTemplate(data,shifts)
+			self.addStats(stats,n)
+			a=stats['area']
+			if a[0]<=a[2]:
+				lo=shifts.min(axis=0)
+				hi=shifts.max(axis=0)
+				self.updateArea(np.array([[a[0]+lo[0],a[1]+lo[1]],[a[2]+hi[0],a[3]+hi[1]]]))
+		else:
+			raise ValueError("Unknown macro mode %r"%(mode))
 			
 	def addFrame(self, x,y,w,h,width=0,dose=1,layer=0,loop=None):
 		"""
@@ -480,50 +2115,50 @@ class GDSII:
 		# The user shouln't take care of this function
 		# The hacker should know that this function converts the object of type t with arguments p to the GDS binary format
 		# The type t, can be either a keyword defined my self.Type, or directly a 2-bytes binary
-		if p==None: p=[]
-		tt=self.getType(t)
-		if tt in self.Type:
-			t=self.Type[tt]
-		else:
-			t='UNKNOWKN'
-		fmt=self.Type2[tt[1:2]]
-		if fmt[1]=='':
-			return struct.pack(">H2s",4,tt)
-		if fmt[0]==-1:
-			if type(p)==list or type(p)==tuple: p=p[0]
-			if p[-1]!='\x00' and len(p)%2==1: p+='\x00'
-			return struct.pack(">H2s%is"%(len(p)),4+len(p),tt,p.encode('ascii'))
-		else:
-			if type(p)!=tuple and type(p)!=list: p=[p]
-			s=struct.pack(">H2s",4+len(p)*fmt[0],tt)
-			for x in p:
-				if fmt[1]=='Q':
-					s+=float2gds(x)
-				else:
-					if fmt[1]=='i': x=int(x)
-					s+=struct.pack(">"+fmt[1],x)
-			return s
+		return encodeRecord(recordCode(self.getType(t)),p)
 			
 	def addObj(self,t,p=[],area=None):
 		if self.enabledMacro:
-			self.macro.append({'TYPE':t,'PARAMS':p})
+			self.macro.append({'TYPE':t,'PARAMS':p,'AREA':area})
 		else:
 			if type(p)==str:
 				if len(p)%2==1: p+'\x00'
-			if type(p)!=list and type(p)!=tuple: p=[p]
+			if not isinstance(p,(list,tuple,np.ndarray)): p=[p]
 			tt=self.getType(t)
+			name=self.Type.get(tt)
+			if name in ('SREF','AREF'):
+				self.ref={'TYPE':name}
+				self.element=name
+			elif name in ('BOUNDARY','PATH','TEXT','NODE','BOX','FBMS'):
+				self.ref=None
+				self.element=name
+				self.halfWidth=0
+			elif name=='WIDTH' and self.element=='PATH':
+				self.halfWidth=abs(p[0])/2.0
+			elif self.ref is not None and name in ('SNAME','STRANS','MAG','ANGLE'):
+				self.ref[name]=p[0]
+				if name=='SNAME': self.ref[name]=p[0].rstrip('\x00')
+			elif self.ref is not None and name=='COLROW':
+				self.ref[name]=tuple(int(x) for x in p)
 			# \x10\x03 is the code for XY
 			if tt==b'\x10\x03':
-				pts=[]
-				for z in zip(p[::2],p[1::2]):
-					uv=self.uv2xy(z)
-					pts+=uv
-				p=pts
-				for i in range(len(p[::2])):
-					if p[::2][i]<self.area[self.currentStructure][0]: self.area[self.currentStructure][0]=p[::2][i]
-					if p[::2][i]>self.area[self.currentStructure][2]: self.area[self.currentStructure][2]=p[::2][i]
-					if p[1::2][i]<self.area[self.currentStructure][1]: self.area[self.currentStructure][1]=p[1::2][i]
-					if p[1::2][i]>self.area[self.currentStructure][3]: self.area[self.currentStructure][3]=p[1::2][i]
+				if isinstance(p,np.ndarray): p=p.ravel().tolist()
+				if len(p)>2*SHORTXY:
+					p=self.uv2xyArray(np.asarray(p,dtype=np.float64).reshape(-1,2)).ravel().tolist()
+				else:
+					p=self.uv2xyList(p)
+			if tt==b'\x10\x03' and self.ref is not None:
+				self.refArea(p)
+			elif tt==b'\x10\x03':
+				if self.normalize and self.element in ('BOUNDARY','PATH'):
+					if len(p)>2*SHORTXY:
+						pts,starts=simplifyShapes(np.trunc(np.reshape(p,(-1,2))),np.array([0,len(p)//2]),self.element=='BOUNDARY',self.tolerance)
+						p=pts.ravel().tolist()
+					else:
+						p=simplifyPoints(p,self.element=='BOUNDARY',self.tolerance)
+					if len(p)>2*MAXPOINTS:
+						raise ValueError("XY records are limited to %i points"%(MAXPOINTS))
+				self.updateArea(p,self.halfWidth if self.element=='PATH' else 0)
 				if area:
 					self.LastArea=1e-18*getArea(p)
 					if self.ax is not None:
@@ -536,18 +2171,28 @@ class GDSII:
 			if self.f != None:
 				self.f.write(self.encodeObj(tt,p))
 			else:
-				self.objs.append({'TYPE':tt,'PARAMS':p})
+				self.objs.add(tt,p)
 				
 	def addLine(self,pts, layer=0, width=0, dose=1,loop=None):
 		if loop==None:
 			loop=self.loops
+		if self.normalize and len(pts)>2*MAXPOINTS:
+			# Too long for an XY record: drawn as consecutive lines
+			p,starts,src=splitShapes(np.asarray(pts,dtype=np.float64).reshape(-1,2),np.array([0,len(pts)//2]),False)
+			for i in range(len(src)):
+				self.addLine(p[starts[i]:starts[i+1]].ravel().tolist(),layer=layer,width=width,dose=dose,loop=loop)
+			return
 		self.addObj('PATH')
 		self.addObj('LAYER',layer)
 		self.addObj('DATATYPE',self.doseEnc(dose))
 		self.addObj('WIDTH',width)
 		self.addObj('XY',pts,area=False)
-		self.Length[self.currentStructure]+=self.LastLength
-		self.DoseLine[self.currentStructure]+=self.LastLength*dose
+		if self.enabledMacro:
+			# Summed when the macro is played
+			self.macro[-1]['DOSE']=dose
+		else:
+			self.Length[self.currentStructure]+=self.LastLength
+			self.DoseLine[self.currentStructure]+=self.LastLength*dose
 		if loop>1:
 			self.writeLoop(loop)
 		# No idea what it is, but Raith write them for each line!
@@ -559,13 +2204,22 @@ class GDSII:
 			loop=self.loops
 		if pos[-2]!=pos[0] or pos[-1]!=pos[1]:
 			pos+=pos[0:2]
+		if self.normalize and len(pos)>2*MAXPOINTS:
+			# Too large for an XY record: cut into bands
+			p,starts,src=splitShapes(np.asarray(pos,dtype=np.float64).reshape(-1,2),np.array([0,len(pos)//2]))
+			for i in range(len(src)):
+				self.addPoly(p[starts[i]:starts[i+1]].ravel().tolist(),layer=layer,dose=dose,loop=loop,fmode=fmode,dmode=dmode,adir=adir)
+			return
 		# pos=[x1,y1,x2,y2,x3,y3,...,x1,y1]
 		self.addObj('BOUNDARY')
 		self.addObj('LAYER',layer)
 		self.addObj('DATATYPE',self.doseEnc(dose))
 		self.addObj('XY',pos,area=True)
-		self.Area[self.currentStructure]+=self.LastArea
-		self.DoseArea[self.currentStructure]+=self.LastArea*dose
+		if self.enabledMacro:
+			self.macro[-1]['DOSE']=dose
+		else:
+			self.Area[self.currentStructure]+=self.LastArea
+			self.DoseArea[self.currentStructure]+=self.LastArea*dose
 		if loop>1:
 			self.writeLoop(loop)
 		if fmode!=None:
@@ -577,7 +2231,55 @@ class GDSII:
 		self.addObj(b'\x11\x00')
 
 	def getArea(self, st):
-		return self.area[st]
+		"""
+		Return the boundary [xmin,ymin,xmax,ymax] of the structure st, references included.
+		For the structures generated by this instance, it is tracked while writing,
+		otherwise (loaded structures) it is computed from the hierarchy (see getBBox).
+		"""
+		if st in self.area:
+			a=self.area[st]
+			if a[0]>a[2]:
+				return [0,0,0,0]
+			return a
+		b=self.getBBox(st)
+		if b is None:
+			return [0,0,0,0]
+		return b
+		
+	def getBBox(self, st):
+		"""
+		Return the hierarchical bounding box of the stored structure st (None if empty).
+		The boxes of the structures are memoized. The structures written to a file (DirectWrite)
+		return the boundary tracked while writing.
+		"""
+		import gdsflat
+		if self.f is not None and st in self.area:
+			a=self.area[st]
+			if a[0]>a[2]:
+				return None
+			return list(a)
+		if self.bboxes is None:
+			self.bboxes=gdsflat.BBoxes(self)
+		return self.bboxes.get(st)
+		
+	def refArea(self, p):
+		# Extend the boundary of the current structure to the reference self.ref placed at p [x1,y1,...]
+		import gdsflat
+		pts=np.array(p,dtype=np.float64).reshape(-1,2)
+		r=self.ref
+		self.ref=None
+		a=self.area.get(r.get('SNAME'))
+		if a is None or a[0]>a[2]:
+			return
+		L=gdsflat.refMatrix(r.get('STRANS',0),r.get('MAG',1.0),r.get('ANGLE',0.0))
+		if r['TYPE']=='AREF' and len(pts)>=3:
+			cols,rows=r.get('COLROW',(1,1))
+			trs=gdsflat.arefTranslations(pts[:3],cols,rows)
+			trs=trs[[0,cols-1,len(trs)-cols,len(trs)-1]]
+		else:
+			trs=pts[:1]
+		b=gdsflat.transformBBox(a,L,trs)
+		self.updateArea(np.array([b[:2],b[2:]]))
 		
 	def millInfo(self, structure, BeamCurrent=3e-11, AreaDose=1, LineDose=1e-8):
 		Area   = self.Area[structure]
@@ -587,17 +2289,19 @@ class GDSII:
 		return dict(area=Area*1e12,length=Length*1e6,dose=Dose*1e9,time=Time)
 		
 	def new(self,name='TEST'):
-		self.objs=[]
+		self.objs=RecordStore()
+		self.bboxes=None
+		self.glyphs=OrderedDict()
+		self.cells=[]
 		self.addObj('HEADER',3)
 		self.addObj('BGNLIB',[2010,1,1,0,0,0,2010,1,1,0,0,0])
 		self.addObj('LIBNAME',[name])
 		self.addObj('UNITS',[0.001,1e-09])
 		
 	def newStr(self, name, ax = None):
-		self.shift=[0,0]
-		self.M=[[1,0],[0,1]]
+		self.uvReset()
 		self.currentStructure = name
-		self.area[name] = [0,0,0,0]
+		self.area[name] = [float('inf'),float('inf'),-float('inf'),-float('inf')]
 		self.Area[name]     = 0.0
 		self.DoseArea[name] = 0.0
 		self.DoseLine[name] = 0.0
@@ -615,20 +2319,113 @@ class GDSII:
 	def endStr(self):
 		self.addObj('ENDSTR')
 		
+	def glyphCell(self, c, scale, layer, width, dose, loop):
+		"""
+		Return [cell name, length of the strokes (m), written] of the glyph c of FONT drawn at the given
+		scale (database units per font unit). The cell is registered on first use and written by endLib.
+		"""
+		key=(c,scale,layer,width,dose,loop)
+		g=self.glyphs.get(key)
+		if g is None:
+			name="_G%s%02X_%i"%(self.glyphTag,ord(c),len(self.glyphs))
+			strokes=[np.trunc(np.array(k,dtype=np.float64)*scale) for k in FONT[c]]
+			pts,starts=shapeArrays(np.concatenate(strokes),np.cumsum([0]+[len(k) for k in strokes]))
+			hw=abs(width)/2.0
+			self.area[name]=(pts.min(axis=0)-hw).tolist()+(pts.max(axis=0)+hw).tolist()
+			g=self.glyphs[key]=[name,1e-9*float(getLengths(pts,starts).sum()),False]
+		return g
+		
+	def writeGlyphs(self):
+		"""
+		Write the cells of the glyphs registered by glyphCell not written yet
+		"""
+		for key,g in self.glyphs.items():
+			if not g[2]:
+				self.writeGlyph(key)
+				
+	def writeGlyph(self, key):
+		# Write the cell of the glyph key (see glyphCell)
+		c,scale,layer,width,dose,loop=key
+		g=self.glyphs[key]
+		self.newStr(g[0])
+		for k in FONT[c]:
+			pts=np.trunc(np.array(k,dtype=np.float64)*scale)
+			self.addLine(pts.ravel().tolist(),dose=dose,layer=layer,loop=loop,width=width)
+		self.endStr()
+		g[2]=True
+		
+	def addStrBytes(self, name, data, stats=None):
+		"""
+		Append the structure name given as GDSII binary data (BGNSTR to ENDSTR).
+		stats are its boundary and sums (area, Area, Length, DoseArea, DoseLine) as returned by buildStructs.
+		"""
+		if self.f is not None:
+			self.StrPos[name]=self.f.tell()
+			self.f.write(data)
+		else:
+			self.StrPos[name]=None
+			self.objs.addBytes(data)
+		if stats is not None:
+			self.area[name]=stats['area']
+			self.Area[name]=stats['Area']
+			self.Length[name]=stats['Length']
+			self.DoseArea[name]=stats['DoseArea']
+			self.DoseLine[name]=stats['DoseLine']
+			
+	def addStructs(self, func, jobs, workers=None, chunk=1):
+		"""
+		Generate structures in parallel worker processes and append them in the order of jobs.
+		Each structure is drawn by func(g, *args, **kargs) between g.newStr(name) and g.endStr(),
+		func must be a module-level function (it is sent to the workers).
+		The structures can reference the structures written before the call, not each other
+		(except those generated earlier in the same chunk).
+		
+		Arguments:
+		----------
+		func: the function drawing a structure
+		jobs: list of (name, args) or (name, args, kargs)
+		workers: number of worker processes (None: one per CPU, 1: in this process)
+		chunk: number of structures generated per task
+		"""
+		from concurrent.futures import ProcessPoolExecutor
+		jobs=[(j[0],tuple(j[1]),j[2] if len(j)>2 else {}) for j in jobs]
+		batches=[jobs[i:i+chunk] for i in range(0,len(jobs),chunk)]
+		n=len(batches)
+		if workers is None:
+			workers=os.cpu_count() or 1
+		if workers<=1 or n<=1:
+			res=[buildStructs(func,b,self.area,self.loops,"%i_"%(i)) for i,b in enumerate(batches)]
+			for r in res:
+				for name,data,stats in r:
+					self.addStrBytes(name,data,stats)
+			return
+		with ProcessPoolExecutor(workers) as ex:
+			for r in ex.map(buildStructs,[func]*n,batches,[self.area]*n,[self.loops]*n,["%i_"%(i) for i in range(n)]):
+				for name,data,stats in r:
+					self.addStrBytes(name,data,stats)
+		
+	def writeCells(self):
+		"""
+		Write the compiled macros (see compileMacro) not written yet
+		"""
+		for name,data,stats in self.cells:
+			self.addStrBytes(name,data,stats)
+		self.cells=[]
+		
 	def endLib(self):
+		self.writeGlyphs()
+		self.writeCells()
 		self.addObj('ENDLIB')
+		if self.f is not None:
+			self.f.flush()
+		else:
+			self.objs.trim()
 		
 	def addCircle(self, pos, radius, npts=10, layer=0, width=0, dose=1, A=0, B=360,loop=None):
 		if loop==None:
 			loop=self.loops
-		coords=[]
-		A*=math.pi/180
-		B*=math.pi/180
-		for i in range(npts+1):
-			x=pos[0]+radius*math.cos(A+(B-A)*i/npts)
-			y=pos[1]+radius*math.sin(A+(B-A)*i/npts)
-			coords+=[int(x),int(y)]
-		self.addLine(coords,dose=dose,width=width,layer=layer)
+		coords=np.trunc(np.asarray(pos[:2],dtype=np.float64)+radius*circleTemplate(npts,A,B)).astype(np.int64)
+		self.addLine(coords.ravel().tolist(),dose=dose,width=width,layer=layer)
 		if loop>1:
 			self.writeLoop(loop)
 			
@@ -648,74 +2445,227 @@ class GDSII:
 		"""
 		if loop==None:
 			loop=self.loops
-		coords=[]
-		A*=math.pi/180
-		B*=math.pi/180
-		for i in range(npts+1):
-			x=pos[0]+radius*math.cos(A+(B-A)*i/npts)
-			y=pos[1]+radius*math.sin(A+(B-A)*i/npts)
-			coords+=[int(x),int(y)]
-		self.addPoly(coords,dose=dose,layer=layer)
+		coords=np.trunc(np.asarray(pos[:2],dtype=np.float64)+radius*circleTemplate(npts,A,B)).astype(np.int64)
+		self.addPoly(coords.ravel().tolist(),dose=dose,layer=layer)
 		if loop>1:
 			self.writeLoop(loop)
 			
+	def circlePoints(self, pos, radius, npts, A, B):
+		# (N,npts+1,2) vertices of the circles of centers pos (N,2) and radius (scalar or N values)
+		pos=np.asarray(pos,dtype=np.float64).reshape(-1,2)
+		radius=np.broadcast_to(np.asarray(radius,dtype=np.float64),len(pos))
+		return np.trunc(pos[:,None,:]+radius[:,None,None]*circleTemplate(npts,A,B))
+		
+	def addDisks(self, pos, radius, npts=10, layer=0, dose=1, A=0, B=360, loop=None):
+		"""
+		Add many filled circles at once (vectorized addDisk, see addPolys)
+		
+		Arguments:
+		----------
+		pos: the (N,2) centers of the circles
+		radius: the radius (scalar or one per circle)
+		npts, A, B: see addDisk
+		layer, dose: scalars or one value per circle
+		loop: The number of loop (only useful for FIB patterning, not for E-beam)
+		"""
+		self.addPolys(self.circlePoints(pos,radius,npts,A,B),layer=layer,dose=dose,loop=loop)
+		
+	def addCircles(self, pos, radius, npts=10, layer=0, width=0, dose=1, A=0, B=360, loop=None):
+		"""
+		Add many circles (lines) at once (vectorized addCircle, see addLines)
+		"""
+		self.addLines(self.circlePoints(pos,radius,npts,A,B),layer=layer,width=width,dose=dose,loop=loop)
+		
 	def close(self):
 		self.f.close()
 		
+	def writeElements(self, kind, pts, starts, layer=0, datatype=0, width=None, loop=1):
+		"""
+		Encode N elements at once and write them (or add them to self.objs)
+		
+		Arguments:
+		----------
+		kind: the element record code (0x0800 for BOUNDARY, 0x0900 for PATH)
+		pts, starts: the points (already transformed) and the index of the first point of each element
+		layer, datatype, width: scalars or arrays of N values
+		loop: Raith loop count
+		"""
+		N=len(starts)-1
+		if N<=0:
+			return
+		if self.normalize:
+			pts,starts,src=normalizeShapes(pts,starts,kind!=0x0900,self.tolerance)
+			if len(src)!=N:
+				layer=np.broadcast_to(layer,N)[src]
+				datatype=np.broadcast_to(datatype,N)[src]
+				if width is not None:
+					width=np.broadcast_to(width,N)[src]
+				N=len(src)
+		counts=np.diff(starts)
+		if counts.max()>MAXPOINTS:
+			raise ValueError("XY records are limited to %i points"%(MAXPOINTS))
+		xy=pts.astype(np.int32).astype('>i4')
+		head=[('eh','>u2',2),('lh','>u2',2),('layer','>i2'),('dh','>u2',2),('datatype','>i2')]
+		if width is not None:
+			head+=[('wh','>u2',2),('width','>i4')]
+		head+=[('xh','>u2',2)]
+		tail=[]
+		if loop>1:
+			tail+=[('loop','V16')]
+		tail+=[('end','>u2',2)]
+		uniform=(counts==counts[0]).all()
+		if uniform:
+			a=np.zeros(N,dtype=head+[('xy','>i4',(counts[0],2))]+tail)
+			a['xy']=xy.reshape(N,counts[0],2)
+		else:
+			a=np.zeros(N,dtype=head)
+		a['eh']=(4,kind)
+		a['lh']=(6,0x0D02)
+		a['layer']=layer
+		a['dh']=(6,0x0E02)
+		a['datatype']=datatype
+		if width is not None:
+			a['wh']=(8,0x0F03)
+			a['width']=width
+		a['xh'][:,0]=4+8*counts
+		a['xh'][:,1]=0x1003
+		lp=b''
+		if loop>1:
+			lp=encodeRecord(0x6306,b'\xaa'+b'\x00'*7+struct.pack("<I",int(loop)))
+		if uniform:
+			if loop>1:
+				a['loop']=np.void(lp)
+			a['end']=(4,0x1100)
+			data=a.tobytes()
+		else:
+			# The headers, XY payloads and ends are scattered into one buffer of 4-bytes words
+			pre=np.frombuffer(a.tobytes(),dtype=np.uint32).reshape(N,-1)
+			post=np.frombuffer(lp+_HEADER.pack(4,0x1100),dtype=np.uint32)
+			H=pre.shape[1]
+			size=H+2*counts+len(post)
+			o=np.zeros(N,dtype=np.int64)
+			np.cumsum(size[:-1],out=o[1:])
+			buf=np.empty(int(size.sum()),dtype=np.uint32)
+			buf[o[:,None]+np.arange(H)]=pre
+			buf[np.repeat(o+H-2*starts[:-1],2*counts)+np.arange(2*int(starts[-1]))]=xy.view(np.uint32).ravel()
+			buf[(o+H+2*counts)[:,None]+np.arange(len(post))]=post
+			data=buf.tobytes()
+		if self.f is not None:
+			self.f.write(data)
+		else:
+			self.objs.addBytes(data)
+			
+	def updateArea(self, pts, hw=0):
+		# Extend the boundary of the current structure to the points pts ((P,2) array or list [x1,y1,x2,y2,...])
+		# enlarged by hw (half width of the paths, scalar or (P,1) array)
+		if len(pts)==0: return
+		a=self.area[self.currentStructure]
+		if isinstance(pts,list):
+			mi=(min(pts[::2])-hw,min(pts[1::2])-hw)
+			ma=(max(pts[::2])+hw,max(pts[1::2])+hw)
+		elif np.ndim(hw):
+			mi=(pts-hw).min(axis=0)
+			ma=(pts+hw).max(axis=0)
+		else:
+			mi=pts.min(axis=0)-hw
+			ma=pts.max(axis=0)+hw
+		a[0]=min(a[0],float(mi[0]))
+		a[1]=min(a[1],float(mi[1]))
+		a[2]=max(a[2],float(ma[0]))
+		a[3]=max(a[3],float(ma[1]))
+		
+	def addPolys(self, polys, offsets=None, layer=0, dose=1, loop=None):
+		"""
+		Add many polygons at once (vectorized addPoly)
+		
+		Arguments:
+		----------
+		polys: N polygons of K points ((N,K,2) or (N,2K) array) or the flat coordinates
+			[x1,y1,x2,y2,...] of all the polygons if offsets is given
+		offsets: the index (in points) of the first point of each polygon
+		layer: the layer id (scalar or one per polygon)
+		dose: the dose (scalar or one per polygon)
+		loop: The number of loop (only useful for FIB patterning, not for E-beam)
+		"""
+		if loop==None:
+			loop=self.loops
+		pts,starts=closeShapes(*shapeArrays(polys,offsets))
+		if self.enabledMacro or getattr(self,'ax',None) is not None:
+			dose=np.broadcast_to(dose,len(starts)-1)
+			layer=np.broadcast_to(layer,len(starts)-1)
+			for i in range(len(starts)-1):
+				self.addPoly(pts[starts[i]:starts[i+1]].ravel().tolist(),layer=int(layer[i]),dose=float(dose[i]),loop=loop)
+			return
+		pts=self.uv2xyArray(pts)
+		self.updateArea(pts)
+		area=1e-18*getAreas(pts,starts)
+		self.Area[self.currentStructure]+=float(area.sum())
+		self.DoseArea[self.currentStructure]+=float((area*dose).sum())
+		self.writeElements(0x0800,pts,starts,layer=layer,datatype=self.doseEncArray(dose),loop=loop)
+		
+	def addLines(self, lines, offsets=None, layer=0, width=0, dose=1, loop=None):
+		"""
+		Add many lines (paths) at once (vectorized addLine)
+		
+		Arguments:
+		----------
+		lines: N lines of K points ((N,K,2) or (N,2K) array) or the flat coordinates
+			[x1,y1,x2,y2,...] of all the lines if offsets is given
+		offsets: the index (in points) of the first point of each line
+		layer, width, dose: scalars or one value per line
+		loop: The number of loop (only useful for FIB patterning, not for E-beam)
+		"""
+		if loop==None:
+			loop=self.loops
+		pts,starts=shapeArrays(lines,offsets)
+		if self.enabledMacro or getattr(self,'ax',None) is not None:
+			N=len(starts)-1
+			dose=np.broadcast_to(dose,N)
+			layer=np.broadcast_to(layer,N)
+			width=np.broadcast_to(width,N)
+			for i in range(N):
+				self.addLine(pts[starts[i]:starts[i+1]].ravel().tolist(),layer=int(layer[i]),width=int(width[i]),dose=float(dose[i]),loop=loop)
+			return
+		pts=self.uv2xyArray(pts)
+		self.updateArea(pts,np.repeat(np.abs(np.broadcast_to(width,len(starts)-1))/2.0,np.diff(starts))[:,None])
+		length=1e-9*getLengths(pts,starts)
+		self.Length[self.currentStructure]+=float(length.sum())
+		self.DoseLine[self.currentStructure]+=float((length*dose).sum())
+		self.writeElements(0x0900,pts,starts,layer=layer,datatype=self.doseEncArray(dose),width=width,loop=loop)
+		
+	def addRects(self, rects, layer=0, dose=1, CCW=False, loop=None):
+		"""
+		Add many rectangles at once (vectorized addRect)
+		
+		Arguments:
+		----------
+		rects: (N,4) array of [x,y,w,h]
+		layer, dose: scalars or one value per rectangle
+		"""
+		r=np.asarray(rects,dtype=np.float64).reshape(-1,4)
+		x0=r[:,0]
+		y0=r[:,1]
+		x1=x0+r[:,2]
+		y1=y0+r[:,3]
+		if CCW:
+			p=[x0,y0,x1,y0,x1,y1,x0,y1,x0,y0]
+		else:
+			p=[x0,y0,x0,y1,x1,y1,x1,y0,x0,y0]
+		self.addPolys(np.stack(p,axis=1),layer=layer,dose=dose,loop=loop)
+		
 	def addRect(self, pos, layer=0, dose=1,CCW=False,loop=None):
 		if loop==None:
 			loop=self.loops
 		# pos=[x,y,w,h]
 		if CCW:
-			self.addPoly([pos[0],pos[1],pos[0]+pos[2],pos[1],pos[0]+pos[2],pos[1]+pos[3],pos[0],pos[1]+pos[3],pos[0],pos[1]],dose=does,layer=layer,loop=loop)
+			self.addPoly([pos[0],pos[1],pos[0]+pos[2],pos[1],pos[0]+pos[2],pos[1]+pos[3],pos[0],pos[1]+pos[3],pos[0],pos[1]],dose=dose,layer=layer,loop=loop)
 		else:
 			self.addPoly([pos[0],pos[1],pos[0],pos[1]+pos[3],pos[0]+pos[2],pos[1]+pos[3],pos[0]+pos[2],pos[1],pos[0],pos[1]],dose=dose,layer=layer,loop=loop)
 			
-	def addText(self, pos, txt, height=None, mag=22.22222, layer=0, width=0, dose=1,angle=0,loop=None, align='NW',custom=False, mirror=False):
-		# Custom Font
-		font={	'0':[[(0,0),(1,0),(1,2),(0,2),(0,0)]],
-			'1':[[(.5,0),(.5,2)]],
-			'2':[[(0,2),(1,2),(1,1),(0,1),(0,0),(1,0)]],
-			'3':[[(0,0),(1,0),(1,2),(0,2)],[(0,1),(1,1)]],
-			'4':[[(0,2),(0,1),(1,1)],[(1,2),(1,0)]],
-			'5':[[(0,0),(1,0),(1,1),(0,1),(0,2),(1,2)]],
-			'6':[[(1,2),(0,2),(0,0),(1,0),(1,1),(0,1)]],
-			'7':[[(0,2),(1,2),(0,0)],[(0,1),(1,1)]],
-			'8':[[(0,1),(1,1),(1,2),(0,2),(0,0),(1,0),(1,1)]],
-			'9':[[(0,0),(1,0),(1,2),(0,2),(0,1),(1,1)]],
-			'A':[[(0,0),(0,2),(1,2),(1,0)],[(0,1),(1,1)]],
-			'B':[[(0,0),(0,2),(1,1.5),(0,1),(1,0.5),(0,0)]],
-			'C':[[(1,0),(0,0),(0,2),(1,2)]],
-			'D':[[(0,0),(0,2),(1,1),(0,0)]],
-			'E':[[(1,0),(0,0),(0,2),(1,2)],[(0,1),(1,1)]],
-			'F':[[(0,0),(0,2),(1,2)],[(0,1),(1,1)]],
-			'G':[[(1,2),(0,2),(0,0),(1,0),(1,1),(0.5,1)]],
-			'H':[[(0,0),(0,2)],[(1,0),(1,2)],[(0,1),(1,1)]],
-			'I':[[(0.5,0),(0.5,2)],[(0,0),(1,0)],[(0,2),(1,2)]],
-			'J':[[(0,2),(1,2),(1,0),(0,0),(.5,.5)]],
-			'K':[[(0,0),(0,2)],[(1,2),(0,1),(1,0)]],
-			'L':[[(0,2),(0,0),(1,0)]],
-			'M':[[(0,0),(0,2),(0.5,1),(1,2),(1,0)]],
-			'N':[[(0,0),(0,2),(1,0),(1,2)]],
-			'O':[[(0,0),(1,0),(1,2),(0,2),(0,0)]],
-			'P':[[(0,0),(0,2),(1,2),(1,1),(0,1)]],
-			'Q':[[(0.5,0.5),(1,0),(1,2),(0,2),(0,0),(1,0)]],
-			'R':[[(0,0),(0,2),(1,2),(1,1),(0,1),(1,0)]],
-			'S':[[(0,0),(1,0),(1,1),(0,1),(0,2),(1,2)]],
-			'T':[[(0,2),(1,2)],[(0.5,0),(0.5,2)]],
-			'U':[[(0,2),(0,0),(1,0),(1,2)]],
-			'V':[[(0,2),(.5,0),(1,2)]],
-			'W':[[(0,2),(0,0),(.5,1),(1,0),(1,2)]],
-			'X':[[(0,0),(1,2)],[(0,2),(1,0)]],
-			'Y':[[(0,2),(.5,1),(1,2)],[(.5,1),(.5,0)]],
-			'Z':[[(0,2),(1,2),(0,0),(1,0)]],
-			'+':[[(0.5,0),(0.5,2)],[(0,1),(1,1)]],
-			'-':[[(0,1),(1,1)]],
-			'=':[[(0,.75),(1,.75)],[(0,.25),(1,.25)]],
-			'.':[[(.33,0),(.33,.33),(.66,.33),(.66,0),(.33,0)]],
-			'?':[[(0,0),(1,2),(0,2),(0,0),(1,0),(1,2)],[(0,2),(1,0)]],
-			' ':[]
-			}
+	def addText(self, pos, txt, height=None, mag=22.22222, layer=0, width=0, dose=1,angle=0,loop=None, align='NW',custom=False, mirror=False, cell=False):
+		# custom: draw the text with the strokes of FONT (height in micron)
+		# cell: with the custom font, place each glyph as a reference to a cell drawn once (see glyphCell)
+		#	instead of drawing its strokes (always done if the uv transformation is not a similarity)
 		# height is given in micron!
 		if loop==None:
 			loop=self.loops
@@ -742,8 +2692,7 @@ class GDSII:
 				self.writeLoop(loop)
 			self.addObj(b'\x11\x00')
 		else:
-			bckShift = self.shift[:]
-			bckMatr = self.M[:]
+			self.uvPush()
 			length=2*len(txt)-1
 			self.uvShift(x=pos[0],y=pos[1])
 			dx=length/2.0
@@ -761,16 +2710,34 @@ class GDSII:
 			if mirror:
 				self.uvMirror(x=True)
 				dx-=length
-			self.uvScale(x=500*height,y=500*height)
-			for x in enumerate(txt):
-				t='?'
-				if x[1] in font:
-					t=x[1]
-				else:
-					if x[1].upper() in font:
-						t=x[1].upper()
-				for k in font[t]:
-					pts=[[dx+z[0]+x[0]*2,dy+z[1]][i] for z in k for i in range(2)]
-					self.addLine(pts,dose=dose,layer=layer,loop=loop,width=width)
-			self.shift = bckShift[:]
-			self.M = bckMatr[:]
\ No newline at end of file
+			# The glyph cells are not used in macros (their length is summed when placed)
+			ref=refParams(self.T[:2,:2]) if cell and not self.enabledMacro else None
+			if ref is None:
+				self.uvScale(x=500*height,y=500*height)
+				for x in enumerate(txt):
+					for k in FONT[glyphName(x[1])]:
+						pts=[[dx+z[0]+x[0]*2,dy+z[1]][i] for z in k for i in range(2)]
+						self.addLine(pts,dose=dose,layer=layer,loop=loop,width=width)
+			else:
+				# Each glyph is a cell (written by endLib) placed with a SREF
+				strans,m,ang=ref
+				s=500*height
+				for i,c in enumerate(txt):
+					c=glyphName(c)
+					if not FONT[c]:
+						continue
+					# The width of the strokes is scaled by the MAG of the reference
+					name,glen,written=self.glyphCell(c,s,layer,int(round(width/m)),dose,loop)
+					self.addObj('SREF')
+					self.addObj('SNAME',name)
+					if strans:
+						self.addObj('STRANS',strans)
+					if m!=1:
+						self.addObj('MAG',float(m))
+					if ang!=0:
+						self.addObj('ANGLE',float(ang))
+					self.addObj('XY',[s*(dx+2*i),s*dy])
+					self.addObj(b'\x11\x00')
+					self.Length[self.currentStructure]+=glen*m
+					self.DoseLine[self.currentStructure]+=glen*m*dose
+			self.uvPop()
\ No newline at end of file
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# *-* coding: utf-8 *-*
+
+# Boolean operations on polygons (union, intersection, difference, xor)
+#
+# The plane is cut into horizontal slabs at the y of the vertices and of the edge crossings.
+# Inside a slab no edges cross, so the edges spanning it are sorted along x and the windings
+# of the two operands summed from left to right: the gaps where the operation holds are the
+# trapezoids of the result. The edges of all the slabs are handled at once with NumPy
+# (one sort per pass), then the trapezoids stacked one on the other are joined into y-monotone
+# polygons, so a disk or a rectangle stays a single polygon. Large sets of polygons are cut into
+# vertical strips, so the slabs of a strip only hold its own edges.
+
+import numpy as np
+import gds
+import gdsflat
+
+UNION='or'
+INTERSECTION='and'
+DIFFERENCE='not'
+XOR='xor'
+
+OPS={
+	UNION:lambda a,b:a|b,
+	INTERSECTION:lambda a,b:a&b,
+	DIFFERENCE:lambda a,b:a&~b,
+	XOR:lambda a,b:a^b,
+}
+
+def edges(pts, starts):
+	"""
+	Return the non-horizontal edges (x0,y0,x1,y1,w) of the polygons (pts, starts) going upward (y0<y1)
+	and their winding w (+1/-1), the polygons being oriented counterclockwise
+	"""
+	pts,starts=gds.closeShapes(np.asarray(pts,dtype=np.float64),np.asarray(starts,dtype=np.int64))
+	if len(pts)<2:
+		z=np.zeros(0)
+		return z,z,z,z,z
+	seg=np.ones(len(pts),dtype=bool)
+	seg[starts[1:]-1]=False
+	seg[-1]=False
+	i=np.nonzero(seg)[0]
+	a=pts[i]
+	b=pts[i+1]
+	# Signed areas of the polygons, to orient them counterclockwise
+	c=np.zeros(len(pts))
+	c[i]=a[:,0]*b[:,1]-b[:,0]*a[:,1]
+	sign=np.where(np.add.reduceat(c,starts[:-1])<0,-1.0,1.0)
+	poly=np.repeat(np.arange(len(starts)-1),np.diff(starts))[i]
+	dy=b[:,1]-a[:,1]
+	k=dy!=0
+	a,b,dy,poly=a[k],b[k],dy[k],poly[k]
+	up=dy>0
+	w=np.where(up,1.0,-1.0)*sign[poly]
+	lo=np.where(up[:,None],a,b)
+	hi=np.where(up[:,None],b,a)
+	return lo[:,0],lo[:,1],hi[:,0],hi[:,1],w
+
+def sweep(x0, y0, x1, y1, ys):
+	"""
+	Return the pairs (edge, slab) of the edges spanning the slabs [ys[s],ys[s+1]] and the x of the edges
+	at the bottom and top of the slabs, sorted by slab then along x
+	"""
+	lo=np.searchsorted(ys,y0)
+	n=np.searchsorted(ys,y1)-lo
+	offs=np.zeros(len(n),dtype=np.int64)
+	np.cumsum(n[:-1],out=offs[1:])
+	e=np.repeat(np.arange(len(n)),n)
+	s=np.arange(n.sum())-np.repeat(offs,n)+lo[e]
+	# The vertical edges (the borders of the strips may be at infinity) have no slope
+	dx=np.zeros(len(x0))
+	np.subtract(x1,x0,out=dx,where=x1!=x0)
+	slope=dx/(y1-y0)
+	xb=x0[e]+(ys[s]-y0[e])*slope[e]
+	xt=x0[e]+(ys[s+1]-y0[e])*slope[e]
+	o=np.lexsort((xt,xb+xt,s))
+	return e[o],s[o],xb[o],xt[o]
+
+def trapezoids(x0, y0, x1, y1, wa, wb, op=UNION, eps=1e-9):
+	"""
+	Return the trapezoids t (yb, yt, xl bottom, xr bottom, xl top, xr top) where op holds between the
+	windings wa and wb of the edges (see edges) and their slabs s, sorted by slab then along x.
+	The x closer than eps (relative to the largest coordinate) are considered equal.
+	"""
+	f=OPS[op]
+	k=y1>y0
+	x0,y0,x1,y1,wa,wb=x0[k],y0[k],x1[k],y1[k],wa[k],wb[k]
+	c=np.abs(np.concatenate([x0,x1,y0,y1]))
+	eps*=max(1.0,c[np.isfinite(c)].max()) if len(c) else 1.0
+	ys=np.unique(np.concatenate([y0,y1]))
+	while True:
+		e,s,xb,xt=sweep(x0,y0,x1,y1,ys)
+		# Consecutive edges of a slab in the wrong order at its bottom or top cross inside the slab
+		same=s[1:]==s[:-1]
+		cross=same&((xb[1:]<xb[:-1]-eps)|(xt[1:]<xt[:-1]-eps))
+		if not cross.any():
+			break
+		i=np.nonzero(cross)[0]
+		db=xb[i]-xb[i+1]
+		dt=xt[i]-xt[i+1]
+		t=db/(db-dt)
+		y=ys[s[i]]+t*(ys[s[i]+1]-ys[s[i]])
+		n=len(ys)
+		ys=np.unique(np.concatenate([ys,y]))
+		if len(ys)==n:
+			raise ValueError("The crossings of %i edges can't be separated at the float resolution"%(len(i)))
+	# The windings of a slab sum to 0, so the global sums are the sums of each slab
+	inside=f(np.cumsum(wa[e])!=0,np.cumsum(wb[e])!=0)
+	prev=np.concatenate([[False],inside[:-1]])
+	l=np.nonzero(inside&~prev)[0]
+	r=np.nonzero(~inside&prev)[0]
+	s=s[l]
+	t=np.stack([ys[s],ys[s+1],xb[l],xb[r],xt[l],xt[r]],axis=1)
+	if len(t)==0:
+		return t,s
+	# Trapezoids of a slab touching along an edge
+	new=np.ones(len(t),dtype=bool)
+	new[1:]=(s[1:]!=s[:-1])|(np.abs(t[1:,2]-t[:-1,3])>eps)|(np.abs(t[1:,4]-t[:-1,5])>eps)
+	first=np.nonzero(new)[0]
+	last=np.append(first[1:],len(t))-1
+	t=np.concatenate([t[first][:,[0,1,2]],t[last][:,[3]],t[first][:,[4]],t[last][:,[5]]],axis=1)
+	s=s[first]
+	k=(t[:,3]-t[:,2])+(t[:,5]-t[:,4])>eps
+	return t[k],s[k]
+
+def chains(t, s, eps=1e-9):
+	"""
+	Return the index of the trapezoid above each trapezoid of (t, s) (see trapezoids) when they are
+	the only one above and below each other (-1 otherwise)
+	"""
+	X=np.unique(t[:,2:].ravel())
+	M=len(X)+1
+	rank=lambda x:np.searchsorted(X,x)
+	# Trapezoids of the slab s+1 overlapping the top of the trapezoids of the slab s, and conversely
+	lo=np.searchsorted(s*M+rank(t[:,3]),(s+1)*M+rank(t[:,4]),'right')
+	hi=np.searchsorted(s*M+rank(t[:,2]),(s+1)*M+rank(t[:,5]),'left')
+	dlo=np.searchsorted((s+1)*M+rank(t[:,5]),s*M+rank(t[:,2]),'right')
+	dhi=np.searchsorted((s+1)*M+rank(t[:,4]),s*M+rank(t[:,3]),'left')
+	up=np.full(len(t),-1,dtype=np.int64)
+	k=np.nonzero(hi-lo==1)[0]
+	j=lo[k]
+	ok=(dhi[j]-dlo[j]==1)&(np.minimum(t[k,5],t[j,3])-np.maximum(t[k,4],t[j,2])>eps)
+	up[k[ok]]=j[ok]
+	return up
+
+def toPolygons(t, s, maxTraps=2000):
+	"""
+	Return the trapezoids (t, s) (see trapezoids) as closed clockwise polygons (pts, starts).
+	The trapezoids linked by chains are joined into y-monotone polygons (of at most maxTraps trapezoids).
+	"""
+	n=len(t)
+	if n==0:
+		return np.zeros((0,2)),np.zeros(1,dtype=np.int64)
+	up=chains(t,s)
+	down=np.full(n,-1,dtype=np.int64)
+	down[up[up>=0]]=np.nonzero(up>=0)[0]
+	# First trapezoid of each chain (pointer jumping)
+	head=np.where(down>=0,down,np.arange(n))
+	while True:
+		h=head[head]
+		if (h==head).all():
+			break
+		head=h
+	o=np.lexsort((s,head))
+	head=head[o]
+	new=np.ones(n,dtype=bool)
+	new[1:]=head[1:]!=head[:-1]
+	first=np.nonzero(new)[0]
+	pos=np.arange(n)-np.repeat(first,np.diff(np.append(first,n)))
+	# Split the long chains
+	new|=(pos%maxTraps)==0
+	first=np.nonzero(new)[0]
+	k=np.diff(np.append(first,n))
+	grp=np.repeat(np.arange(len(first)),k)
+	pos=np.arange(n)-first[grp]
+	yb,yt,xlb,xrb,xlt,xrt=t[o].T
+	starts=np.zeros(len(first)+1,dtype=np.int64)
+	np.cumsum(4*k+1,out=starts[1:])
+	pts=np.empty((starts[-1],2))
+	base=starts[grp]
+	# Left side going up, right side going down, closed on the first point
+	left=base+2*pos
+	pts[left]=np.stack([xlb,yb],axis=1)
+	pts[left+1]=np.stack([xlt,yt],axis=1)
+	right=base+2*k[grp]+2*(k[grp]-1-pos)
+	pts[right]=np.stack([xrt,yt],axis=1)
+	pts[right+1]=np.stack([xrb,yb],axis=1)
+	pts[starts[1:]-1]=pts[starts[:-1]]
+	return gds.simplifyShapes(pts,starts)
+
+def split(x0, y0, x1, y1, wa, wb, B):
+	"""
+	Cut the edges along the vertical lines x=B (sorted) bounding the strips. Return the pieces
+	(x0,y0,x1,y1,wa,wb) going upward and their strip k (between B[k-1] and B[k]), sorted by strip
+	"""
+	Bx=np.concatenate([[-np.inf],B,[np.inf]])
+	xa=np.minimum(x0,x1)
+	xb=np.maximum(x0,x1)
+	ka=np.searchsorted(B,xa,'right')
+	n=np.maximum(ka,np.searchsorted(B,xb,'left'))-ka+1
+	offs=np.zeros(len(n),dtype=np.int64)
+	np.cumsum(n[:-1],out=offs[1:])
+	e=np.repeat(np.arange(len(n)),n)
+	k=ka[e]+np.arange(n.sum())-np.repeat(offs,n)
+	lo=np.maximum(xa[e],Bx[k])
+	hi=np.minimum(xb[e],Bx[k+1])
+	dx=(x1-x0)[e]
+	inc=dx>0
+	d=np.where(dx==0,1,dx)
+	# Parameters along the edges of the ends of the pieces (increasing y)
+	ta=np.where(dx==0,0,(np.where(inc,lo,hi)-x0[e])/d)
+	tb=np.where(dx==0,1,(np.where(inc,hi,lo)-x0[e])/d)
+	dy=(y1-y0)[e]
+	py0=y0[e]+ta*dy
+	py1=y0[e]+tb*dy
+	px0=np.where(dx==0,x0[e],np.where(inc,lo,hi))
+	px1=np.where(dx==0,x0[e],np.where(inc,hi,lo))
+	keep=py1>py0
+	o=np.argsort(k[keep],kind='stable')
+	e=e[keep][o]
+	return px0[keep][o],py0[keep][o],px1[keep][o],py1[keep][o],wa[e],wb[e],k[keep][o]
+
+def snap(y, tol):
+	"""
+	Return the values y with the values closer than tol to the previous distinct value merged with it
+	"""
+	u,inv=np.unique(y,return_inverse=True)
+	new=np.ones(len(u),dtype=bool)
+	new[1:]=np.diff(u)>tol
+	return u[new][np.cumsum(new)-1][inv.ravel()]
+
+def borderEdges(x, ys, da, db, sign=1):
+	"""
+	Return the vertical edges at x carrying the windings of the steps (ys, da, db) (see boolean)
+	"""
+	Wa=np.cumsum(da)[:-1]*sign
+	Wb=np.cumsum(db)[:-1]*sign
+	k=(Wa!=0)|(Wb!=0)
+	n=k.sum()
+	return np.full(n,x),ys[:-1][k],np.full(n,x),ys[1:][k],Wa[k],Wb[k]
+
+def boolean(a, b=None, op=UNION, size=2048, eps=1e-9):
+	"""
+	Return the polygons (pts, starts) of the boolean operation op between the polygons a and b.
+	The polygons are filled with the non-zero rule, each one being oriented counterclockwise,
+	so the overlaps of the polygons of an operand count once (the self-intersecting polygons
+	can cancel the polygons they overlap).
+	The plane is cut into vertical strips of about size edges processed one after the other, the edges
+	left of a strip being replaced by the vertical edges carrying their windings along its border.
+	The polygons of the result are split along the borders of the strips.
+
+	Arguments:
+	----------
+	a, b: the operands, as (pts, starts) (see gds.shapeArrays)
+	op: UNION, INTERSECTION, DIFFERENCE (a-b) or XOR
+	size: the number of edges per strip
+	eps: the y closer than eps (relative to the largest coordinate) are merged, so the slabs have a height
+	"""
+	ea=edges(*a)
+	eb=edges(*b) if b is not None else edges(np.zeros((0,2)),np.zeros(1,dtype=np.int64))
+	x0,y0,x1,y1,w=[np.concatenate([p,q]) for p,q in zip(ea,eb)]
+	if len(w)==0:
+		return np.zeros((0,2)),np.zeros(1,dtype=np.int64)
+	n=len(ea[4])
+	wa=np.where(np.arange(len(w))<n,w,0)
+	wb=w-wa
+	K=len(w)//size+1
+	B=np.unique(np.round(np.quantile((x0+x1)/2,np.arange(1,K)/K)))
+	Bx=np.concatenate([[-np.inf],B,[np.inf]])
+	px0,py0,px1,py1,pa,pb,k=split(x0,y0,x1,y1,wa,wb,B)
+	# The ends of the pieces of an edge are interpolated: merge the y differing by rounding errors
+	m=len(py0)
+	py=snap(np.concatenate([py0,py1]),eps*max(1.0,np.abs(y0).max(),np.abs(y1).max()))
+	py0,py1=py[:m],py[m:]
+	keep=py1>py0
+	px0,py0,px1,py1,pa,pb,k=[c[keep] for c in (px0,py0,px1,py1,pa,pb,k)]
+	first=np.searchsorted(k,np.arange(len(B)+2))
+	# Steps of the windings of the edges left of the current strip along y
+	ys=np.zeros(0)
+	da=np.zeros(0)
+	db=np.zeros(0)
+	polys=[]
+	for j in range(len(B)+1):
+		i=slice(first[j],first[j+1])
+		left=borderEdges(Bx[j],ys,da,db)
+		ys,inv=np.unique(np.concatenate([ys,py0[i],py1[i]]),return_inverse=True)
+		da=np.bincount(inv,np.concatenate([da,pa[i],-pa[i]]),len(ys))
+		db=np.bincount(inv,np.concatenate([db,pb[i],-pb[i]]),len(ys))
+		nz=(da!=0)|(db!=0)
+		ys,da,db=ys[nz],da[nz],db[nz]
+		right=borderEdges(Bx[j+1],ys,da,db,-1)
+		E=[np.concatenate(c) for c in zip(left,(px0[i],py0[i],px1[i],py1[i],pa[i],pb[i]),right)]
+		if len(E[0]):
+			polys.append(toPolygons(*trapezoids(*E,op=op)))
+	if not polys:
+		return np.zeros((0,2)),np.zeros(1,dtype=np.int64)
+	offs=np.cumsum([0]+[len(p) for p,st in polys])
+	return np.concatenate([p for p,st in polys]),np.concatenate([st[:-1]+o for (p,st),o in zip(polys,offs)]+[[offs[-1]]])
+
+def union(pts, starts):
+	return boolean((pts,starts))
+
+def intersection(a, b):
+	return boolean(a,b,INTERSECTION)
+
+def difference(a, b):
+	return boolean(a,b,DIFFERENCE)
+
+def xor(a, b):
+	return boolean(a,b,XOR)
+
+def mergeFlat(flat):
+	"""
+	Return the Flat flat with the overlapping boundaries and boxes of each (layer, datatype, loop) merged.
+	The paths are kept as is.
+	"""
+	poly=flat.kind!=gdsflat.PATH
+	blocks=[flat.take(np.nonzero(~poly)[0])]
+	sel=np.nonzero(poly)[0]
+	keys=np.stack([flat.layer[sel],flat.datatype[sel],flat.loop[sel]],axis=1)
+	keys,inv=np.unique(keys,axis=0,return_inverse=True)
+	inv=inv.ravel()
+	for j,(layer,datatype,loop) in enumerate(keys.tolist()):
+		sub=flat.take(sel[inv==j])
+		pts,starts=union(sub.pts,sub.starts)
+		n=len(starts)-1
+		blocks.append(gdsflat.Flat(np.full(n,gdsflat.BOUNDARY),np.full(n,layer),np.full(n,datatype),
+			np.zeros(n),np.full(n,loop),pts,starts))
+	return gdsflat.concat(blocks)
+
+def merge(lib, name, g, out=None):
+	"""
+	Flatten the structure name of lib, merge its overlapping boundaries (see mergeFlat) and write
+	the result as the structure out (default: name) of the GDSII g, whose area and dose sums
+	are those of the merged polygons. Return the merged Flat.
+	"""
+	f=mergeFlat(gdsflat.flatten(lib,name))
+	f.write(g,out or name)
+	return f
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# *-* coding: utf-8 *-*
+
+# Incremental editing of a GDSII file
+#
+# Structures can be replaced, added or deleted without decoding the library: the untouched
+# structures are copied verbatim from the byte ranges of the StructIndex and only the changed
+# structures are encoded. When the changes only concern the end of the file (typically new
+# structures), the file is truncated and appended to in place.
+
+import os
+import struct
+import gds
+
+def copyRange(fin, fout, begin, end, size=1<<24):
+	"""
+	Copy the bytes [begin,end) of the file fin at the current position of the file fout
+	"""
+	fout.flush()
+	n=end-begin
+	if hasattr(os,'copy_file_range'):
+		try:
+			while n>0:
+				k=os.copy_file_range(fin.fileno(),fout.fileno(),min(n,1<<30),begin)
+				if k==0:
+					break
+				begin+=k
+				n-=k
+			fout.seek(0,os.SEEK_END)
+			if n==0:
+				return
+		except OSError:
+			pass
+	fin.seek(begin)
+	while n>0:
+		b=fin.read(min(n,size))
+		if not b:
+			raise IOError("Unexpected end of file")
+		fout.write(b)
+		n-=len(b)
+
+def countRecords(data):
+	"""
+	Return the number of records of the GDSII binary data
+	"""
+	n=0
+	i=0
+	L=len(data)
+	while i+4<=L:
+		l=struct.unpack_from(">H",data,i)[0]
+		if l<4:
+			raise ValueError("Invalid record length %i at %i"%(l,i))
+		i+=l
+		n+=1
+	return n
+
+def structBytes(src, name):
+	"""
+	Return the GDSII binary data (BGNSTR to ENDSTR) of the structure name of src.
+	src is either the binary data itself or a GDSII in memory (not DirectWrite) holding the structure.
+	Raise ValueError if its STRNAME is not name.
+	"""
+	if isinstance(src,(bytes,bytearray,memoryview)):
+		data=bytes(src)
+	else:
+		if src.f is not None:
+			raise ValueError("The structures of a DirectWrite GDSII are not kept in memory")
+		t=src.getTable(name)
+		data=b''.join(src.objs.encode(i) for i in range(t.first,t.last))
+	if len(data)<8 or struct.unpack_from(">H",data,2)[0]!=0x0502 or struct.unpack_from(">H",data,len(data)-2)[0]!=0x0700:
+		raise ValueError("The data of the structure %s must go from BGNSTR to ENDSTR"%(name))
+	# The STRNAME record follows BGNSTR
+	i=struct.unpack_from(">H",data,0)[0]
+	l,code=struct.unpack_from(">HH",data,i) if i+4<=len(data) else (0,0)
+	if code!=0x0606 or l<4:
+		raise ValueError("The data of the structure %s has no STRNAME after BGNSTR"%(name))
+	sname=data[i+4:i+l].rstrip(b'\x00').decode('latin-1')
+	if sname!=name:
+		raise ValueError("The data of the structure %s is named %s"%(name,sname))
+	return data
+
+class Editor:
+	def __init__(self, path, saveIndex=False):
+		"""
+		Incremental editor of the GDSII file path. The changes (replace, add, delete) are kept
+		in memory until commit.
+
+		Arguments:
+		----------
+		path: the GDSII file
+		saveIndex: keep the sidecar index (path+".idx", see gds.StructIndex) up to date
+		"""
+		self.path=path
+		self.saveIndex=saveIndex
+		self.index=gds.loadIndex(path,save=saveIndex)
+		self.changes={}
+
+	def names(self):
+		"""
+		Return the names of the structures after the pending changes (in file order)
+		"""
+		r=[n for n in self.index.names() if self.changes.get(n,True) is not None]
+		return r+[n for n in self.changes if n not in self.index and self.changes[n] is not None]
+
+	def __contains__(self, name):
+		if name in self.changes:
+			return self.changes[name] is not None
+		return name in self.index
+
+	def get(self, name):
+		"""
+		Return the binary data of the structure name (after the pending changes)
+		"""
+		if name in self.changes:
+			if self.changes[name] is None:
+				raise KeyError(name)
+			return self.changes[name]
+		begin,end=self.index[name][:2]
+		with open(self.path,"rb") as f:
+			f.seek(begin)
+			return f.read(end-begin)
+
+	def replace(self, name, src):
+		"""
+		Replace the structure name by the one of src (binary data or GDSII, see structBytes)
+		"""
+		if name not in self:
+			raise KeyError(name)
+		self.changes[name]=structBytes(src,name)
+
+	def add(self, name, src):
+		"""
+		Add the structure name of src (binary data or GDSII, see structBytes) at the end of the library
+		"""
+		if name in self:
+			raise ValueError("The structure %s already exists"%(name))
+		self.changes[name]=structBytes(src,name)
+
+	def delete(self, name):
+		if name not in self:
+			raise KeyError(name)
+		if name in self.index:
+			self.changes[name]=None
+		else:
+			del self.changes[name]
+
+	def commit(self, out=None):
+		"""
+		Write the pending changes, to the file out if given, otherwise to the edited file.
+		In place, the file is truncated and appended to if only its last structures are changed,
+		otherwise it is rewritten to a temporary file which replaces it.
+		Return the StructIndex of the written file.
+		"""
+		idx=self.index
+		order=sorted(idx.structs.items(),key=lambda x:x[1][0])
+		changed=[i for i,(n,v) in enumerate(order) if n in self.changes]
+		cut=len(order)
+		if changed and all(n in self.changes for n,v in order[changed[0]:]):
+			cut=changed[0]
+		if out is None and cut==min(changed+[len(order)]):
+			# Append in place
+			start=order[cut][1][0] if cut<len(order) else idx.end
+			with open(self.path,"r+b") as f:
+				f.truncate(start)
+				f.seek(start)
+				new=self.writeTail(f,order[:cut],order[cut:])
+		else:
+			dst=out if out is not None else self.path+".tmp"
+			with open(self.path,"rb") as fin, open(dst,"wb") as f:
+				copyRange(fin,f,0,idx.header)
+				new=self.writeTail(f,[],order,fin)
+			if out is None:
+				os.replace(dst,self.path)
+		path=self.path if out is None else out
+		st=os.stat(path)
+		new.path=path
+		new.size=st.st_size
+		new.mtime=st.st_mtime_ns
+		if self.saveIndex:
+			new.save()
+		if out is None:
+			self.index=new
+			self.changes={}
+		return new
+
+	def writeTail(self, f, kept, order, fin=None):
+		"""
+		Write at the current position of f the structures of order (copied from fin or changed),
+		the added structures and ENDLIB. kept are the structures already in place before.
+		Return the new StructIndex.
+		"""
+		idx=self.index
+		new=gds.StructIndex()
+		new.header=idx.header
+		for n,v in kept:
+			new.structs[n]=list(v)
+		if kept:
+			rec=kept[-1][1][3]
+		elif order:
+			rec=order[0][1][2]
+		else:
+			with open(self.path,"rb") as fh:
+				rec=countRecords(fh.read(idx.header))
+		pos=f.tell()
+		# Untouched consecutive structures are copied with a single range
+		run=None
+		for n,v in order+[(n,None) for n in self.changes if n not in idx]:
+			data=self.changes.get(n) if n in self.changes else False
+			if data is False and run is not None and run[1]==v[0]:
+				run[1]=v[1]
+			elif run is not None:
+				copyRange(fin,f,run[0],run[1])
+				run=None
+			if data is False:
+				if run is None:
+					run=[v[0],v[1]]
+				k=v[3]-v[2]
+				new.structs[n]=[pos,pos+v[1]-v[0],rec,rec+k]
+				pos+=v[1]-v[0]
+				rec+=k
+			elif data is not None:
+				f.write(data)
+				k=countRecords(data)
+				new.structs[n]=[pos,pos+len(data),rec,rec+k]
+				pos+=len(data)
+				rec+=k
+		if run is not None:
+			copyRange(fin,f,run[0],run[1])
+		new.end=pos
+		f.write(gds.encodeRecord(0x0400))
+		f.flush()
+		if not new.structs:
+			new.header=new.end
+		return new
+
+def edit(path, changes, out=None):
+	"""
+	Apply the changes {name: binary data, GDSII or None to delete} to the GDSII file path
+	"""
+	e=Editor(path)
+	for n,src in changes.items():
+		if src is None:
+			e.delete(n)
+		elif n in e:
+			e.replace(n,src)
+		else:
+			e.add(n,src)
+	return e.commit(out)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# *-* coding: utf-8 *-*
+
+# Estimation of the exposure/milling budget of a structure and its hierarchy
+#
+# The area of the boundaries/boxes and the length of the paths are summed per layer and
+# datatype (the dose factor encoded by GDSII.doseEnc), weighted by the Raith loop counts and
+# by the number of instances of the references. The sums are memoized per structure and
+# scaled by the magnification of the references, so nothing is flattened.
+
+import numpy as np
+import gds
+import gdsflat
+
+# Columns of the per (layer, datatype) sums: area, length, area*loop, length*loop (database units)
+AREA,LENGTH,LOOPAREA,LOOPLENGTH=range(4)
+
+class Exposure:
+	def __init__(self, lib, BeamCurrent=3e-11, AreaDose=1, LineDose=1e-8, unit=None):
+		"""
+		Exposure estimator of the structures of the library lib (gds.GDSII, gds.LazyLibrary, ...).
+		The doses and time follow GDSII.millInfo: dose = (area*AreaDose + length*LineDose) * dose factor * loop
+		and time = dose / BeamCurrent.
+
+		Arguments:
+		----------
+		lib: the library
+		BeamCurrent: the beam current in A
+		AreaDose: the area dose in C/m² (single number or dictionary layer -> dose)
+		LineDose: the line dose in C/m (single number or dictionary layer -> dose)
+		unit: the database unit in meter (default: read from the UNITS of the library, or 1e-9)
+		"""
+		self.lib=lib
+		self.BeamCurrent=BeamCurrent
+		self.AreaDose=AreaDose
+		self.LineDose=LineDose
+		if unit is None:
+			u=lib.getUnits() if hasattr(lib,'getUnits') else None
+			unit=u[1] if u else 1e-9
+		self.unit=unit
+		self.cache={}
+		self.stack=set()
+
+	def own(self, name):
+		"""
+		Return the sums of the elements of the structure name itself
+		as a dictionary (layer, datatype) -> array [area, length, area*loop, length*loop]
+		"""
+		t=self.lib.getTable(name)
+		r={}
+		for kinds,col in (((gdsflat.BOUNDARY,gdsflat.BOX),AREA),((gdsflat.PATH,),LENGTH)):
+			sel=t.select(kinds)
+			if len(sel)==0:
+				continue
+			pts,starts=t.getPoints(sel)
+			pts=pts.astype(np.float64)
+			if col==AREA:
+				v=gds.getAreas(*gds.closeShapes(pts,starts))
+			else:
+				v=gds.getLengths(pts,starts)
+			loop=t.column('loop')[sel]
+			keys=np.stack([t.column('layer')[sel],t.column('datatype')[sel]],axis=1)
+			keys,inv=np.unique(keys,axis=0,return_inverse=True)
+			inv=inv.ravel()
+			s=np.bincount(inv,weights=v,minlength=len(keys))
+			sl=np.bincount(inv,weights=v*loop,minlength=len(keys))
+			for k,a,b in zip(keys.tolist(),s,sl):
+				x=r.setdefault(tuple(k),np.zeros(4))
+				x[col]+=a
+				x[col+2]+=b
+		return r
+
+	def get(self, name):
+		"""
+		Return the sums of the structure name and its hierarchy (see own), memoized
+		"""
+		if name in self.cache:
+			return self.cache[name]
+		if name in self.stack:
+			raise ValueError("Recursive reference to the structure %s"%(name))
+		self.stack.add(name)
+		try:
+			r=self.own(name)
+			t=self.lib.getTable(name)
+			kind=t.column('kind')
+			for i in np.nonzero((kind==gdsflat.SREF)|(kind==gdsflat.AREF))[0]:
+				n=t.cols[i]*t.rows[i] if kind[i]==gdsflat.AREF else 1
+				m=t.mag[i]
+				scale=np.array([m*m,m,m*m,m])*n
+				for k,v in self.get(t.sname[i]).items():
+					if k in r:
+						r[k]=r[k]+v*scale
+					else:
+						r[k]=v*scale
+		finally:
+			self.stack.discard(name)
+		self.cache[name]=r
+		return r
+
+	def clear(self):
+		self.cache={}
+
+	def dose(self, layer, datatype, v):
+		"""
+		Return the dose (C) of the sums v of the given layer and datatype
+		"""
+		ad=self.AreaDose.get(layer,0) if isinstance(self.AreaDose,dict) else self.AreaDose
+		ld=self.LineDose.get(layer,0) if isinstance(self.LineDose,dict) else self.LineDose
+		u=self.unit
+		return float((v[LOOPAREA]*u*u*ad+v[LOOPLENGTH]*u*ld)*gds.doseDec(datatype))
+
+	def info(self, name, by=('layer','dose')):
+		"""
+		Return the budget of the structure name grouped by layer and/or dose factor
+		as a dictionary key -> dict(area (µm²), length (µm), dose (nC), time (s)) like GDSII.millInfo.
+		by: ('layer','dose'), ('layer',), ('dose',) or () for the total
+		"""
+		u=self.unit
+		r={}
+		for (layer,datatype),v in self.get(name).items():
+			key=tuple({'layer':layer,'dose':float(gds.doseDec(datatype))}[b] for b in by)
+			x=r.setdefault(key,dict(area=0.,length=0.,dose=0.,time=0.))
+			d=self.dose(layer,datatype,v)
+			x['area']+=float(v[AREA])*u*u*1e12
+			x['length']+=float(v[LENGTH])*u*1e6
+			x['dose']+=d*1e9
+			x['time']+=d/self.BeamCurrent
+		return r
+
+	def total(self, name):
+		"""
+		Return the total budget of the structure name (see info)
+		"""
+		return self.info(name,by=()).get((),dict(area=0.,length=0.,dose=0.,time=0.))
+
+def exposure(lib, name, **kargs):
+	"""
+	Return the total budget of the structure name of lib (see Exposure)
+	"""
+	return Exposure(lib,**kargs).total(name)
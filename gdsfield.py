@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# *-* coding: utf-8 *-*
+
+# Partition of a structure into writefields
+#
+# The structure is flattened (gdsflat), cut along a regular grid of fields and each field is
+# written as its own structure, centred on its origin, with a matching entry in a Raith
+# position list (plsmaker.PLS). The tiles are clipped in parallel by a pool of processes.
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import gds
+import gdsflat
+
+def clipLine(pts, box, halfOpen=False):
+	"""
+	Clip the polyline pts (n,2) to the box [xmin,ymin,xmax,ymax] (Liang-Barsky per segment).
+	Return the list of the parts of the polyline inside the box.
+	halfOpen: the segments lying on the right or top side of the box are left to the next box
+	"""
+	parts=[]
+	cur=[]
+	for a,b in zip(pts[:-1],pts[1:]):
+		d=b-a
+		t0,t1=0.0,1.0
+		for p,q,side in ((-d[0],a[0]-box[0],False),(d[0],box[2]-a[0],halfOpen),(-d[1],a[1]-box[1],False),(d[1],box[3]-a[1],halfOpen)):
+			if p==0:
+				if q<0 or (side and q==0):
+					t0,t1=1.0,0.0
+			elif p<0:
+				t0=max(t0,q/p)
+			else:
+				t1=min(t1,q/p)
+		if t0>t1:
+			if cur:
+				parts.append(np.array(cur))
+			cur=[]
+			continue
+		pa,pb=a+t0*d,a+t1*d
+		if cur and not (cur[-1]==pa).all():
+			parts.append(np.array(cur))
+			cur=[]
+		if not cur:
+			cur=[pa]
+		cur.append(pb)
+		if t1<1:
+			parts.append(np.array(cur))
+			cur=[]
+	if cur:
+		parts.append(np.array(cur))
+	return [p for p in parts if len(p)>1]
+
+def elementBoxes(flat, width=True):
+	"""
+	Return the bounding boxes (n,4) of the elements of the Flat flat (paths extended by half their width
+	if width is True, otherwise the boxes of their centre lines)
+	"""
+	if len(flat)==0:
+		return np.zeros((0,4))
+	s=flat.starts[:-1]
+	hw=(np.abs(flat.width)/2.0)[:,None]*(flat.kind==gdsflat.PATH)[:,None]*width
+	return np.concatenate([np.minimum.reduceat(flat.pts,s)-hw,np.maximum.reduceat(flat.pts,s)+hw],axis=1)
+
+def owned(lo, hi, a, b):
+	# Mask of the intervals [lo,hi] belonging to the interval [a,b): overlapping it, or reduced to a point in it
+	return ((lo<b)&(hi>a))|((lo==hi)&(lo>=a)&(lo<b))
+
+def clipFlat(flat, box, boxes=None):
+	"""
+	Return the part of the Flat flat inside the box [xmin,ymin,xmax,ymax].
+	Elements entirely inside are kept as is, the others are clipped. The box is half-open: the elements
+	and the segments of paths lying on its right or top side belong to the next box, so adjacent boxes
+	share nothing. Paths are clipped on their centre line (boxes of elementBoxes(flat, False)) and keep
+	their width: a path running along a side, within half its width, overlaps the next box.
+	"""
+	if boxes is None:
+		boxes=elementBoxes(flat,False)
+	meet=np.nonzero(owned(boxes[:,0],boxes[:,2],box[0],box[2])&owned(boxes[:,1],boxes[:,3],box[1],box[3]))[0]
+	inside=(boxes[meet,0]>=box[0])&(boxes[meet,2]<=box[2])&(boxes[meet,1]>=box[1])&(boxes[meet,3]<=box[3])
+	blocks=[flat.take(meet[inside])]
+	cut=[]
+	for i in meet[~inside]:
+		pts=flat.pts[flat.starts[i]:flat.starts[i+1]]
+		if flat.kind[i]==gdsflat.PATH:
+			cut+=[(i,p) for p in clipLine(pts,box,True)]
+		else:
+			p=gds.clipPolygon(pts,box)
+			if len(p):
+				cut.append((i,p))
+	if cut:
+		sel=np.array([i for i,p in cut],dtype=np.int64)
+		starts=np.zeros(len(cut)+1,dtype=np.int64)
+		np.cumsum([len(p) for i,p in cut],out=starts[1:])
+		blocks.append(gdsflat.Flat(flat.kind[sel],flat.layer[sel],flat.datatype[sel],flat.width[sel],
+			flat.loop[sel],np.concatenate([p for i,p in cut]),starts))
+	return gdsflat.concat(blocks)
+
+# State of the worker processes (set once per process by initWorker)
+_flat=None
+_boxes=None
+
+def initWorker(flat):
+	global _flat,_boxes
+	_flat=flat
+	_boxes=elementBoxes(flat,False)
+
+def clipTiles(tiles):
+	"""
+	Clip the flattened structure of the worker to each tile (ix, iy, box) of tiles
+	"""
+	return [(ix,iy,clipFlat(_flat,box,_boxes)) for ix,iy,box in tiles]
+
+class Fields:
+	def __init__(self, lib, name, size, origin=None, kinds=(gdsflat.BOUNDARY,gdsflat.PATH,gdsflat.BOX)):
+		"""
+		Grid of writefields covering the structure name of the library lib.
+
+		Arguments:
+		----------
+		lib: the library (gds.GDSII, gds.LazyLibrary, ... see gdsflat)
+		name: the structure to partition
+		size: the size (w,h) of a field in database units (or a single number for square fields)
+		origin: the lower left corner of the field (0,0). Default: the lower left corner of the structure
+		kinds: the elements taken (BOUNDARY, PATH, BOX)
+		"""
+		if not hasattr(size,'__getitem__'):
+			size=(size,size)
+		self.size=np.array(size,dtype=np.float64)
+		self.flat=gdsflat.flatten(lib,name,kinds)
+		self.name=name
+		b=self.flat.bbox()
+		if b is None:
+			b=[0,0,0,0]
+		if origin is None:
+			origin=b[:2]
+		self.origin=np.array(origin,dtype=np.float64)
+		# The fields are half-open: the elements on the right or top side of the structure need a field
+		self.shape=tuple(np.maximum(np.floor((np.array(b[2:])-self.origin)/self.size).astype(int)+1,1).tolist())
+		self.fields={}
+
+	def box(self, ix, iy):
+		"""
+		Return the box [xmin,ymin,xmax,ymax] of the field (ix,iy)
+		"""
+		lo=self.origin+self.size*(ix,iy)
+		return lo.tolist()+(lo+self.size).tolist()
+
+	def center(self, ix, iy):
+		return self.origin+self.size*(ix+.5,iy+.5)
+
+	def tiles(self):
+		return [(ix,iy,self.box(ix,iy)) for iy in range(self.shape[1]) for ix in range(self.shape[0])]
+
+	def split(self, workers=None, chunk=16):
+		"""
+		Clip the geometry to the fields. The tiles are distributed by chunks to a pool of
+		worker processes (workers=None: one per CPU, workers<=1: in this process).
+		Return the dictionary (ix,iy) -> Flat of the non-empty fields.
+		"""
+		tiles=self.tiles()
+		if workers is None:
+			workers=os.cpu_count() or 1
+		chunks=[tiles[i:i+chunk] for i in range(0,len(tiles),chunk)]
+		if workers<=1 or len(chunks)<=1:
+			initWorker(self.flat)
+			res=[clipTiles(c) for c in chunks]
+		else:
+			with ProcessPoolExecutor(workers,initializer=initWorker,initargs=(self.flat,)) as ex:
+				res=list(ex.map(clipTiles,chunks))
+		self.fields={}
+		for r in res:
+			for ix,iy,f in r:
+				if len(f):
+					self.fields[(ix,iy)]=f
+		return self.fields
+
+	def fieldName(self, ix, iy):
+		return "%s_%i_%i"%(self.name,ix,iy)
+
+	def write(self, g, pls=None, unit=1000.0, **kargs):
+		"""
+		Write each non-empty field as a structure of the GDSII g, with coordinates relative to the
+		centre of the field, and add its position list entry to pls (plsmaker.PLS) if given.
+
+		Arguments:
+		----------
+		g: the GDSII library written (DirectWrite or in memory)
+		pls: the plsmaker.PLS receiving one entry per field (centre and size in µm, structure name as comment)
+		unit: the number of database units per µm
+		kargs: the other parameters of the PLS entries (filename of the GDSII, layer, dosefactor, ...)
+		"""
+		if not self.fields:
+			self.split()
+		for (ix,iy),f in sorted(self.fields.items(),key=lambda x:(x[0][1],x[0][0])):
+			c=self.center(ix,iy)
+			name=self.fieldName(ix,iy)
+			gdsflat.Flat(f.kind,f.layer,f.datatype,f.width,f.loop,f.pts-c,f.starts).write(g,name)
+			if pls is not None:
+				x=dict(kargs)
+				x.update({'u':c[0]/unit,'v':c[1]/unit,'comment':name})
+				# The field size in µm (AddStruct would convert the area with 1000 units per µm)
+				if not x.get('Usize'): x['Usize']=self.size[0]/unit
+				if not x.get('Vsize'): x['Vsize']=self.size[1]/unit
+				half=self.size/2
+				pls.AddStruct(x,[-half[0],-half[1],half[0],half[1]])
+		return [self.fieldName(ix,iy) for (ix,iy) in sorted(self.fields,key=lambda x:(x[1],x[0]))]
+
+def partition(lib, name, size, g, pls=None, workers=None, **kargs):
+	"""
+	Split the structure name of lib into fields of the given size written in g (see Fields)
+	"""
+	f=Fields(lib,name,size)
+	f.split(workers)
+	return f.write(g,pls,**kargs)
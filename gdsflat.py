@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# *-* coding: utf-8 *-*
+
+# Hierarchy flattening of GDSII libraries
+#
+# The SREF/AREF of a structure are resolved recursively. Each structure is flattened once
+# (in its own coordinates) and the result is then placed with NumPy for every reference,
+# a whole AREF being a single broadcasted translation.
+# A library is anything providing getTable(name) -> gds.ElementTable
+# (gds.GDSII, gds.LazyLibrary or gds.RecordStore).
+
+import math
+import numpy as np
+import gds
+
+BOUNDARY=0x0800
+PATH=0x0900
+SREF=0x0A00
+AREF=0x0B00
+BOX=0x2D00
+
+def refMatrix(strans=0, mag=1.0, angle=0.0):
+	"""
+	Return the 2x2 linear transformation of a reference.
+	The reflection about the x-axis (bit 0x8000 of STRANS) is applied first,
+	then the magnification and the rotation (angle in degrees, counterclockwise).
+	The absolute magnification/angle bits are not supported (treated as relative).
+	"""
+	a=angle%360
+	if a%90==0:
+		# Exact values for the usual orientations
+		c,s=[(1,0),(0,1),(-1,0),(0,-1)][int(a//90)]
+	else:
+		a=math.radians(a)
+		c,s=math.cos(a),math.sin(a)
+	L=np.array([[c,-s],[s,c]],dtype=np.float64)*mag
+	if strans&0x8000:
+		L[:,1]*=-1
+	return L
+
+def arefTranslations(xy, cols, rows):
+	"""
+	Return the (cols*rows,2) positions of the instances of an AREF whose XY is
+	[origin, origin+cols*column spacing, origin+rows*row spacing]
+	"""
+	xy=np.asarray(xy,dtype=np.float64).reshape(3,2)
+	o=xy[0]
+	dc=(xy[1]-o)/cols
+	dr=(xy[2]-o)/rows
+	r,c=np.divmod(np.arange(cols*rows),cols)
+	return o+c[:,None]*dc+r[:,None]*dr
+
+def refGroups(t, corners=False):
+	"""
+	Return the references of the ElementTable t grouped by child and linear transformation
+	as a list of (child name, 2x2 matrix, (K,2) translations).
+	If corners is True, only the 4 corner instances of each AREF are returned
+	(enough for the bounding boxes).
+	"""
+	groups={}
+	kind=t.column('kind')
+	for i in np.nonzero((kind==SREF)|(kind==AREF))[0]:
+		L=refMatrix(t.strans[i],t.mag[i],t.angle[i])
+		xy=t.getXY(i)
+		if kind[i]==AREF:
+			trs=arefTranslations(xy,t.cols[i],t.rows[i])
+			if corners:
+				cols=t.cols[i]
+				trs=trs[[0,cols-1,len(trs)-cols,len(trs)-1]]
+		else:
+			trs=xy[:2].astype(np.float64).reshape(1,2)
+		key=(t.sname[i],L.tobytes())
+		if key in groups:
+			groups[key][2].append(trs)
+		else:
+			groups[key]=(t.sname[i],L,[trs])
+	return [(n,L,np.concatenate(trs)) for n,L,trs in groups.values()]
+
+def transformBBox(b, L, trs):
+	"""
+	Return the bounding box of the box b=[xmin,ymin,xmax,ymax] transformed by the 2x2 matrix L
+	and placed at each of the translations trs
+	"""
+	c=np.array([[b[0],b[1]],[b[0],b[3]],[b[2],b[1]],[b[2],b[3]]],dtype=np.float64).dot(L.T)
+	trs=np.asarray(trs,dtype=np.float64).reshape(-1,2)
+	return (c.min(axis=0)+trs.min(axis=0)).tolist()+(c.max(axis=0)+trs.max(axis=0)).tolist()
+
+def unionBBox(a, b):
+	if a is None: return b
+	if b is None: return a
+	return [min(a[0],b[0]),min(a[1],b[1]),max(a[2],b[2]),max(a[3],b[3])]
+
+class Flat:
+	__slots__=('kind','layer','datatype','width','loop','pts','starts')
+	def __init__(self, kind, layer, datatype, width, loop, pts, starts):
+		"""
+		Array-backed list of flat elements (struct-of-arrays).
+		The points of element i are pts[starts[i]:starts[i+1]] (float64, in database units).
+		A negative width is an absolute width (not scaled by the references).
+		"""
+		self.kind=kind
+		self.layer=layer
+		self.datatype=datatype
+		self.width=width
+		self.loop=loop
+		self.pts=pts
+		self.starts=starts
+
+	def __len__(self):
+		return len(self.kind)
+
+	def polygons(self):
+		"""
+		Iterate over the elements as (kind, layer, datatype, width, points) tuples
+		"""
+		for i in range(len(self)):
+			yield self.kind[i],self.layer[i],self.datatype[i],self.width[i],self.pts[self.starts[i]:self.starts[i+1]]
+
+	def bbox(self):
+		"""
+		Return [xmin, ymin, xmax, ymax] of the points (None if empty)
+		"""
+		if len(self.pts)==0:
+			return None
+		return self.pts.min(axis=0).tolist()+self.pts.max(axis=0).tolist()
+
+	def place(self, pts, trs, scale=1.0):
+		"""
+		Return the elements with the points pts (the points of self already linearly transformed)
+		translated by each of the (K,2) translations trs
+		"""
+		K=len(trs)
+		P=len(pts)
+		N=len(self)
+		pts=(pts[None,:,:]+np.asarray(trs,dtype=np.float64)[:,None,:]).reshape(-1,2)
+		starts=np.empty(K*N+1,dtype=np.int64)
+		starts[:-1]=(self.starts[:-1][None,:]+P*np.arange(K)[:,None]).ravel()
+		starts[-1]=K*P
+		width=self.width
+		if scale!=1:
+			width=np.where(width>=0,width*scale,width)
+		return Flat(np.tile(self.kind,K),np.tile(self.layer,K),np.tile(self.datatype,K),
+			np.tile(width,K),np.tile(self.loop,K),pts,starts)
+
+	def take(self, sel):
+		"""
+		Return the subset of the elements sel (array of indices)
+		"""
+		counts=np.diff(self.starts)[sel]
+		starts=np.zeros(len(sel)+1,dtype=np.int64)
+		np.cumsum(counts,out=starts[1:])
+		idx=np.arange(starts[-1],dtype=np.int64)+np.repeat(self.starts[:-1][sel]-starts[:-1],counts)
+		return Flat(self.kind[sel],self.layer[sel],self.datatype[sel],self.width[sel],self.loop[sel],self.pts[idx],starts)
+
+	def write(self, g, name):
+		"""
+		Write the elements as the new structure name of the GDSII g (DirectWrite or in memory).
+		Boxes are written as boundaries, coordinates are rounded to the database unit.
+		The area, length and dose sums of the structure (see GDSII.millInfo) are those of the elements.
+		"""
+		g.newStr(name)
+		g.updateArea(self.pts)
+		for kind,loop in sorted(set(zip(self.kind.tolist(),self.loop.tolist()))):
+			sub=self.take(np.nonzero((self.kind==kind)&(self.loop==loop))[0])
+			pts=np.rint(sub.pts)
+			dose=gds.doseDec(sub.datatype)
+			if kind==PATH:
+				g.writeElements(PATH,pts,sub.starts,layer=sub.layer,datatype=sub.datatype,width=np.rint(np.abs(sub.width)),loop=loop)
+				length=1e-9*gds.getLengths(pts,sub.starts)
+				g.Length[name]+=float(length.sum())
+				g.DoseLine[name]+=float((length*dose).sum())
+			else:
+				g.writeElements(BOUNDARY,pts,sub.starts,layer=sub.layer,datatype=sub.datatype,loop=loop)
+				area=1e-18*gds.getAreas(*gds.closeShapes(pts,sub.starts))
+				g.Area[name]+=float(area.sum())
+				g.DoseArea[name]+=float((area*dose).sum())
+		g.endStr()
+
+def concat(flats):
+	"""
+	Concatenate a list of Flat
+	"""
+	flats=[f for f in flats if len(f)]
+	if len(flats)==0:
+		return emptyFlat()
+	if len(flats)==1:
+		return flats[0]
+	offs=np.cumsum([0]+[len(f.pts) for f in flats])
+	starts=np.concatenate([f.starts[:-1]+o for f,o in zip(flats,offs)]+[[offs[-1]]])
+	return Flat(*[np.concatenate([getattr(f,k) for f in flats]) for k in ('kind','layer','datatype','width','loop','pts')]+[starts])
+
+def emptyFlat():
+	e=np.zeros(0,dtype=np.int64)
+	return Flat(e,e,e,np.zeros(0),e,np.zeros((0,2)),np.zeros(1,dtype=np.int64))
+
+class Flattener:
+	def __init__(self, lib, kinds=(BOUNDARY,PATH,BOX)):
+		"""
+		Flattening engine of the hierarchy of the library lib.
+		The flattened structures and their linearly transformed points are cached,
+		so each structure is flattened once and transformed once per distinct orientation/magnification.
+
+		Arguments:
+		----------
+		lib: gds.GDSII, gds.LazyLibrary or anything providing getTable(name)
+		kinds: the element record codes kept (BOUNDARY, PATH and BOX by default)
+		"""
+		self.lib=lib
+		self.kinds=kinds
+		self.cache={}
+		self.tcache={}
+		self.stack=set()
+
+	def clear(self):
+		self.cache={}
+		self.tcache={}
+
+	def own(self, name):
+		"""
+		Return the Flat of the elements of the structure name itself (references not resolved)
+		"""
+		t=self.lib.getTable(name)
+		sel=t.select(self.kinds)
+		pts,starts=t.getPoints(sel)
+		return Flat(t.column('kind')[sel],t.column('layer')[sel],t.column('datatype')[sel],
+			t.column('width')[sel].astype(np.float64),t.column('loop')[sel],pts.astype(np.float64),starts)
+
+	def refs(self, name):
+		"""
+		Return the references of the structure name grouped by child and linear transformation
+		as a list of (child name, 2x2 matrix, (K,2) translations)
+		"""
+		return refGroups(self.lib.getTable(name))
+
+	def flatten(self, name):
+		"""
+		Return the fully flattened structure name (Flat, in its own coordinates)
+		"""
+		f=self.cache.get(name)
+		if f is not None:
+			return f
+		if name in self.stack:
+			raise ValueError("Recursive reference to the structure %s"%(name))
+		self.stack.add(name)
+		try:
+			f=concat([self.own(name)]+[self.place(n,L,trs) for n,L,trs in self.refs(name)])
+		finally:
+			self.stack.discard(name)
+		self.cache[name]=f
+		return f
+
+	def place(self, name, L, trs):
+		"""
+		Return the flattened structure name transformed by the linear part L and
+		placed at each of the translations trs
+		"""
+		f=self.flatten(name)
+		key=(name,L.tobytes())
+		pts=self.tcache.get(key)
+		if pts is None:
+			pts=f.pts.dot(L.T)
+			self.tcache[key]=pts
+		return f.place(pts,trs,math.sqrt(abs(np.linalg.det(L))))
+
+	def iterFlat(self, name, L=None, t=(0,0)):
+		"""
+		Stream the flattened structure name as Flat blocks (its own elements, then one block
+		per group of references), without building the whole flat structure in memory.
+		L and t is an optional transformation (2x2 matrix and translation) applied to everything.
+		"""
+		if L is None:
+			L=np.eye(2)
+		t=np.asarray(t,dtype=np.float64).reshape(1,2)
+		f=self.own(name)
+		if len(f):
+			yield f.place(f.pts.dot(L.T),t,math.sqrt(abs(np.linalg.det(L))))
+		for n,Lr,trs in self.refs(name):
+			yield self.place(n,L.dot(Lr),trs.dot(L.T)+t)
+
+class BBoxes:
+	def __init__(self, lib, kinds=(BOUNDARY,PATH,BOX)):
+		"""
+		Hierarchical bounding boxes of the structures of the library lib.
+		The boxes are computed bottom-up and memoized per structure: the box of a reference is
+		the transformed box of its child (the 4 corner instances for an AREF), nothing is flattened.
+		Paths are extended by half their width.
+		"""
+		self.lib=lib
+		self.kinds=kinds
+		self.cache={}
+		self.stack=set()
+
+	def own(self, name):
+		"""
+		Return the bounding box of the elements of the structure name itself (None if empty)
+		"""
+		t=self.lib.getTable(name)
+		sel=t.select(self.kinds)
+		if len(sel)==0:
+			return None
+		pts,starts=t.getPoints(sel)
+		if len(pts)==0:
+			return None
+		hw=np.repeat(np.abs(t.column('width')[sel])/2.0,np.diff(starts))[:,None]
+		return (pts-hw).min(axis=0).tolist()+(pts+hw).max(axis=0).tolist()
+
+	def get(self, name):
+		"""
+		Return [xmin, ymin, xmax, ymax] of the structure name and its references (None if empty)
+		"""
+		if name in self.cache:
+			return self.cache[name]
+		if name in self.stack:
+			raise ValueError("Recursive reference to the structure %s"%(name))
+		self.stack.add(name)
+		try:
+			b=self.own(name)
+			for n,L,trs in refGroups(self.lib.getTable(name),corners=True):
+				c=self.get(n)
+				if c is not None:
+					b=unionBBox(b,transformBBox(c,L,trs))
+		finally:
+			self.stack.discard(name)
+		self.cache[name]=b
+		return b
+
+	def __getitem__(self, name):
+		return self.get(name)
+
+def getBBox(lib, name):
+	"""
+	Return the hierarchical bounding box [xmin, ymin, xmax, ymax] of the structure name
+	"""
+	return BBoxes(lib).get(name)
+
+def flatten(lib, name, kinds=(BOUNDARY,PATH,BOX)):
+	"""
+	Return the structure name of the library lib with its whole hierarchy flattened (Flat)
+	"""
+	return Flattener(lib,kinds).flatten(name)
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# *-* coding: utf-8 *-*
+
+# Spatial index of the elements of GDSII structures
+#
+# RTree is a STR-packed (Sort-Tile-Recursive) R-tree over bounding boxes, stored as NumPy arrays.
+# HierIndex builds one RTree per structure (elements and references) and answers window and
+# nearest queries through the hierarchy without flattening it.
+
+import os
+import heapq
+import zipfile
+import itertools
+import numpy as np
+import gdsflat
+
+def expand(start, end):
+	"""
+	Return the concatenation of the ranges [start[i],end[i])
+	"""
+	counts=end-start
+	total=counts.sum()
+	offs=np.zeros(len(start),dtype=np.int64)
+	np.cumsum(counts[:-1],out=offs[1:])
+	return np.arange(total,dtype=np.int64)+np.repeat(start-offs,counts)
+
+def intersects(boxes, w):
+	# Boolean mask of the boxes (n,4) intersecting the window w=[xmin,ymin,xmax,ymax]
+	return (boxes[:,0]<=w[2])&(boxes[:,2]>=w[0])&(boxes[:,1]<=w[3])&(boxes[:,3]>=w[1])
+
+def boxDistance(b, p):
+	# Distance between the point p and the box b=[xmin,ymin,xmax,ymax]
+	dx=max(b[0]-p[0],0,p[0]-b[2])
+	dy=max(b[1]-p[1],0,p[1]-b[3])
+	return (dx*dx+dy*dy)**.5
+
+def boxDistances(b, p):
+	# Distances between the point p and the boxes b (n,4)
+	dx=np.maximum(np.maximum(b[:,0]-p[0],0),p[0]-b[:,2])
+	dy=np.maximum(np.maximum(b[:,1]-p[1],0),p[1]-b[:,3])
+	return np.hypot(dx,dy)
+
+def strPack(boxes, M):
+	"""
+	Return the permutation of the boxes in Sort-Tile-Recursive order for nodes of M entries
+	"""
+	n=len(boxes)
+	cx=(boxes[:,0]+boxes[:,2])/2
+	cy=(boxes[:,1]+boxes[:,3])/2
+	S=int(np.ceil(np.sqrt(np.ceil(n/float(M)))))
+	order=np.argsort(cx,kind='stable')
+	slices=np.arange(n)//(S*M)
+	return order[np.lexsort((cy[order],slices))]
+
+class RTree:
+	def __init__(self, boxes=None, M=16):
+		"""
+		STR-packed R-tree over the boxes (n,4) [xmin,ymin,xmax,ymax].
+		Each level is stored as arrays: the node boxes and the [start,end) range of their
+		children in the level below (or in self.order for the leaves).
+		"""
+		self.M=M
+		self.boxes=np.zeros((0,4))
+		self.order=np.zeros(0,dtype=np.int64)
+		self.levels=[]
+		if boxes is not None:
+			self.build(boxes)
+
+	def __len__(self):
+		return len(self.boxes)
+
+	def build(self, boxes):
+		M=self.M
+		self.boxes=np.asarray(boxes,dtype=np.float64).reshape(-1,4)
+		self.levels=[]
+		if len(self.boxes)==0:
+			self.order=np.zeros(0,dtype=np.int64)
+			return
+		self.order=strPack(self.boxes,M)
+		b=self.boxes[self.order]
+		while True:
+			n=len(b)
+			start=np.arange(0,n,M,dtype=np.int64)
+			end=np.minimum(start+M,n)
+			nb=np.concatenate([np.minimum.reduceat(b[:,:2],start),np.maximum.reduceat(b[:,2:],start)],axis=1)
+			if len(nb)>1:
+				p=strPack(nb,M)
+				nb,start,end=nb[p],start[p],end[p]
+			self.levels.append((nb,start,end))
+			if len(nb)<=M:
+				break
+			b=nb
+
+	def query(self, w):
+		"""
+		Return the indices of the boxes intersecting the window w=[xmin,ymin,xmax,ymax]
+		"""
+		if len(self.levels)==0:
+			return np.zeros(0,dtype=np.int64)
+		nodes=np.arange(len(self.levels[-1][0]))
+		for box,start,end in reversed(self.levels):
+			nodes=nodes[intersects(box[nodes],w)]
+			nodes=expand(start[nodes],end[nodes])
+		items=self.order[nodes]
+		return np.sort(items[intersects(self.boxes[items],w)])
+
+	def nearest(self, p, k=1):
+		"""
+		Return the k nearest boxes of the point p as a list of (distance, index)
+		"""
+		return list(itertools.islice(self.iterNearest(p),k))
+
+	def iterNearest(self, p):
+		"""
+		Iterate over the boxes by increasing distance to the point p (best-first search)
+		"""
+		if len(self.levels)==0:
+			return
+		cnt=itertools.count()
+		top=len(self.levels)-1
+		heap=[(boxDistance(b,p),next(cnt),top,i) for i,b in enumerate(self.levels[top][0])]
+		heapq.heapify(heap)
+		while heap:
+			d,c,lvl,i=heapq.heappop(heap)
+			if lvl<0:
+				yield d,i
+				continue
+			box,start,end=self.levels[lvl]
+			for j in range(start[i],end[i]):
+				if lvl==0:
+					j=self.order[j]
+					heapq.heappush(heap,(boxDistance(self.boxes[j],p),next(cnt),-1,j))
+				else:
+					heapq.heappush(heap,(boxDistance(self.levels[lvl-1][0][j],p),next(cnt),lvl-1,j))
+
+	def arrays(self, prefix=''):
+		"""
+		Return the arrays describing the tree (see fromArrays), keys prefixed by prefix
+		"""
+		d={prefix+'boxes':self.boxes,prefix+'order':self.order,prefix+'M':np.array(self.M)}
+		for i,(box,start,end) in enumerate(self.levels):
+			d[prefix+'box%i'%i]=box
+			d[prefix+'start%i'%i]=start
+			d[prefix+'end%i'%i]=end
+		return d
+
+	def fromArrays(self, d, prefix=''):
+		self.boxes=d[prefix+'boxes']
+		self.order=d[prefix+'order']
+		self.M=int(d[prefix+'M'])
+		self.levels=[]
+		i=0
+		while prefix+'box%i'%i in d:
+			self.levels.append((d[prefix+'box%i'%i],d[prefix+'start%i'%i],d[prefix+'end%i'%i]))
+			i+=1
+		return self
+
+def elementBoxes(lib, name, bboxes):
+	"""
+	Return the bounding boxes (n,4) of all the elements of the structure name
+	(paths extended by half their width, references by the box of their child, NaN if empty)
+	"""
+	t=lib.getTable(name)
+	n=len(t)
+	boxes=np.full((n,4),np.nan)
+	kind=t.column('kind')
+	sel=np.nonzero(~np.isin(kind,(gdsflat.SREF,gdsflat.AREF)))[0]
+	sel=sel[t.column('nxy')[sel]>0]
+	if len(sel):
+		pts,starts=t.getPoints(sel)
+		hw=(np.abs(t.column('width')[sel])/2.0)[:,None]
+		boxes[sel,:2]=np.minimum.reduceat(pts,starts[:-1])-hw
+		boxes[sel,2:]=np.maximum.reduceat(pts,starts[:-1])+hw
+	for i in np.nonzero(np.isin(kind,(gdsflat.SREF,gdsflat.AREF)))[0]:
+		c=bboxes.get(t.sname[i])
+		if c is None: continue
+		L=gdsflat.refMatrix(t.strans[i],t.mag[i],t.angle[i])
+		xy=t.getXY(i)
+		if kind[i]==gdsflat.AREF:
+			trs=gdsflat.arefTranslations(xy,t.cols[i],t.rows[i])
+		else:
+			trs=xy[:2].reshape(1,2)
+		boxes[i]=gdsflat.transformBBox(c,L,trs)
+	return boxes
+
+def invert(T):
+	return np.linalg.inv(T)
+
+def windowIn(T, w):
+	"""
+	Return the bounding box, in the coordinates of a child, of the window w given in the
+	parent coordinates, T being the 3x3 child -> parent transformation
+	"""
+	Ti=invert(T)
+	c=np.array([[w[0],w[1],1],[w[0],w[3],1],[w[2],w[1],1],[w[2],w[3],1]]).dot(Ti.T)
+	return c[:,:2].min(axis=0).tolist()+c[:,:2].max(axis=0).tolist()
+
+def refTransforms(t, i):
+	"""
+	Return the list of the 3x3 child -> parent transformations of the instances of the reference i
+	"""
+	L=gdsflat.refMatrix(t.strans[i],t.mag[i],t.angle[i])
+	xy=t.getXY(i)
+	if t.kind[i]==gdsflat.AREF:
+		trs=gdsflat.arefTranslations(xy,t.cols[i],t.rows[i])
+	else:
+		trs=xy[:2].reshape(1,2).astype(np.float64)
+	T=np.zeros((len(trs),3,3))
+	T[:,:2,:2]=L
+	T[:,:2,2]=trs
+	T[:,2,2]=1
+	return T
+
+# Candidates of HierIndex.nearest
+ELEMENT=0
+REFERENCE=1
+STRUCTURE=2
+
+class HierIndex:
+	def __init__(self, lib, M=16):
+		"""
+		Spatial index of the structures of the library lib (gds.GDSII, gds.LazyLibrary, ...).
+		The RTree of a structure is built on first use from the bounding boxes of its elements
+		and references; queries descend into the references whose box meets the window.
+
+		Arguments:
+		----------
+		lib: the library (anything providing getTable(name))
+		M: the capacity of the nodes of the trees
+		"""
+		self.lib=lib
+		self.M=M
+		self.bboxes=gdsflat.BBoxes(lib)
+		self.trees={}
+
+	def getTree(self, name):
+		t=self.trees.get(name)
+		if t is None:
+			boxes=elementBoxes(self.lib,name,self.bboxes)
+			ok=~np.isnan(boxes[:,0])
+			t=RTree(boxes[ok],self.M)
+			t.ids=np.nonzero(ok)[0]
+			self.trees[name]=t
+		return t
+
+	def query(self, name, w, T=None):
+		"""
+		Return the elements of the structure name (hierarchy included) whose box meets
+		the window w=[xmin,ymin,xmax,ymax], as a list of (structure, element index, T)
+		where T is the 3x3 transformation from the structure to the coordinates of name.
+		"""
+		if T is None:
+			T=np.eye(3)
+		r=[]
+		tree=self.getTree(name)
+		t=self.lib.getTable(name)
+		wl=windowIn(T,w)
+		for i in tree.ids[tree.query(wl)]:
+			if t.kind[i] in (gdsflat.SREF,gdsflat.AREF):
+				child=self.bboxes.get(t.sname[i])
+				Ts=refTransforms(t,i)
+				if len(Ts)>1:
+					# Keep the instances of the array whose box meets the window
+					trs=Ts[:,:2,2]
+					b=gdsflat.transformBBox(child,Ts[0][:2,:2],np.zeros((1,2)))
+					m=(trs[:,0]+b[0]<=wl[2])&(trs[:,0]+b[2]>=wl[0])&(trs[:,1]+b[1]<=wl[3])&(trs[:,1]+b[3]>=wl[1])
+					Ts=Ts[m]
+				for Tc in Ts:
+					r+=self.query(t.sname[i],w,T.dot(Tc))
+			else:
+				r.append((name,int(i),T))
+		return r
+
+	def window(self, name, w):
+		"""
+		Return the elements of the structure name meeting the window w as a gdsflat.Flat
+		in the coordinates of name
+		"""
+		blocks=[]
+		for s,i,T in self.query(name,w):
+			t=self.lib.getTable(s)
+			if t.kind[i] not in (gdsflat.BOUNDARY,gdsflat.PATH,gdsflat.BOX):
+				continue
+			pts=t.getXY(i).reshape(-1,2).dot(T[:2,:2].T)+T[:2,2]
+			w=t.width[i]
+			if w>0:
+				w*=abs(np.linalg.det(T[:2,:2]))**.5
+			blocks.append(gdsflat.Flat(np.array([t.kind[i]]),np.array([t.layer[i]]),np.array([t.datatype[i]]),
+				np.array([w],dtype=np.float64),np.array([t.loop[i]]),pts,np.array([0,len(pts)])))
+		return gdsflat.concat(blocks)
+
+	def nearest(self, name, p, k=1):
+		"""
+		Return the k elements of the structure name (hierarchy included) whose boxes are the
+		nearest to the point p, as a list of (distance, structure, element index, T).
+		The trees of the placed structures and the instances of the references are walked lazily:
+		each source of candidates (see candidates and instances) stays on the heap with its next
+		candidate, which is never nearer than the ones before.
+		"""
+		cnt=itertools.count()
+		heap=[]
+		def push(gen):
+			for d,item in gen:
+				heapq.heappush(heap,(d,next(cnt),item,gen))
+				return
+		push(iter([(0.0,(STRUCTURE,name,np.eye(3),None))]))
+		r=[]
+		while heap and len(r)<k:
+			d,c,(what,s,T,i),gen=heapq.heappop(heap)
+			push(gen)
+			if what==ELEMENT:
+				r.append((d,s,i,T))
+			elif what==STRUCTURE:
+				push(self.candidates(s,T,p))
+			else:
+				push(self.instances(s,T,i,p))
+		return r
+
+	def candidates(self, s, T, p):
+		"""
+		Iterate over the elements and references of the structure s placed with T (3x3) by increasing
+		distance of their boxes to p, as (distance, (ELEMENT or REFERENCE, s, T, element index))
+		"""
+		tree=self.getTree(s)
+		t=self.lib.getTable(s)
+		pl=np.linalg.inv(T).dot([p[0],p[1],1])[:2]
+		scale=abs(np.linalg.det(T[:2,:2]))**.5
+		for dl,j in tree.iterNearest(pl):
+			j=int(tree.ids[j])
+			what=REFERENCE if t.kind[j] in (gdsflat.SREF,gdsflat.AREF) else ELEMENT
+			yield dl*scale,(what,s,T,j)
+
+	def instances(self, s, T, i, p):
+		"""
+		Iterate over the instances of the reference i of the structure s placed with T by increasing
+		distance of their boxes to p, as (distance, (STRUCTURE, child, transformation, None))
+		"""
+		t=self.lib.getTable(s)
+		child=self.bboxes.get(t.sname[i])
+		if child is None:
+			return
+		Ts=refTransforms(t,i)
+		pl=np.linalg.inv(T).dot([p[0],p[1],1])[:2]
+		scale=abs(np.linalg.det(T[:2,:2]))**.5
+		# Boxes of the instances in the coordinates of s
+		b=np.array(gdsflat.transformBBox(child,Ts[0][:2,:2],np.zeros((1,2))))
+		trs=Ts[:,:2,2]
+		d=boxDistances(b+np.concatenate([trs,trs],axis=1),pl)*scale
+		for j in np.argsort(d,kind='stable'):
+			yield float(d[j]),(STRUCTURE,t.sname[i],T.dot(Ts[j]),None)
+
+	def save(self, path):
+		"""
+		Save the trees built so far next to the GDSII file path (path.rtree.npz)
+		"""
+		d={}
+		names=list(self.trees)
+		for k,n in enumerate(names):
+			d.update(self.trees[n].arrays('t%i_'%k))
+			d['t%i_ids'%k]=self.trees[n].ids
+		st=os.stat(path)
+		d['names']=np.array(names,dtype=str)
+		d['stat']=np.array([st.st_size,st.st_mtime_ns],dtype=np.int64)
+		with open(path+".rtree.npz","wb") as f:
+			np.savez(f,**d)
+
+	def load(self, path):
+		"""
+		Load the trees saved by save. Return False if missing, corrupt or out of date.
+		"""
+		try:
+			d=dict(np.load(path+".rtree.npz"))
+			st=os.stat(path)
+			if d['stat'].tolist()!=[st.st_size,st.st_mtime_ns]:
+				return False
+			trees={}
+			for k,n in enumerate(d['names'].tolist()):
+				t=RTree(M=self.M).fromArrays(d,'t%i_'%k)
+				t.ids=d['t%i_ids'%k]
+				trees[n]=t
+		except (IOError,EOFError,ValueError,KeyError,IndexError,zipfile.BadZipFile):
+			return False
+		self.trees.update(trees)
+		return True
+
+	def buildAll(self, names):
+		"""
+		Build the trees of the structures names and of all the structures reachable from them
+		"""
+		for n in names:
+			self.getTree(n)
+			t=self.lib.getTable(n)
+			children=set(x for x in t.sname if x is not None)-set(self.trees)
+			if children:
+				self.buildAll(sorted(children))
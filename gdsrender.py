@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# *-* coding: utf-8 *-*
+
+# Preview of a structure (hierarchy included) as SVG or as a NumPy raster
+#
+# The structure is flattened with gdsflat and the coordinates converted to pixels.
+# Elements smaller than a pixel are culled (drawn as single pixels in the rasters), the polygons
+# of a layer are merged in a single SVG path and the paths of a layer in one stroke per width.
+
+import numpy as np
+import gdsflat
+
+# Colors of the layers (cycled)
+COLORS=['#1f77b4','#ff7f0e','#2ca02c','#d62728','#9467bd','#8c564b','#e377c2','#7f7f7f','#bcbd22','#17becf']
+
+def layerColor(layer):
+	return COLORS[layer%len(COLORS)]
+
+def pathPolygons(pts, starts, widths):
+	"""
+	Return the quadrilaterals (points and starts) covering the segments of the paths
+	(pts, starts) of the given widths (same units as pts)
+	"""
+	n=np.diff(starts)
+	seg=np.ones(len(pts),dtype=bool)
+	seg[starts[1:]-1]=False
+	i=np.nonzero(seg)[0]
+	a=pts[i]
+	b=pts[i+1]
+	w=np.repeat(widths,n)[i]/2.0
+	d=b-a
+	l=np.hypot(d[:,0],d[:,1])
+	l[l==0]=1
+	nrm=np.stack([-d[:,1],d[:,0]],axis=1)/l[:,None]*w[:,None]
+	quads=np.stack([a+nrm,b+nrm,b-nrm,a-nrm,a+nrm],axis=1).reshape(-1,2)
+	return quads,np.arange(0,len(quads)+1,5)
+
+def fillPolygons(pts, starts, shape):
+	"""
+	Return the boolean (H,W) raster of the polygons (pts in pixels, starts) with the even-odd rule,
+	the pixels whose centre is inside a polygon are set.
+	"""
+	H,W=shape
+	mask=np.zeros((H,W+1),dtype=np.int32)
+	if len(starts)<2:
+		return mask[:,:W]>0
+	poly=np.repeat(np.arange(len(starts)-1),np.diff(starts))
+	seg=np.ones(len(pts),dtype=bool)
+	seg[starts[1:]-1]=False
+	i=np.nonzero(seg)[0]
+	x0,y0=pts[i,0],pts[i,1]
+	x1,y1=pts[i+1,0],pts[i+1,1]
+	poly=poly[i]
+	# Rows whose centre r+0.5 is in [min(y0,y1),max(y0,y1))
+	r0=np.clip(np.ceil(np.minimum(y0,y1)-0.5),0,H).astype(np.int64)
+	r1=np.clip(np.ceil(np.maximum(y0,y1)-0.5),0,H).astype(np.int64)
+	cnt=r1-r0
+	k=cnt>0
+	x0,y0,x1,y1,poly,r0,cnt=x0[k],y0[k],x1[k],y1[k],poly[k],r0[k],cnt[k]
+	if len(cnt)==0:
+		return mask[:,:W]>0
+	offs=np.zeros(len(cnt),dtype=np.int64)
+	np.cumsum(cnt[:-1],out=offs[1:])
+	e=np.repeat(np.arange(len(cnt)),cnt)
+	row=np.arange(cnt.sum())-np.repeat(offs,cnt)+r0[e]
+	t=(row+0.5-y0[e])/(y1[e]-y0[e])
+	x=x0[e]+t*(x1[e]-x0[e])
+	o=np.lexsort((x,row,poly[e]))
+	x=x[o]
+	row=row[o]
+	# Consecutive crossings of a polygon on a row delimit the spans
+	a=np.clip(np.ceil(x[0::2]-0.5),0,W).astype(np.int64)
+	b=np.clip(np.ceil(x[1::2]-0.5),0,W).astype(np.int64)
+	r=row[0::2]
+	np.add.at(mask,(r,a),1)
+	np.add.at(mask,(r,b),-1)
+	return np.cumsum(mask,axis=1)[:,:W]>0
+
+class Renderer:
+	def __init__(self, lib, name, width=1024, height=None, box=None, kinds=(gdsflat.BOUNDARY,gdsflat.PATH,gdsflat.BOX)):
+		"""
+		Preview of the structure name of the library lib (hierarchy included).
+
+		Arguments:
+		----------
+		lib: the library (gds.GDSII, gds.LazyLibrary, ... see gdsflat)
+		name: the structure drawn
+		width: the width of the image in pixels
+		height: the height of the image in pixels (default: keep the aspect ratio)
+		box: the window drawn [xmin,ymin,xmax,ymax] (default: the whole structure)
+		kinds: the elements drawn (BOUNDARY, PATH, BOX)
+		"""
+		self.flat=gdsflat.flatten(lib,name,kinds)
+		f=self.flat
+		if len(f):
+			s=f.starts[:-1]
+			hw=(np.abs(f.width)/2.0)[:,None]*(f.kind==gdsflat.PATH)[:,None]
+			self.boxes=np.concatenate([np.minimum.reduceat(f.pts,s)-hw,np.maximum.reduceat(f.pts,s)+hw],axis=1)
+		else:
+			self.boxes=np.zeros((0,4))
+		if box is None:
+			box=[0,0,1,1] if len(f)==0 else self.boxes[:,:2].min(axis=0).tolist()+self.boxes[:,2:].max(axis=0).tolist()
+		self.box=list(map(float,box))
+		w=max(self.box[2]-self.box[0],1e-9)
+		h=max(self.box[3]-self.box[1],1e-9)
+		if height is None:
+			self.scale=width/w
+			height=max(1,int(np.ceil(h*self.scale)))
+		else:
+			self.scale=min(width/w,height/h)
+		self.width=int(width)
+		self.height=int(height)
+
+	def toPixels(self, pts):
+		"""
+		Convert the points (database units) to pixels (origin at the top left corner)
+		"""
+		p=np.empty((len(pts),2))
+		p[:,0]=(pts[:,0]-self.box[0])*self.scale
+		p[:,1]=(self.box[3]-pts[:,1])*self.scale
+		return p
+
+	def visible(self):
+		"""
+		Return the mask of the elements in the window and of the elements at least one pixel wide or high
+		"""
+		b=self.boxes
+		B=self.box
+		inside=(b[:,0]<=B[2])&(b[:,2]>=B[0])&(b[:,1]<=B[3])&(b[:,3]>=B[1])
+		big=np.maximum(b[:,2]-b[:,0],b[:,3]-b[:,1])*self.scale>=1
+		return inside&big,inside&~big
+
+	def layers(self, sel):
+		return sorted(set(self.flat.layer[sel].tolist()))
+
+	def svg(self, f, opacity=0.5):
+		"""
+		Write the SVG preview to f (path or text file object). One path per layer for the
+		polygons and one per layer and width for the paths, coordinates rounded to 0.1 pixel.
+		The elements smaller than a pixel are merged into the pixels they fall in.
+		"""
+		if isinstance(f,str):
+			with open(f,"w") as ff:
+				return self.svg(ff,opacity)
+		big,small=self.visible()
+		sub=self.flat.take(np.nonzero(big)[0])
+		out=['<svg xmlns="http://www.w3.org/2000/svg" width="%i" height="%i" viewBox="0 0 %i %i">\n'%(self.width,self.height,self.width,self.height)]
+		for layer in self.layers(big|small):
+			c=layerColor(layer)
+			sel=np.nonzero(small&(self.flat.layer==layer))[0]
+			if len(sel):
+				# The elements smaller than a pixel are drawn as the pixels of their centres
+				p=self.toPixels((self.boxes[sel,:2]+self.boxes[sel,2:])/2).astype(np.int64)
+				p=np.unique(p[:,::-1],axis=0)
+				# Runs of consecutive pixels of a row
+				new=np.ones(len(p),dtype=bool)
+				new[1:]=(p[1:,0]!=p[:-1,0])|(p[1:,1]!=p[:-1,1]+1)
+				i=np.nonzero(new)[0]
+				n=np.diff(np.append(i,len(p)))
+				out.append('<path fill="%s" fill-opacity="%g" stroke="none" d="%s"/>\n'%(c,opacity,"".join("M%i,%ih%iv1h-%iZ"%(x,y,k,k) for (y,x),k in zip(p[i].tolist(),n.tolist()))))
+			sel=np.nonzero((sub.layer==layer)&(sub.kind!=gdsflat.PATH))[0]
+			if len(sel):
+				out.append('<path fill="%s" fill-opacity="%g" stroke="none" d="%s"/>\n'%(c,opacity,self.pathData(sub.take(sel),True)))
+			sel=np.nonzero((sub.layer==layer)&(sub.kind==gdsflat.PATH))[0]
+			if len(sel):
+				w=np.maximum(np.round(np.abs(sub.width[sel])*self.scale,1),1)
+				for ww in np.unique(w):
+					s=sel[w==ww]
+					out.append('<path fill="none" stroke="%s" stroke-opacity="%g" stroke-width="%g" stroke-linejoin="round" d="%s"/>\n'%(c,opacity,ww,self.pathData(sub.take(s),False)))
+		out.append('</svg>\n')
+		f.write("".join(out))
+
+	def pathData(self, flat, closed):
+		"""
+		Return the SVG path data of the elements of flat (consecutive duplicate points removed)
+		"""
+		p=np.round(self.toPixels(flat.pts),1)
+		starts=flat.starts
+		keep=np.ones(len(p),dtype=bool)
+		keep[1:]=(p[1:]!=p[:-1]).any(axis=1)
+		keep[starts[:-1]]=True
+		p=p[keep]
+		starts=np.concatenate([[0],np.cumsum(keep)[starts[1:]-1]])
+		xy=["%g,%g"%(x,y) for x,y in p.tolist()]
+		for i in starts[:-1].tolist():
+			xy[i]="M"+xy[i]
+		if closed:
+			for i in (starts[1:]-1).tolist():
+				xy[i]+="Z"
+		return " ".join(xy)
+
+	def raster(self, layers=None):
+		"""
+		Return the dictionary layer -> boolean (H,W) raster of the elements of the layer.
+		The elements smaller than a pixel set the pixel of their centre.
+		"""
+		big,small=self.visible()
+		f=self.flat
+		r={}
+		for layer in self.layers(big|small):
+			if layers is not None and layer not in layers:
+				continue
+			on=f.layer==layer
+			parts=[]
+			sel=np.nonzero(big&on&(f.kind!=gdsflat.PATH))[0]
+			if len(sel):
+				s=f.take(sel)
+				parts.append((self.toPixels(s.pts),s.starts))
+			sel=np.nonzero(big&on&(f.kind==gdsflat.PATH))[0]
+			if len(sel):
+				s=f.take(sel)
+				parts.append(pathPolygons(self.toPixels(s.pts),s.starts,np.maximum(np.abs(s.width)*self.scale,1)))
+			if parts:
+				pts=np.concatenate([p for p,s in parts])
+				offs=np.cumsum([0]+[len(p) for p,s in parts])
+				starts=np.concatenate([s[:-1]+o for (p,s),o in zip(parts,offs)]+[[offs[-1]]])
+				m=fillPolygons(pts,starts,(self.height,self.width))
+			else:
+				m=np.zeros((self.height,self.width),dtype=bool)
+			sel=np.nonzero(small&on)[0]
+			if len(sel):
+				c=self.toPixels((self.boxes[sel,:2]+self.boxes[sel,2:])/2)
+				i=np.clip(c[:,1].astype(np.int64),0,self.height-1)
+				j=np.clip(c[:,0].astype(np.int64),0,self.width-1)
+				m[i,j]=True
+			r[layer]=m
+		return r
+
+	def image(self, opacity=0.5):
+		"""
+		Return the RGB (H,W,3) uint8 image of the layers blended over a white background
+		"""
+		img=np.ones((self.height,self.width,3))
+		for layer,m in sorted(self.raster().items()):
+			c=np.array([int(layerColor(layer)[i:i+2],16)/255.0 for i in (1,3,5)])
+			img[m]=img[m]*(1-opacity)+c*opacity
+		return (img*255).round().astype(np.uint8)
+
+def svg(lib, name, f, width=1024, **kargs):
+	"""
+	Write the SVG preview of the structure name of lib to f (see Renderer)
+	"""
+	Renderer(lib,name,width,**kargs).svg(f)
+
+def raster(lib, name, width=1024, **kargs):
+	"""
+	Return the rasters per layer of the structure name of lib (see Renderer.raster)
+	"""
+	return Renderer(lib,name,width,**kargs).raster()
@@ -68,15 +68,16 @@ StepsizeV=W:50,VISIBLE,!SHOWDIM
 		for xx in x:
 			self.x0[xx]=x[xx]
 	def AddStruct(self,x,area):
+		# area is the boundary [xmin,ymin,xmax,ymax] of the structure (see gds.GDSII.getArea)
 		x['id']=self.id
 		self.id+=1
 		for k in self.x0:
 			if not k in x:
 				x[k]=self.x0[k]
 		if x['Vsize']==0:
-			x['Vsize']=area[3]/1000.0
+			x['Vsize']=(area[3]-area[1])/1000.0
 		if x['Usize']==0:
-			x['Usize']=area[2]/1000.0
+			x['Usize']=(area[2]-area[0])/1000.0
 		self.f.write(self.dataLine%x)
 	def close(self):
 		self.f.close()